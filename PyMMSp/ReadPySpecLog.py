@@ -2,137 +2,185 @@
 """ This script is used to scan through the log files generated by
 PyMMSp.py, and read out fitting parameters. Alternatively, it can also
 generate an artificial spectra convolved with Gaussian with all fitting
-parameters read. """
+parameters read.
+
+    python -m PyMMSp.ReadPySpecLog Fit*.log -o summary.csv
+    python -m PyMMSp.ReadPySpecLog Fit*.log -spectra --resol 0.1
+"""
 
 import re
+import csv
 import argparse
 import numpy as np
 from math import pi
+from scipy.signal import oaconvolve
+from scipy.special import ndtr
+
+# parameter line of sflib.save_log, e.g. 'mu        240012.345678 (0.001234)'
+_PAR_RE = re.compile(r'(\D{5}) *(-?\d+\.\d+|-?inf|nan) \((\d+\.\d+|inf|nan)\)')
+SUMMARY_FIELDS = ('filename', 'mu', 'err_mu', 'sigma', 'err_sigma', 'A', 'err_A')
+
 
 def g(x, mu, sigma, a):
     """ Gaussian function """
     return abs(a)/(np.sqrt(2*pi)*sigma)*np.exp(-(x-mu)**2/(2*sigma**2))
 
+
 def regulate(x, y, resol=0.05, rescale_x=0.01):
-    """ Regulate x points into a fixed step size and sum up y value. """
+    """ Regulate x points into a fixed step size and average the y values
+    that fall into the same step. """
     # calculate number of steps from start point, round to integer
     step_num = np.ceil((x - np.amin(x))/resol)
-    # find unique values of x and corresponding index
-    x_reg, x_unique_idx = np.unique(step_num, return_index=True)
+    # unique steps, and the step of each point
+    x_reg, inv, counts = np.unique(step_num, return_inverse=True, return_counts=True)
     x_reg = np.amin(x) + x_reg*resol
-    y_reg = np.array([])
-    # count for occurance
-    x_occurance = np.append(np.diff(x_unique_idx), len(x)-x_unique_idx[-1])
-    # extract y values at each unique x point
-    for i in range(len(x_unique_idx)):
-        xid_start = x_unique_idx[i]
-        xid_end = xid_start + x_occurance[i]
-        y_reg = np.append(y_reg, np.average(y[xid_start:xid_end]))
+    y_reg = np.bincount(inv.ravel(), weights=y)/counts
     return np.column_stack((x_reg*rescale_x, y_reg))
 
 
-# parse arguments
-parser = argparse.ArgumentParser(description=__doc__,
-                epilog='--- Luyao Zou @ https://github.com/luyaozou/ ---')
-parser.add_argument('log', nargs='+', help='List log files')
-parser.add_argument('-o', '--out', nargs=1, help='Specify output file name')
-parser.add_argument('-spectra', action='store_true',
-                    help="""Generate an artificial spectra convolved with
-                            Gaussian using all lines read in""")
-args = parser.parse_args()
-log_list = args.log
-
-if args.out:
-    out_name = args.out[0]
-else:
-    if args.spectra:
-        out_name = 'FitSimSpectra.txt'
-    else:
-        out_name = 'FitLogSummary.csv'
-
-# initialization
-mu = []
-sigma = []
-a = []
-err_mu = []
-err_sigma = []
-err_a = []
-snr = []
-file_name = []
-
-for log_name in log_list:
+def iter_log(log_name):
+    """ Iterate over the lines of a log file, without loading the whole file.
+    A parameter set is complete when its mu, width and A are read.
+    Yields
+        (mu, err_mu, sigma, err_sigma, A, err_A)
+    """
+
+    par = {}
     with open(log_name, 'r') as log_file:
-        log_content = log_file.readlines()
-#        counter = 0
-        for log_line in log_content:
-            try:
-                parameters = re.match('(\D{5})[ ]*(-?\d+.\d+) \((\d+.\d+)\)',
-                                      log_line).groups()
-                if 'mu' in parameters[0]:
-                    mu.append(parameters[1])
-                    err_mu.append(parameters[2])
-                    file_name.append(log_name)
-                elif 'sigma' in parameters[0] or 'gamma' in parameters[0]:
-                    sigma.append(parameters[1])
-                    err_sigma.append(parameters[2])
-                elif 'A' in parameters[0]:
-                    a.append(parameters[1])
-                    err_a.append(parameters[2])
-                else:
-                    pass
-            except AttributeError:
-                pass
-# Don't need snr anymore. It's not realiable
-#            try:
-#                snr_max = re.match('max\(SnR\) = (\d+.\d+)', log_line).group(1)
-#            except AttributeError:
-#                pass
-#        for k in range(counter):
-#            snr.append(snr_max)
-
-line_freq = np.array(mu, dtype=float)
-sort_idx = np.argsort(line_freq)
-
-# write summary file
-if not args.spectra:
-    # construct output table
-    out_tbl = []
-    for j in range(len(sort_idx)):
-        i = sort_idx[j]
-        row = ','.join([file_name[i], mu[i], err_mu[i], sigma[i],
-                        err_sigma[i], a[i], err_a[i]])
-        out_tbl.append(row)
-    with open(out_name, 'w') as out_file:
-        out_file.write(','.join(['filename', 'mu', 'err_mu', 'sigma',
-                                 'err_sigma', 'A', 'err_A\n']))
-        for row in out_tbl:
-            out_file.write(row+'\n')
-    print(out_name + ' saved!')
-# generate and save spectra
-else:
-    # claim fullx, fully
-    fullx = np.array([1], dtype=float)
-    fully = np.array([1], dtype=float)
-    for j in range(len(sort_idx)):
-        i = sort_idx[j]
-        # get +/- 10 sigma frequency window and 0.2 sigma resolution
-        window = 20*float(sigma[i])
-        resol = window/100
-        # create x-array w/ frequency resolution of 0.002 sigma
-        x = np.arange(100)*resol + line_freq[i] - window/2
-        # create y-array
-        y = g(x, line_freq[i], float(sigma[i]), float(a[i])/float(err_a[i]))
-        # append x, y to full array
-        fullx = np.append(fullx, x)
-        fully = np.append(fully, y)
-    # delete the first number of fullx and fully
-    fullx = np.delete(fullx, 0)
-    fully = np.delete(fully, 0)
-    sort_x_idx = np.argsort(fullx)
-    # regulate x points into 100kHz resolution
-    # & rescale x to 100MHz unit so the values are on the scale of MW data
-    out_tbl = regulate(fullx[sort_x_idx], fully[sort_x_idx],
-                       resol=0.1, rescale_x=0.01)
-    # save xy file
-    np.savetxt(out_name, out_tbl, delimiter=' ', fmt='%.6f')
+        for log_line in log_file:
+            m = _PAR_RE.match(log_line)
+            if not m:
+                continue
+            name, value, err = m.groups()
+            if 'mu' in name:
+                par = {'mu': (float(value), float(err))}
+            elif 'sigma' in name or 'gamma' in name:
+                par['sigma'] = (float(value), float(err))
+            elif 'A' in name:
+                par['A'] = (float(value), float(err))
+                if len(par) == 3:
+                    yield par['mu'] + par['sigma'] + par['A']
+                par = {}
+
+
+def read_logs(log_list):
+    """ Read the fitted lines of the log files
+    Returns
+        file_name: list of str, log file of each line
+        pars: np.array, shape (n, 6), columns (mu, err_mu, sigma, err_sigma, A, err_A),
+            sorted by mu
+    """
+
+    file_name = []
+    rows = []
+    for log_name in log_list:
+        for row in iter_log(log_name):
+            file_name.append(log_name)
+            rows.append(row)
+    pars = np.array(rows, dtype=float).reshape(-1, 6)
+    sort_idx = np.argsort(pars[:, 0], kind='stable')
+    return [file_name[i] for i in sort_idx], pars[sort_idx]
+
+
+def save_summary(out_name, file_name, pars):
+    """ Save the fitted lines in a csv table, columns SUMMARY_FIELDS """
+
+    with open(out_name, 'w', newline='') as out_file:
+        writer = csv.writer(out_file, lineterminator='\n')
+        writer.writerow(SUMMARY_FIELDS)
+        for name, row in zip(file_name, pars):
+            writer.writerow([name] + ['{:.6f}'.format(v) for v in row])
+
+
+def synth_spectrum(mu, sigma, a, resol=0.1, hw=10., width_tol=0.02):
+    """ Synthetic spectrum of Gaussian lines on a fixed grid.
+    The lines are put as sticks on the grid, and convolved with the Gaussian
+    of their width by FFT. The lines of widths within width_tol are convolved together.
+    Lines of zero width or of non finite area are skipped.
+    Arguments
+        mu, sigma, a: np.array, center, width and area of the lines
+        resol: float, grid step
+        hw: float, half width of the lines, in units of sigma
+        width_tol: float, relative width tolerance
+    Returns
+        x: np.array, the grid points within hw*sigma of a line, and next to the narrow lines
+        y: np.array
+    """
+
+    mu = np.asarray(mu, dtype=float)
+    sigma = np.abs(np.asarray(sigma, dtype=float))
+    a = np.abs(np.asarray(a, dtype=float))
+    is_ok = (sigma > 0) & np.isfinite(sigma) & np.isfinite(a) & np.isfinite(mu)
+    mu, sigma, a = mu[is_ok], sigma[is_ok], a[is_ok]
+    if not len(mu):
+        return np.array([]), np.array([])
+
+    # width class of each line, and its kernel half width in grid points
+    log_step = np.log1p(width_tol)
+    cls = np.floor(np.log(sigma)/log_step).astype(int)
+    max_khw = int(np.ceil(hw*np.exp((cls.max() + 1)*log_step)/resol))
+    # the grid is padded by the widest kernel
+    x0 = (np.floor(np.min(mu - hw*sigma)/resol) - max_khw)*resol
+    n = int(np.ceil((np.max(mu + hw*sigma) - x0)/resol)) + max_khw + 1
+    y = np.zeros(n)
+    # sticks shared by the 2 nearest grid points
+    pos = (mu - x0)/resol
+    idx = np.floor(pos).astype(int)
+    frac = pos - idx
+    for c in np.unique(cls):
+        sel = cls == c
+        s = np.exp((c + 0.5)*log_step)
+        khw = int(np.ceil(hw*s/resol))
+        i_lo = idx[sel].min()
+        n_stick = idx[sel].max() - i_lo + 2
+        stick = np.bincount(idx[sel] - i_lo, weights=a[sel]*(1 - frac[sel]), minlength=n_stick)
+        stick[1:] += np.bincount(idx[sel] - i_lo, weights=a[sel]*frac[sel], minlength=n_stick - 1)
+        # gaussian averaged over each grid step, so that the area is kept for the narrow lines
+        j = np.arange(-khw, khw + 1)
+        kernel = (ndtr((j + 0.5)*resol/s) - ndtr((j - 0.5)*resol/s))/resol
+        y[i_lo - khw:i_lo - khw + len(stick) + 2*khw] += oaconvolve(stick, kernel)
+
+    # keep the grid points covered by the lines, at least the 2 points of the stick
+    start = np.minimum(np.ceil((mu - hw*sigma - x0)/resol).astype(int), idx)
+    stop = np.maximum(np.floor((mu + hw*sigma - x0)/resol).astype(int) + 1, idx + 2)
+    coverage = np.cumsum(np.bincount(start, minlength=n + 1) - np.bincount(stop, minlength=n + 1))[:n]
+    is_covered = coverage > 0
+    return (x0 + resol*np.arange(n))[is_covered], y[is_covered]
+
+
+def main(argv=None):
+    # parse arguments
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog='--- Luyao Zou @ https://github.com/luyaozou/ ---')
+    parser.add_argument('log', nargs='+', help='List log files')
+    parser.add_argument('-o', '--out', nargs=1, help='Specify output file name')
+    parser.add_argument('-spectra', action='store_true',
+                        help="""Generate an artificial spectra convolved with
+                                Gaussian using all lines read in""")
+    parser.add_argument('--resol', type=float, default=0.1,
+                        help='frequency resolution of the artificial spectra, MHz')
+    args = parser.parse_args(argv)
+
+    if args.out:
+        out_name = args.out[0]
+    else:
+        if args.spectra:
+            out_name = 'FitSimSpectra.txt'
+        else:
+            out_name = 'FitLogSummary.csv'
+
+    file_name, pars = read_logs(args.log)
+    if not args.spectra:
+        save_summary(out_name, file_name, pars)
+    else:
+        # line intensity weighted by its SnR, A/err_A
+        with np.errstate(invalid='ignore', divide='ignore'):
+            snr = pars[:, 4]/pars[:, 5]
+        x, y = synth_spectrum(pars[:, 0], pars[:, 2], snr, resol=args.resol)
+        # rescale x to 100MHz unit so the values are on the scale of MW data
+        np.savetxt(out_name, np.column_stack((x*0.01, y)), delimiter=' ', fmt='%.6f')
     print(out_name + ' saved!')
+
+
+if __name__ == '__main__':
+    main()
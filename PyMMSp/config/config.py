@@ -69,6 +69,10 @@ class Prefs:
     tmp_dir: str = str(TEMP_DIR)
 
 
+# file formats of the absorption scan data
+DATA_FORMATS = ('.dat', '.lwa', '.spb')
+
+
 @dataclass
 class AbsScanSetting:
     """ Absorption scan settings """
@@ -88,3 +92,14 @@ class AbsScanSetting:
     is_press: bool = True
     press: float = 0
     press_tol: float = 0
+    is_lockin_buffer: bool = False
+    sample_rate_idx: int = 13
+    is_list_sweep: bool = False
+    is_multi_sweep: bool = False
+    reject_thresh: float = 0
+    stop_err: float = 0
+    octave_idx: int = 0
+    is_auto_dwell: bool = False
+    settle_tol: float = 0.01
+    is_watch_settle: bool = False
+    file_fmt: str = '.dat'
@@ -22,15 +22,18 @@ class CtrlFlow(QtWidgets.QWidget):
         self.h = h
         self.panel_cfg = panel_cfg
 
-        ui.dFlow.btnGroup.idClicked[int].connect(self._commit_mks_general)
-        ui.dFlow.boxChn1.btnGroup.idClicked[int].connect(self._commit_mks_chn1)
-        ui.dFlow.boxChn2.btnGroup.idClicked[int].connect(self._commit_mks_chn2)
-        ui.dFlow.btnRefresh.clicked.connect(self._refresh_all_mks_setting)
-        ui.dFlow.boxChn1.btnZero.clicked.connect(lambda: self._zero_mks_chn(1))
-        ui.dFlow.boxChn2.btnZero.clicked.connect(lambda: self._zero_mks_chn(2))
-        ui.dFlow.btnGCF.clicked.connect(ui.dGCF.show)
-        ui.dFlow.btnGCF.clicked.connect(ui.dGCF.raise_)
-        ui.dGCF.sig_calc_gcf.connect(self._calc_gcf)
+        ui.on_dialog('dFlow', self._connect_flow_dialog)
+        ui.on_dialog('dGCF', lambda d: d.sig_calc_gcf.connect(self._calc_gcf))
+
+    def _connect_flow_dialog(self, d):
+        d.btnGroup.idClicked[int].connect(self._commit_mks_general)
+        d.boxChn1.btnGroup.idClicked[int].connect(self._commit_mks_chn1)
+        d.boxChn2.btnGroup.idClicked[int].connect(self._commit_mks_chn2)
+        d.btnRefresh.clicked.connect(self._refresh_all_mks_setting)
+        d.boxChn1.btnZero.clicked.connect(lambda: self._zero_mks_chn(1))
+        d.boxChn2.btnZero.clicked.connect(lambda: self._zero_mks_chn(2))
+        d.btnGCF.clicked.connect(lambda: self.ui.dGCF.show())
+        d.btnGCF.clicked.connect(lambda: self.ui.dGCF.raise_())
 
     def closeEvent(self, ev):
         self._timer.stop()
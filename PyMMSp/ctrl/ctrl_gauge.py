@@ -3,7 +3,6 @@
 from PyQt6 import QtWidgets, QtCore
 import numpy as np
 import datetime
-import pyvisa
 from PyMMSp.ui import ui_shared
 from PyMMSp.inst import gauge as api_gauge
 from PyMMSp.inst import validator as api_val
@@ -27,18 +26,6 @@ class CtrlGauge(QtWidgets.QWidget):
         self.wait_time = 1
         self.timer = QtCore.QTimer()
         self.timer.setInterval(1000)
-        self.timer.start()
-
-        # trigger settings
-        self.ui.dGauge.channelSel.activated.connect(self.set_channel)
-        self.ui.dGauge.updateRate.textChanged.connect(self.set_update_period)
-        self.ui.dGauge.updateRateUnitSel.activated.connect(self.protect_update_period)
-        self.ui.dGauge.pUnitSel.activated.connect(self.protect_p_unit)
-        self.ui.dGauge.startButton.clicked.connect(self.start)
-        self.ui.dGauge.stopButton.clicked.connect(self.stop)
-        self.ui.dGauge.saveButton.clicked.connect(self.save)
-        self.ui.dGauge.savepButton.clicked.connect(self.save_and_continue)
-        self.ui.dGauge.finished.connect(self.timer.stop)
         self.timer.timeout.connect(self.daq)
         self._data_collecting = False
         self._counter = 0
@@ -49,9 +36,29 @@ class CtrlGauge(QtWidgets.QWidget):
         self._current_chn_idx = 0
         self._current_p_unit_idx = 0
         self._current_p = 0
+        self.ui.on_dialog('dGauge', self._connect_dialog)
+
+    def _connect_dialog(self, d):
+
+        # trigger settings
+        d.channelSel.activated.connect(self.set_channel)
+        d.updateRate.textChanged.connect(self.set_update_period)
+        d.updateRateUnitSel.activated.connect(self.protect_update_period)
+        d.pUnitSel.activated.connect(self.protect_p_unit)
+        d.startButton.clicked.connect(self.start)
+        d.stopButton.clicked.connect(self.stop)
+        d.saveButton.clicked.connect(self.save)
+        d.savepButton.clicked.connect(self.save_and_continue)
+        d.finished.connect(self.timer.stop)
         # set default unit
         self.set_p_unit()
 
+    def on_connect(self, handle):
+        """ Start polling the gauge once it is connected """
+
+        self.handle = handle
+        self.timer.start()
+
     def start(self):
 
         # avoid connecting to the timer multiple times
@@ -222,9 +229,12 @@ class CtrlGauge(QtWidgets.QWidget):
         else:
             msg_code, status_txt, self._current_p = api_gauge.query_p(
                 self.handle, self.ui.dGauge.channelSel.currentText())
-        self.ui.dGauge.currentP.setText('{:.3e}'.format(self._current_p))
-        self.ui.dGauge.currentStatus.setText(status_txt)
-        self.ui.dGauge.currentStatus.setStyleSheet(f'color: {ui_shared.msg_color(msg_code)}')
+        # the readings are displayed in the gauge dialog, do not build it just for them
+        d = self.ui.built_dialog('dGauge')
+        if d is not None:
+            d.currentP.setText('{:.3e}'.format(self._current_p))
+            d.currentStatus.setText(status_txt)
+            d.currentStatus.setStyleSheet(f'color: {ui_shared.msg_color(msg_code)}')
 
         if not msg_code:  # if fatal, stop daq
             self.timer.stop()
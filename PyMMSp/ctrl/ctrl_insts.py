@@ -4,6 +4,9 @@ from PyMMSp.inst.base import INST_TYPES, INST_MODEL_DICT
 
 class CtrlInsts(QtWidgets.QWidget):
 
+    # inst_type, after the instrument is connected
+    sig_inst_connected = QtCore.pyqtSignal(str)
+
     def __init__(self, prefs, ui, inst_handles, parent=None):
         super().__init__(parent)
 
@@ -11,18 +14,21 @@ class CtrlInsts(QtWidgets.QWidget):
         self.ui = ui
         self.inst_handles = inst_handles
 
-        # define and link instrument selection & configuration dialog behavior
-        self.ui.dConnInst.dIndvInst.accepted.connect(self.on_config_indv_inst_accepted)
-        self.ui.dConnInst.accepted.connect(self.on_sel_inst_dialog_accepted)
+        self.ui.on_dialog('dConnInst', self._connect_dialog)
+
+    def _connect_dialog(self, d):
+        """ Define and link instrument selection & configuration dialog behavior """
+        d.dIndvInst.accepted.connect(self.on_config_indv_inst_accepted)
+        d.accepted.connect(self.on_sel_inst_dialog_accepted)
         # the linked names should agree with the names in the INST_MODEL_DICT
-        self.ui.dConnInst.btnSyn.clicked.connect(lambda: self.on_inst_btn_clicked('Synthesizer'))
-        self.ui.dConnInst.btnLockin.clicked.connect(lambda: self.on_inst_btn_clicked('Lock-in'))
-        self.ui.dConnInst.btnAWG.clicked.connect(lambda: self.on_inst_btn_clicked('AWG'))
-        self.ui.dConnInst.btnOscillo.clicked.connect(lambda: self.on_inst_btn_clicked('Oscilloscope'))
-        self.ui.dConnInst.btnUCA.clicked.connect(lambda: self.on_inst_btn_clicked('Power Supply'))
-        self.ui.dConnInst.btnFlow.clicked.connect(lambda: self.on_inst_btn_clicked('Flow Controller'))
-        self.ui.dConnInst.btnGauge1.clicked.connect(lambda: self.on_inst_btn_clicked('Gauge Controller 1'))
-        self.ui.dConnInst.btnGauge2.clicked.connect(lambda: self.on_inst_btn_clicked('Gauge Controller 2'))
+        d.btnSyn.clicked.connect(lambda: self.on_inst_btn_clicked('Synthesizer'))
+        d.btnLockin.clicked.connect(lambda: self.on_inst_btn_clicked('Lock-in'))
+        d.btnAWG.clicked.connect(lambda: self.on_inst_btn_clicked('AWG'))
+        d.btnOscillo.clicked.connect(lambda: self.on_inst_btn_clicked('Oscilloscope'))
+        d.btnUCA.clicked.connect(lambda: self.on_inst_btn_clicked('Power Supply'))
+        d.btnFlow.clicked.connect(lambda: self.on_inst_btn_clicked('Flow Controller'))
+        d.btnGauge1.clicked.connect(lambda: self.on_inst_btn_clicked('Gauge Controller 1'))
+        d.btnGauge2.clicked.connect(lambda: self.on_inst_btn_clicked('Gauge Controller 2'))
 
     def on_inst_btn_clicked(self, inst_name):
         self.ui.dConnInst.dIndvInst.setWindowTitle('Configure ' + inst_name)
@@ -43,6 +49,8 @@ class CtrlInsts(QtWidgets.QWidget):
         except (ValueError, ConnectionError) as e:
             self.ui.msgErr.setText(str(e))
             self.ui.msgErr.exec()
+        else:
+            self.sig_inst_connected.emit(inst_type)
         self.ui.dConnInst.dIndvInst.accept()
         self.refresh(inst_type)
 
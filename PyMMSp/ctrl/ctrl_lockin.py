@@ -2,10 +2,12 @@
 
 from PyQt6 import QtWidgets, QtCore
 import numpy as np
-import pyvisa
 from PyMMSp.ui import ui_shared
 from PyMMSp.inst import lockin as api_lia
 from PyMMSp.inst import validator as api_val
+from PyMMSp.libs.common import lazy_import
+
+pyvisa = lazy_import('pyvisa')
 
 
 class CtrlLockin(QtWidgets.QWidget):
@@ -39,8 +41,8 @@ class CtrlLockin(QtWidgets.QWidget):
         self.ui.liaStatus.clicked.connect(self.check)
         self.ui.liaStatus.errMsgBtn.clicked.connect(self.pop_err_msg)
         self.ui.liaStatus.refreshButton.clicked.connect(self.manual_refresh)
-        self.ui.liaStatus.moreInfoButton.clicked.connect(self.ui.dLockin.show)
-        self.ui.dLockin.refreshButton.clicked.connect(self.dialog_manual_refresh)
+        self.ui.liaStatus.moreInfoButton.clicked.connect(lambda: self.ui.dLockin.show())
+        self.ui.on_dialog('dLockin', lambda d: d.refreshButton.clicked.connect(self.dialog_manual_refresh))
         self.timer.timeout.connect(self.monitor_daq)
         self.ui.liaMonitor.startButton.clicked.connect(self.monitor_start)
         self.ui.liaMonitor.restartButton.clicked.connect(self.monitor_restart)
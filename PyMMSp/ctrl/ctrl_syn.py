@@ -1,10 +1,12 @@
 #! encoding = utf-8
 
 from PyQt6 import QtWidgets, QtCore
-import pyvisa
 from PyMMSp.ui import ui_shared
 from PyMMSp.inst import synthesizer as api_syn
 from PyMMSp.inst import validator as api_val
+from PyMMSp.libs.common import lazy_import
+
+pyvisa = lazy_import('pyvisa')
 
 
 class CtrlSyn(QtWidgets.QWidget):
@@ -98,6 +98,7 @@ class MainWindow(QtWidgets.QMainWindow):
             self.prefs, self.ui, self.inst_handles.info_gauge1, self.inst_handles.h_gauge1, parent=self)
         self.ctrl_flow = ctrl_flow.CtrlFlow(
             self.prefs, self.ui, self.inst_handles.h_flow, parent=self)
+        self.ctrl_insts.sig_inst_connected.connect(self.on_inst_connected)
         # controller of scanning routines
         self.ctrl_abs_bb = abs.CtrlAbsBBScan(
             self.prefs, self.ui, self.inst_handles, self.threads, parent=self)
@@ -105,7 +106,9 @@ class MainWindow(QtWidgets.QMainWindow):
         # connect menubar signals
         self.menuBar.instSelAction.triggered.connect(self.on_sel_inst)
         self.menuBar.instCloseAction.triggered.connect(self.on_close_sel_inst)
-        self.menuBar.scanAbsAction.triggered.connect(self.ui.dAbsScan.exec)
+        self.menuBar.instDiagAction.triggered.connect(self.on_diagnostics)
+        self.ui.on_dialog('dDiag', self._connect_diag_dialog)
+        self.menuBar.scanAbsAction.triggered.connect(lambda: self.ui.dAbsScan.exec())
         self.menuBar.scanCEAction.triggered.connect(self.on_scan_cavity)
         self.menuBar.lwaParserAction.triggered.connect(self.on_lwa_parser)
 
@@ -161,6 +164,11 @@ class MainWindow(QtWidgets.QMainWindow):
         else:
             pass
 
+    def on_inst_connected(self, inst_type):
+        """ Pass the new handle to the controllers that poll the instrument """
+        if inst_type == 'Gauge Controller 1':
+            self.ctrl_gauge.on_connect(self.inst_handles.h_gauge1)
+
     def on_close_sel_inst(self):
 
         self.ui.dCloseInst.exec()
@@ -174,6 +182,31 @@ class MainWindow(QtWidgets.QMainWindow):
     def on_scan_cavity(self):
         pass
 
+    def _connect_diag_dialog(self, d):
+
+        d.btnRefresh.clicked.connect(self.on_diagnostics)
+        d.btnClear.clicked.connect(self.on_diagnostics_clear)
+        d.btnSave.clicked.connect(self.on_diagnostics_save)
+
+    def on_diagnostics(self):
+        """ Show the communication statistics of the instruments """
+
+        self.ui.dDiag.set_stats(self.inst_handles.get_stats())
+        self.ui.dDiag.show()
+
+    def on_diagnostics_clear(self):
+
+        for stats in self.inst_handles.get_stats().values():
+            stats.clear()
+        self.ui.dDiag.set_stats(self.inst_handles.get_stats())
+
+    def on_diagnostics_save(self):
+
+        filename, _ = QtWidgets.QFileDialog.getSaveFileName(
+            self, 'Save Diagnostics', './diagnostics.json', 'JSON File (*.json)')
+        if filename:
+            self.inst_handles.dump_stats(filename)
+
     def on_lwa_parser(self):
         """ Launch lwa parser dialog window """
 
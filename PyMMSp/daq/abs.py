@@ -8,21 +8,33 @@ import numpy as np
 from math import ceil
 import datetime
 import os
-from time import sleep
+from time import sleep, perf_counter
 
 from PyMMSp.ui import ui_shared
 from PyMMSp.inst import lockin as api_lia
 from PyMMSp.inst import validator as api_val
 from PyMMSp.inst import synthesizer as api_syn
-from PyMMSp.inst.lockin import MODU_MODE, _SENS_VAL, TAU_VAL
+from PyMMSp.inst.lockin import MODU_MODE, _SENS_VAL, TAU_VAL, buffer_acq_time, decode_buffer, settle_time
+from PyMMSp.inst.synthesizer import LIST_MAX_PTS, SWITCH_TIME
+from PyMMSp.inst.base import gather
 from PyMMSp.libs import lwa
+from PyMMSp.libs import spb
 from PyMMSp.libs import common
+from PyMMSp.libs.sweep import SweepStack
+from PyMMSp.libs.checkpoint import CheckpointWriter, Checkpoint, load_checkpoint, find_unfinished, CHECKPOINT_FILE
 
 # 3 imports for type hinting
 from PyMMSp.config.config import Prefs, AbsScanSetting
 from PyMMSp.ui.ui_main import MainUI
 from PyMMSp.inst.base import Handles, Threads
 
+# Typical time (in ms) to send one instrument configuration command
+CMD_TIME = 50
+# Minimum time (in s) between two updates of the live plot during a sweep
+PLOT_INTERVAL = 0.1
+# Minimum time (in s) between two writes of the partial data of a single sweep to the .lwa file
+SAVE_INTERVAL = 1.
+
 
 class CtrlAbsBBScan(QtWidgets.QWidget):
     """ Controller of the absorption broadband scan """
@@ -62,20 +74,18 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
         # self.current_comment = ''
         self.y = np.array([])
         self.y_sum = np.array([])
+        # completed sweeps, saved in the sweeps column of the .spb file
+        self.y_sweeps = []
         # self.pts_taken = 0
+        # writes the averaged data to the LWA file after each sweep
+        self._lwa_writer = None
+        # plans the batch order in the background
+        self._planner = None
+        # the running batch scan
+        self._scan_thread = None
 
-        # connect quick scan button signals
-        self.ui.dAbsScan.btnPause.clicked[bool].connect(self.pause_current)
-        self.ui.dAbsScan.btnStart.clicked[bool].connect(self.quick_scan_start)
-        self.ui.dAbsScan.btnAbort.clicked[bool].connect(self.abort_scan)
-
-        # connect batch scan button signals
-        self.ui.dAbsScan.btnBatchSetup.clicked[bool].connect(self.ui.dAbsConfig.exec)
-        self.ui.dAbsConfig.accepted.connect(self.on_setup_accepted)
-        self.ui.dAbsConfig.btnEstimate.clicked[bool].connect(self._estimate_time)
-        self.ui.dAbsScan.btnAccessData.clicked[bool].connect(self.open_data_folder)
-        self.ui.dAbsScan.btnBatchStart.clicked[bool].connect(self.batch_start)
-        self.ui.dAbsScan.btnBatchAbort.clicked[bool].connect(self.abort_scan)
+        self.ui.on_dialog('dAbsScan', self._connect_scan_dialog)
+        self.ui.on_dialog('dAbsConfig', self._connect_config_dialog)
 
         #self.ui.dAbsBBScan.redoButton.clicked.connect(self.redo_current)
         #self.ui.dAbsBBScan.restartWinButton.clicked.connect(self.restart_avg)
@@ -88,10 +98,42 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
         #self.ui.dAbsBBScan.addBatchButton.clicked.connect(self.add_entry)
         #self.ui.dAbsBBScan.removeBatchButton.clicked.connect(self.remove_entry)
 
+    def _connect_scan_dialog(self, d):
+        # connect quick scan button signals
+        d.btnPause.clicked[bool].connect(self.pause_current)
+        d.btnStart.clicked[bool].connect(self.quick_scan_start)
+        d.btnAbort.clicked[bool].connect(self.abort_scan)
+
+        # connect batch scan button signals
+        d.btnBatchSetup.clicked[bool].connect(lambda: self.ui.dAbsConfig.exec())
+        d.btnAccessData.clicked[bool].connect(self.open_data_folder)
+        d.btnBatchStart.clicked[bool].connect(self.batch_start)
+        d.btnBatchAbort.clicked[bool].connect(self.abort_scan)
+
+    def _connect_config_dialog(self, d):
+        d.accepted.connect(self.on_setup_accepted)
+        d.btnEstimate.clicked[bool].connect(self._estimate_time)
 
     def on_setup_accepted(self):
         self.list_settings = self.ui.dAbsConfig.get_list_settings()
-        self.ui.dAbsScan.batchListWidget.add_entries(self.list_settings)
+        if self.ui.dAbsConfig.ckOptimize.isChecked():
+            self._start_planner(self.list_settings, self._on_plan_ready)
+        else:
+            self.ui.dAbsScan.batchListWidget.add_entries(self.list_settings)
+
+    def _on_plan_ready(self, list_settings, order, overhead, planned_overhead):
+        if list_settings is self.list_settings:
+            self.list_settings = [list_settings[i] for i in order]
+            self.ui.dAbsScan.batchListWidget.add_entries(self.list_settings)
+
+    def _start_planner(self, list_settings, slot):
+        """ Plan the batch order in a thread, and pass the result to slot in the GUI thread """
+        if self._planner is not None and self._planner.isRunning():
+            # the result of the previous plan is not wanted anymore
+            self._planner.sig_finish.disconnect()
+        self._planner = ThreadPlanBatch(list_settings, parent=self)
+        self._planner.sig_finish.connect(slot)
+        self._planner.start()
 
     def open_data_folder(self):
         directory = self.ui.dAbsConfig.lblDir.text()
@@ -101,16 +143,40 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
         """ Start a quick scan. It is equivalent to put a single item into the batch job queue and then start it. """
         # get settings from quick scan setup
         scan_setting = self.ui.dAbsScan.get_quick_scan_settings()
+        scan_setting.file_fmt = self.ui.dAbsConfig.comboFileFmt.currentText()
         self.list_settings = [scan_setting, ]
         # write this to the batch job queue
         self.ui.dAbsConfig.add_setting_list(self.list_settings)
         self.ui.dAbsConfig.ckPress.setChecked(scan_setting.is_press)
+        self.ui.dAbsConfig.ckBuffer.setChecked(scan_setting.is_lockin_buffer)
+        self.ui.dAbsConfig.ckListSweep.setChecked(scan_setting.is_list_sweep)
+        self.ui.dAbsConfig.ckMultiSweep.setChecked(scan_setting.is_multi_sweep)
+        self.ui.dAbsConfig.inpRejectThresh.setValue(scan_setting.reject_thresh)
+        self.ui.dAbsConfig.inpStopErr.setValue(scan_setting.stop_err)
+        self.ui.dAbsConfig.comboOctave.setCurrentIndex(scan_setting.octave_idx)
+        self.ui.dAbsConfig.ckAutoDwell.setChecked(scan_setting.is_auto_dwell)
+        self.ui.dAbsConfig.inpSettleTol.setValue(scan_setting.settle_tol)
+        self.ui.dAbsConfig.ckWatchSettle.setChecked(scan_setting.is_watch_settle)
+        self.ui.dAbsConfig.comboSampleRate.setCurrentIndex(scan_setting.sample_rate_idx)
         self.ui.dAbsScan.batchListWidget.add_entries(self.list_settings)
         # start batch job
         self.batch_start()
 
     def batch_start(self):
-        """ Start a batch scan """
+        """ Start a batch scan. If an unfinished batch job is found, ask to resume it """
+        ckpt = None
+        filename = find_unfinished(self.prefs.tmp_dir)
+        if filename:
+            q = QtWidgets.QMessageBox.question(
+                self, 'Unfinished Batch Job',
+                'An unfinished batch job is found. Resume it from the last completed point?\n'
+                'Otherwise, it will be discarded.',
+                QtWidgets.QMessageBox.StandardButton.Yes | QtWidgets.QMessageBox.StandardButton.No,
+                QtWidgets.QMessageBox.StandardButton.Yes)
+            if q == QtWidgets.QMessageBox.StandardButton.Yes:
+                ckpt = load_checkpoint(filename)
+                self.list_settings = ckpt.list_settings
+                self.ui.dAbsScan.batchListWidget.add_entries(self.list_settings)
         try:
             # Initiate progress bar
             total_time = ceil(estimate_job_time(self.list_settings))
@@ -118,26 +184,41 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
             self.ui.dAbsScan.totalProgBar.setValue(0)
             self.batch_time_taken = 0
             # Start scan
-            t = ThreadBatchScan(self.prefs, self.handles, self.threads, self.list_settings, parent=self)
+            t = ThreadBatchScan(self.prefs, self.handles, self.threads, self.list_settings,
+                                checkpoint=ckpt, parent=self)
             t.sig_total_progress.connect(self.ui.dAbsScan.totalProgBar.setValue)
             t.sig_this_progress.connect(self.ui.dAbsScan.currentProgBar.setValue)
             t.sig_this_n.connect(self.ui.dAbsScan.currentProgBar.setMaximum)
             t.sig_data_ready.connect(self.ui.dAbsScan.plot_this)
+            t.sig_avg_ready.connect(self.ui.dAbsScan.plot_avg)
             t.start()
+            self._scan_thread = t
         except ZeroDivisionError:
             q = ui_shared.MsgError(self, 'Zero step', 'Step cannot be 0.')
             q.exec()
 
     def _estimate_time(self):
+        # the optimized order is planned in a thread, the estimation is shown when it is ready
+        self._start_planner(self.ui.dAbsConfig.get_list_settings(), self._show_estimate)
+
+    def _show_estimate(self, list_settings, order, overhead, planned_overhead):
         try:
-            total_time = estimate_job_time(self.ui.dAbsConfig.get_list_settings())
+            total_time = estimate_job_time(list_settings)
+            # overhead of instrument reconfiguration between entries, in the given and the optimized order
+            saving = overhead - planned_overhead
+            if self.ui.dAbsConfig.ckOptimize.isChecked():
+                total_time += overhead - saving
+            else:
+                total_time += overhead
             now = datetime.datetime.today()
             length = datetime.timedelta(seconds=total_time)
             time_finish = now + length
             str_duration = common.format_timedelta(length)
             str_finish = time_finish.strftime('%I:%M %p, %m-%d-%Y (%a)')
+            str_saving = common.format_timedelta(datetime.timedelta(seconds=saving))
             text = (f'This batch job is estimated to take {str_duration:s}.\n'
-                    f'It is expected to finish at {str_finish:s}.')
+                    f'It is expected to finish at {str_finish:s}.\n'
+                    f'Optimizing the entry order saves {str_saving:s}.')
             q = ui_shared.MsgInfo(self, 'Time Estimation', text)
             q.exec()
         except ZeroDivisionError:
@@ -147,7 +228,7 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
     def set_file_directory(self):
 
         self.filename, _ = QtWidgets.QFileDialog.getSaveFileName(
-            self, 'Save Data', '', 'SMAP File (*.lwa)')
+            self, 'Save Data', '', 'SMAP File (*.lwa);;PyMMSp Binary File (*.spb)')
         self.ui.dAbsScan.lblDir.setText('Data save to: {:s}'.format(self.filename))
 
     def tune_syn_freq(self):
@@ -216,11 +297,17 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
 
         # add current y array to y_sum
         self.y_sum += self.y
+        self.y_sweeps.append(self.y.copy())
         # update plot
         self.ui.dAbsScan.ySumCurve.setData(self.x, self.y_sum)
+        # put the completed sweeps on disk
+        if not self.filename.endswith(spb.SUFFIX):
+            if self._lwa_writer is None:
+                self._lwa_writer = lwa.LWAWriter(self.filename, self._h_info(self.target_avg), len(self.x))
+            self._lwa_writer.write(self.y_sum / self.acquired_avg, self.acquired_avg)
 
-    def save_data(self):
-        """ Save data array """
+    def _h_info(self, avg):
+        """ LWA header information tuple, see lwa.save_lwa """
 
         # Grab current comment (in case edited during the scan) before saving data
         entry = self.ui.dAbsScan.batchListWidget.entryList[self.this_entry_idx]
@@ -239,14 +326,40 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
                   self.handles.info_syn.modFreq * 1e-3, mod_amp,
                   self.handles.info_syn.modModeText,
                   self.handles.info_lockin.refHarm, self.handles.info_lockin.refPhase,
-                  self.x_min, self.step, self.acquired_avg,
+                  self.x_min, self.step, avg,
                   entry.commentFill.text())
+        return h_info
+
+    def save_data(self):
+        """ Save data array """
 
+        h_info = self._h_info(self.acquired_avg)
         # if already finishes at least one sweep
         if self.acquired_avg > 0:
-            lwa.save_lwa(self.filename, self.y_sum / self.acquired_avg, h_info)
+            y = self.y_sum / self.acquired_avg
+        else:
+            y = self.y
+        if self.filename.endswith(spb.SUFFIX):
+            columns = {'freq': self.x, 'lia_x': y}
+            if self.y_sweeps:
+                # the sweeps averaged in y_sum
+                columns['sweeps'] = np.vstack(self.y_sweeps)
+            spb.save_spb(self.filename, columns, spb.h_info_to_dict(h_info))
+        elif self._lwa_writer is not None and self._lwa_writer.h_info[:11] + self._lwa_writer.h_info[12:] == \
+                h_info[:11] + h_info[12:]:
+            self._lwa_writer.write(y, self.acquired_avg)
+            self._lwa_writer.close()
+            self._lwa_writer = None
         else:
-            lwa.save_lwa(self.filename, self.y, h_info)
+            # e.g. the comment has been edited since the first sweep
+            self._discard_data()
+            lwa.save_lwa(self.filename, y, h_info)
+
+    def _discard_data(self):
+        """ Remove the sweeps of the current entry from the LWA file """
+        if self._lwa_writer is not None:
+            self._lwa_writer.discard()
+            self._lwa_writer = None
 
     def pause_current(self, btn_pressed):
         """ Pause/resume data acquisition """
@@ -288,10 +401,12 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
         if q == QtWidgets.QMessageBox.StandardButton.Yes:
             #print('restart average')
             self._timer.stop()
+            self._discard_data()
             self.acquired_avg = 0
             self.this_x_idx = 0
             self.y = np.zeros_like(self.x)
             self.y_sum = np.zeros_like(self.x)
+            self.y_sweeps = []
             self.ui.dAbsScan.ySumCurve.setData(self.x, self.y_sum)
             self.tune_syn_freq()
         else:
@@ -323,6 +438,7 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
         elif q == QtWidgets.QMessageBox.StandardButton.No:
             #print('abort current')
             self._timer.stop()
+            self._discard_data()
             self.batch_time_taken += ceil(len(self.x) * self.target_avg * self.wait_time * 1e-3)
             self._next_batch_entry_signal.emit()
         else:
@@ -333,6 +449,7 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
         # the index update must be done first because otherwise
         # there will be no chance to do it after the timer signal is emitted
         self.this_entry_idx += 1
+        self.y_sweeps = []
         if self.this_entry_idx < len(self.list_settings):
             self.ui.dAbsScan.batchListWidget.set_active_entry(self.this_entry_idx)
 
@@ -362,10 +479,40 @@ class CtrlAbsBBScan(QtWidgets.QWidget):
 
         if q == QtWidgets.QMessageBox.StandardButton.Yes:
             self._timer.stop()
+            self._discard_data()
+            if self._scan_thread is not None and self._scan_thread.isRunning():
+                self._scan_thread.abort()
         else:
             pass
 
 
+class ThreadPlanBatch(QtCore.QThread):
+    """ Thread to plan the order of the batch entries, see plan_batch.
+    sig_finish sends the settings, the planned order, and the overhead (s) in the given
+    and in the planned order. If planning fails, the given order is sent.
+    """
+
+    sig_finish = QtCore.pyqtSignal(object, object, float, float)
+
+    def __init__(self, list_settings: [AbsScanSetting], parent=None):
+        super().__init__(parent)
+        self.list_settings = list_settings
+
+    def run(self):
+        order = list(range(len(self.list_settings)))
+        try:
+            overhead = estimate_overhead(self.list_settings, order)
+            order = plan_batch(self.list_settings)
+            planned_overhead = estimate_overhead(self.list_settings, order)
+        except ZeroDivisionError:
+            overhead = planned_overhead = 0.
+        self.sig_finish.emit(self.list_settings, order, overhead, planned_overhead)
+
+
+class ScanAborted(Exception):
+    """ The batch scan is aborted by the user """
+
+
 class ThreadBatchScan(QtCore.QThread):
     """ Thread for batch scan """
 
@@ -373,76 +520,359 @@ class ThreadBatchScan(QtCore.QThread):
     sig_this_progress = QtCore.pyqtSignal(int)
     sig_this_n = QtCore.pyqtSignal(int)
     sig_data_ready = QtCore.pyqtSignal(np.ndarray, np.ndarray)
+    sig_avg_ready = QtCore.pyqtSignal(np.ndarray, np.ndarray, np.ndarray)
     sig_finish = QtCore.pyqtSignal()
     def __init__(self, prefs: Prefs, handles: Handles, threads: Threads,
-                 list_settings: [AbsScanSetting], parent=None):
+                 list_settings: [AbsScanSetting], checkpoint: Checkpoint = None, parent=None):
         super().__init__(parent)
 
         self.prefs = prefs
         self.handles = handles
         self.threads = threads
         self.list_settings = list_settings
+        # resume from this checkpoint if given
+        self.checkpoint = checkpoint
+        self._ckpt_writer = None
+        self._entry_idx = 0
+        # the setting of the previous entry, to send only the changed instrument commands
+        self._last_setting = None
+        # the last tuned frequency, to know the size of the next frequency jump
+        self._last_x = None
+        # the last update of the live plot
+        self._t_plot = 0.
+        # data file of the current entry, and its writer if the data is written during the scan
+        self._filename = ''
+        self._lwa_writer = None
+        self._t_save = 0.
+        self._is_abort = False
+        # sweeps of the current entry, for the sweeps column of the .spb file
+        self._sweeps = None
 
     def run(self):
 
-        for setting in self.list_settings:
-            # tune instrument settings
-            self._tune_inst(setting)
-            x_arr = np.arange(setting.freq_start, setting.freq_stop, setting.freq_step)
-            y_arr = np.zeros_like(x_arr)
-            # calculate n to set to the current progress bar
-            # it is equal to no. of points * no. of averages *
-            this_n = len(x_arr) * setting.avg
-            self.sig_this_n.emit(this_n)
-            for idx, x in enumerate(x_arr):
-                # tune synthesizer frequency
-                if self.prefs.is_test:
-                    self.handles.info_syn.freq_cw = x * 1e6
-                else:
-                    syn_f = x * 1e6 / self.handles.info_syn.harm
-                    self.threads.t_syn.call(self.handles.api_syn.set_syn_freq, self.handles.h_syn, syn_f)
-                # sleep in seconds to wait for the previous tau to relax
-                sleep(setting.dwell_time * 1e-3)
-                y = 0
-                if self.prefs.is_test:
-                    for i in range(setting.avg):
-                        y += np.random.random_sample()
-                        self.sig_this_progress.emit(idx * setting.avg + i + 1)
-                else:
-                    for i in range(setting.avg):
-                        y += self.threads.t_lockin.call(self.handles.api_lockin.query_single_x,
-                                                        self.handles.h_lockin, setting.buffer_len)
-                        self.sig_this_progress.emit(idx * setting.avg + i + 1)
-                y_arr[idx] = y / setting.avg
-                self.sig_data_ready.emit(x, y)
-            # auto save current data
-            save_data(np.column_stack((x_arr, y_arr)), setting)
+        ckpt = self.checkpoint
+        self._ckpt_writer = CheckpointWriter(os.path.join(self.prefs.tmp_dir, CHECKPOINT_FILE),
+                                             is_resume=ckpt is not None)
+        if ckpt is None:
+            self._ckpt_writer.start_batch(self.list_settings)
+        self._last_x = None
+        self._last_setting = None
+        try:
+            for self._entry_idx, setting in enumerate(self.list_settings):
+                if ckpt and self._entry_idx in ckpt.done:
+                    continue
+                self._scan_entry(setting, ckpt)
+        except ScanAborted:
+            # the unsaved data is discarded, and the batch job is not resumable
+            self._discard_entry()
+        self._ckpt_writer.finish()
         self.sig_finish.emit()
 
+    def abort(self):
+        """ Stop the scan before the next point, and discard the unsaved data """
+        self._is_abort = True
+
+    def _scan_entry(self, setting: AbsScanSetting, ckpt: Checkpoint = None):
+        """ Scan the entry self._entry_idx and save its data """
+
+        # completed points or sweeps of an interrupted entry
+        if ckpt and self._entry_idx in ckpt.points:
+            done_pts = ckpt.points[self._entry_idx]
+            done_sweeps = ckpt.sweeps[self._entry_idx]
+            self._filename = ckpt.files[self._entry_idx] or data_filename(setting)
+        else:
+            done_pts = {}
+            done_sweeps = []
+            self._filename = data_filename(setting)
+            self._ckpt_writer.start_entry(self._entry_idx, self._filename)
+        # tune instrument settings
+        self._tune_inst(setting)
+        x_arr = np.arange(setting.freq_start, setting.freq_stop, setting.freq_step)
+        # calculate n to set to the current progress bar
+        # it is equal to no. of points * no. of averages *
+        this_n = len(x_arr) * setting.avg
+        self.sig_this_n.emit(this_n)
+        if self._filename.endswith('.lwa'):
+            if os.path.exists(self._filename):
+                # partial scan of the interrupted entry, written again from the checkpoint
+                os.remove(self._filename)
+            self._lwa_writer = lwa.LWAWriter(
+                self._filename, scan_h_info(setting, self.handles.info_syn, self.handles.info_lockin), len(x_arr))
+        if setting.is_multi_sweep:
+            y_arr = self._multi_sweep(x_arr, setting, done_sweeps, sweeps_filename(self._filename))
+        else:
+            y_arr = self._single_sweep(x_arr, setting, done_pts)
+        if setting.is_list_sweep and not self.prefs.is_test:
+            # put the synthesizer back to CW mode
+            self.threads.t_syn.call(self.handles.api_syn.set_freq_mode, self.handles.h_syn, 'CW')
+        # auto save current data. The .lwa file is complete after the last sweep
+        if self._lwa_writer is not None:
+            self._lwa_writer.close()
+            self._lwa_writer = None
+        else:
+            save_data(np.column_stack((x_arr, y_arr)), setting, filename=self._filename,
+                      h_info=scan_h_info(setting, self.handles.info_syn, self.handles.info_lockin),
+                      sweeps=self._sweeps)
+            self._sweeps = None
+        self._ckpt_writer.finish_entry(self._entry_idx)
+
+    def _discard_entry(self):
+        """ Remove the partial data of the current entry """
+
+        if self._lwa_writer is not None:
+            self._lwa_writer.discard()
+            self._lwa_writer = None
+        if self._filename:
+            for filename in (self._filename, sweeps_filename(self._filename)):
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    def _write_partial(self, y, avg, force=False):
+        """ Write the data acquired so far to the .lwa file, if it is the file format.
+        Unless forced, at most once every SAVE_INTERVAL.
+        Arguments
+            y: np.array, average of the acquired sweeps, the first len(y) points of the scan
+            avg: int, number of sweeps in y
+        """
+        if self._lwa_writer is None:
+            return
+        t = perf_counter()
+        if force or t - self._t_save >= SAVE_INTERVAL:
+            self._t_save = t
+            self._lwa_writer.write(y, avg)
+
+    def _single_sweep(self, x_arr, setting: AbsScanSetting, done_pts: dict):
+        """ Sweep once, and average setting.avg readings at each point.
+        Points in done_pts {idx: y} are taken from the checkpoint.
+        Returns
+            y_arr: np.array
+        """
+
+        y_arr = np.zeros_like(x_arr)
+        for idx, y in done_pts.items():
+            y_arr[idx] = y
+        for idx, x in enumerate(x_arr):
+            if idx in done_pts:
+                continue
+            self._tune_point(x_arr, idx, setting)
+            y = 0
+            for i in range(setting.avg):
+                y += self._read_point(setting)
+                self._emit_progress(idx * setting.avg + i + 1)
+            y_arr[idx] = y / setting.avg
+            self._ckpt_writer.add_point(self._entry_idx, idx, y_arr[idx])
+            self._emit_sweep(x_arr[:idx + 1], y_arr[:idx + 1], is_last=idx == len(x_arr) - 1)
+            self._write_partial(y_arr[:idx + 1], setting.avg)
+        self._write_partial(y_arr, setting.avg, force=True)
+        return y_arr
+
+    def _multi_sweep(self, x_arr, setting: AbsScanSetting, done_sweeps: list, filename=''):
+        """ Sweep setting.avg times, alternately up and down, with one reading per point,
+        and average over the sweeps. Slow baseline drift averages out this way.
+        Averaging stops early if every point reaches the target standard error.
+        Sweeps in done_sweeps are taken from the checkpoint.
+        Every sweep taken, rejected or not, is kept in the .npy file filename (if given),
+        shape (setting.avg, n); the sweeps not taken are nan.
+        Returns
+            y_arr: np.array
+        """
+
+        n = len(x_arr)
+        stack = SweepStack(setting.avg, n, reject_thresh=setting.reject_thresh, filename=filename)
+        try:
+            y_arr = self._sweep_stack(x_arr, setting, done_sweeps, stack)
+            if self._filename.endswith(spb.SUFFIX):
+                # the stack is memory-mapped to a file that is closed below
+                self._sweeps = np.array(stack.sweeps[:stack.n_taken])
+            return y_arr
+        finally:
+            stack.close()
+
+    def _sweep_stack(self, x_arr, setting: AbsScanSetting, done_sweeps: list, stack: SweepStack):
+        """ Take the sweeps of _multi_sweep into the stack
+        Returns
+            y_arr: np.array
+        """
+
+        n = len(x_arr)
+        y_this = np.zeros_like(x_arr)
+        for y in done_sweeps:
+            stack.add_sweep(np.array(y))
+        if stack.n_avg > 0:
+            self._write_partial(stack.mean, stack.n_avg, force=True)
+        for i_sweep in range(len(done_sweeps), setting.avg):
+            if stack.is_converged(setting.stop_err):
+                break
+            # even sweep goes up, odd sweep goes down.
+            # The list sweep table only steps forward, so it always goes up
+            if i_sweep % 2 and not setting.is_list_sweep:
+                indices = range(n - 1, -1, -1)
+            else:
+                indices = range(n)
+            for i_pt, idx in enumerate(indices):
+                self._tune_point(x_arr, idx, setting)
+                y_this[idx] = self._read_point(setting)
+                self._emit_progress(i_sweep * n + i_pt + 1)
+                # the part of this sweep measured so far
+                lo, hi = (idx, n) if indices.step < 0 else (0, idx + 1)
+                self._emit_sweep(x_arr[lo:hi], y_this[lo:hi], is_last=i_pt == n - 1)
+            stack.add_sweep(y_this)
+            self._ckpt_writer.add_sweep(self._entry_idx, y_this)
+            if stack.n_avg > 0:
+                self.sig_avg_ready.emit(x_arr, stack.mean.copy(), stack.err)
+                self._write_partial(stack.mean, stack.n_avg, force=True)
+        if stack.n_avg > 0:
+            return stack.mean.copy()
+        else:
+            return y_this.copy()
+
+    def _emit_progress(self, n_done):
+        self.sig_this_progress.emit(n_done)
+
+    def _emit_sweep(self, x, y, is_last=False):
+        """ Send the part of the sweep measured so far to the plot,
+        at most once every PLOT_INTERVAL, and at the end of the sweep """
+        t = perf_counter()
+        if is_last or t - self._t_plot >= PLOT_INTERVAL:
+            self._t_plot = t
+            # y is still being filled by this thread
+            self.sig_data_ready.emit(x, y.copy())
+
+    def _tune_point(self, x_arr, idx, setting: AbsScanSetting):
+        """ Tune synthesizer frequency to the point idx, and wait for the dwell time """
+
+        if self._is_abort:
+            raise ScanAborted
+        self._tune_freq(x_arr, idx, setting)
+        self._dwell(x_arr, idx, setting)
+
+    def _tune_freq(self, x_arr, idx, setting: AbsScanSetting):
+        """ Tune synthesizer frequency to the point idx """
+
+        if self.prefs.is_test:
+            self.handles.info_syn.freq_cw = x_arr[idx] * 1e6
+        elif setting.is_list_sweep:
+            self._next_list_point(x_arr, idx)
+        else:
+            syn_f = x_arr[idx] * 1e6 / self.handles.info_syn.harm
+            self.threads.t_syn.call(self.handles.api_syn.set_cw_freq, self.handles.h_syn, syn_f, 'HZ')
+
+    def _dwell(self, x_arr, idx, setting: AbsScanSetting):
+        """ Wait for the lockin to settle at the point idx """
+
+        # the first point of the batch comes from an unknown frequency, treat it as a full span jump
+        if self._last_x is None:
+            jump = abs(setting.freq_stop - setting.freq_start)
+        else:
+            jump = abs(x_arr[idx] - self._last_x)
+        self._last_x = x_arr[idx]
+        if setting.is_auto_dwell and setting.is_watch_settle and not self.prefs.is_test:
+            self._watch_settle(setting, dwell_time(setting, jump))
+        else:
+            # sleep in seconds to wait for the previous tau to relax
+            sleep(dwell_time(setting, jump) * 1e-3)
+
+    def _watch_settle(self, setting: AbsScanSetting, max_wait):
+        """ Wait for the synthesizer to switch, then read the lockin output once per tau,
+        and proceed as soon as two successive readings differ less than
+        setting.settle_tol of the full scale, or when max_wait (ms) runs out.
+        """
+
+        api = self.handles.api_lockin
+        h = self.handles.h_lockin
+        tau = TAU_VAL[setting.tau_idx]
+        sleep(SWITCH_TIME * 1e-3)
+        waited = SWITCH_TIME
+        y_prev = self.threads.t_lockin.call(api.get_single_x, h)
+        while waited < max_wait:
+            sleep(tau * 1e-3)
+            waited += tau
+            y = self.threads.t_lockin.call(api.get_single_x, h)
+            if abs(y - y_prev) < setting.settle_tol * _SENS_VAL[setting.sens_idx]:
+                break
+            y_prev = y
+
+    def _read_point(self, setting: AbsScanSetting):
+        """ Take a single lockin reading at the current frequency """
+
+        if self.prefs.is_test:
+            if setting.is_lockin_buffer:
+                return np.random.random_sample(setting.buffer_len).mean()
+            else:
+                return np.random.random_sample()
+        elif setting.is_lockin_buffer:
+            return self._read_lockin_buffer(setting).mean()
+        else:
+            return self.threads.t_lockin.call(self.handles.api_lockin.get_single_x,
+                                              self.handles.h_lockin)
+
+    def _next_list_point(self, x_arr, idx):
+        """ Move the synthesizer to the point idx of the list sweep.
+        The frequency table is uploaded once per LIST_MAX_PTS points
+        (the instrument limit), and then advanced by bus triggers.
+        An entry resumed from a checkpoint uploads the table from its first point.
+        """
+
+        api = self.handles.api_syn
+        h = self.handles.h_syn
+        if idx % LIST_MAX_PTS == 0 or self._last_x is None:
+            syn_f = x_arr[idx:idx + LIST_MAX_PTS] * 1e6 / self.handles.info_syn.harm
+            self.threads.t_syn.call(api.set_list_type, h, 'LIST')
+            self.threads.t_syn.call(api.set_list_trig_source, h, 'BUS')
+            self.threads.t_syn.call(api.set_list_freq, h, syn_f)
+            self.threads.t_syn.call(api.set_init_cont, h, False)
+            self.threads.t_syn.call(api.set_freq_mode, h, 'LIST')
+            # arm the sweep, which outputs the first point of this table
+            self.threads.t_syn.call(api.init_sweep, h)
+        else:
+            self.threads.t_syn.call(api.trigger, h)
+
     def _tune_inst(self, setting: AbsScanSetting):
+        """ Tune the synthesizer and the lockin for this entry.
+        Only the commands that differ from the previous entry are sent.
+        Commands to the same instrument are pipelined in its worker thread,
+        and the two instruments are tuned concurrently.
+        """
 
         self.handles.info_syn.modu_mode_idx = setting.modu_mode_idx
         self.handles.info_syn.modu_freq = setting.modu_freq
         self.handles.info_syn.modu_amp = setting.modu_amp
 
-        if self.handles.info_syn.modu_mode_txt == 'AM':
-            self.threads.t_syn.call(self.handles.api_syn.set_am_stat, self.handles.h_syn, 1, True)
-            self.threads.t_syn.call(self.handles.api_syn.set_fm_stat, self.handles.h_syn, 1, False)
-            self.threads.t_syn.call(self.handles.api_syn.set_modu_stat, self.handles.h_syn, True)
-            self.threads.t_syn.call(self.handles.api_syn.set_am_freq, self.handles.h_syn, setting.modu_freq)
-            self.threads.t_syn.call(self.handles.api_syn.set_am_depth_pct, self.handles.h_syn, setting.modu_amp)
-        elif self.handles.info_syn.modu_mode_txt == 'FM':
-            self.threads.t_syn.call(self.handles.api_syn.set_am_stat, self.handles.h_syn, 1, False)
-            self.threads.t_syn.call(self.handles.api_syn.set_fm_stat, self.handles.h_syn, 1, True)
-            self.threads.t_syn.call(self.handles.api_syn.set_modu_stat, self.handles.h_syn, True)
-            self.threads.t_syn.call(self.handles.api_syn.set_fm_freq, self.handles.h_syn, setting.modu_freq)
-            self.threads.t_syn.call(self.handles.api_syn.set_fm_dev, self.handles.h_syn, setting.modu_amp)
+        if self._last_setting is None:
+            last_config = None
+        else:
+            last_config = inst_config(self._last_setting)
+        self._last_setting = setting
+        futures = []
+        for (inst, func_name), args in config_delta(last_config, inst_config(setting)).items():
+            if inst == 'syn':
+                futures.append(self.threads.t_syn.submit(
+                    getattr(self.handles.api_syn, func_name), self.handles.h_syn, *args))
+            else:
+                futures.append(self.threads.t_lockin.submit(
+                    getattr(self.handles.api_lockin, func_name), self.handles.h_lockin, *args))
+        gather(futures)
+
+    def _read_lockin_buffer(self, setting: AbsScanSetting):
+        """ Arm the lockin internal buffer, wait for it to be filled,
+        and pull all points in a single binary transfer.
+        Returns
+            data: np.array
+        """
+
+        api = self.handles.api_lockin
+        h = self.handles.h_lockin
+        self.threads.t_lockin.call(api.reset_buffer, h)
+        self.threads.t_lockin.call(api.start_buffer, h)
+        sleep(buffer_acq_time(setting.buffer_len, setting.sample_rate_idx) * 1e-3)
+        self.threads.t_lockin.call(api.pause_buffer, h)
+        # the buffer may hold one point less/more than requested due to timing
+        n = min(self.threads.t_lockin.call(api.get_buffer_pts, h), setting.buffer_len)
+        if n > 0:
+            raw = self.threads.t_lockin.call(api.get_buffer, h, 1, 0, n, byte=4 * n)
+            return decode_buffer(raw)
         else:
-            self.threads.t_syn.call(self.handles.api_syn.set_modu_stat, self.handles.h_syn, False)
-            self.threads.t_syn.call(self.handles.api_syn.set_am_stat, self.handles.h_syn, 1, False)
-            self.threads.t_syn.call(self.handles.api_syn.set_fm_stat, self.handles.h_syn, 1, False)
-        self.threads.t_lockin.call(self.handles.api_lockin.set_sens, self.handles.h_lockin, setting.sens_idx)
-        self.threads.t_lockin.call(self.handles.api_lockin.set_tau, self.handles.h_lockin, setting.tau_idx)
+            return np.zeros(1)
 
 
 def estimate_job_time(list_settings: [AbsScanSetting]):
@@ -458,21 +888,175 @@ def estimate_job_time(list_settings: [AbsScanSetting]):
         # estimate total data points to be taken
         data_points = ceil((abs(setting.freq_stop - setting.freq_start) / setting.freq_step + 1) * setting.avg)
         # time expense for this entry in seconds, tau & dwell time all in ms
-        total_time += data_points * (TAU_VAL[setting.tau_idx] * setting.buffer_len + setting.dwell_time) * 1e-3
+        if setting.is_lockin_buffer:
+            acq_time = buffer_acq_time(setting.buffer_len, setting.sample_rate_idx)
+        else:
+            acq_time = TAU_VAL[setting.tau_idx] * setting.buffer_len
+        total_time += data_points * (acq_time + dwell_time(setting, setting.freq_step)) * 1e-3
 
     return total_time
 
 
-def save_data(data: np.ndarray, setting: AbsScanSetting, filename=''):
-    """ Save data array to a file """
-    if filename:
-        pass
+def inst_config(setting: AbsScanSetting):
+    """ Instrument commands to configure this entry, in the order to be sent
+    Returns
+        config: dict            {(inst, api function name): args}, inst is 'syn' or 'lockin'
+    """
+
+    config = {}
+    modu_mode = MODU_MODE[setting.modu_mode_idx]
+    if modu_mode == 'AM':
+        config[('syn', 'set_am_stat')] = (1, True)
+        config[('syn', 'set_fm_stat')] = (1, False)
+        config[('syn', 'set_modu_stat')] = (True,)
+        config[('syn', 'set_am_freq')] = (1, setting.modu_freq, 'HZ')
+        config[('syn', 'set_am_depth_pct')] = (1, setting.modu_amp)
+    elif modu_mode == 'FM':
+        config[('syn', 'set_am_stat')] = (1, False)
+        config[('syn', 'set_fm_stat')] = (1, True)
+        config[('syn', 'set_modu_stat')] = (True,)
+        config[('syn', 'set_fm_freq')] = (1, setting.modu_freq, 'HZ')
+        config[('syn', 'set_fm_dev')] = (1, setting.modu_amp, 'KHZ')
+    else:
+        config[('syn', 'set_modu_stat')] = (False,)
+        config[('syn', 'set_am_stat')] = (1, False)
+        config[('syn', 'set_fm_stat')] = (1, False)
+    config[('lockin', 'set_sens')] = (setting.sens_idx,)
+    config[('lockin', 'set_tau')] = (setting.tau_idx,)
+    config[('lockin', 'set_octave')] = (setting.octave_idx,)
+    if setting.is_lockin_buffer:
+        # internal sample rate, software start, one-shot buffer (stop when full)
+        config[('lockin', 'set_sample_rate')] = (setting.sample_rate_idx,)
+        config[('lockin', 'set_trig_start')] = (False,)
+        config[('lockin', 'set_buffer_mode')] = (0,)
+    return config
+
+
+def config_delta(last_config, config):
+    """ Commands in config that differ from last_config. All of them if last_config is None """
+
+    if last_config is None:
+        return config
+    return {key: args for key, args in config.items() if last_config.get(key) != args}
+
+
+def transition_time(last_setting: AbsScanSetting, setting: AbsScanSetting):
+    """ Overhead (in ms) to go from the end of last_setting to the first point of setting:
+    the changed instrument commands and the wait after the frequency jump.
+    last_setting is None for the first entry of the batch """
+
+    if last_setting is None:
+        return _transition_time(None, None, setting, inst_config(setting))
+    return _transition_time(last_setting, inst_config(last_setting), setting, inst_config(setting))
+
+
+def _transition_time(last_setting, last_config, setting, config):
+    """ transition_time, with the instrument configurations computed beforehand """
+
+    if last_setting is None:
+        n_cmd = len(config)
+        jump = abs(setting.freq_stop - setting.freq_start)
+    else:
+        n_cmd = len(config_delta(last_config, config))
+        jump = abs(setting.freq_start - last_setting.freq_stop)
+    return n_cmd * CMD_TIME + dwell_time(setting, jump)
+
+
+def estimate_overhead(list_settings: [AbsScanSetting], order):
+    """ Overhead (in seconds) between the entries of the batch job, run in the order of indices """
+
+    total_time = 0
+    last_setting = None
+    last_config = None
+    for i in order:
+        config = inst_config(list_settings[i])
+        total_time += _transition_time(last_setting, last_config, list_settings[i], config)
+        last_setting = list_settings[i]
+        last_config = config
+    return total_time * 1e-3
+
+
+def plan_batch(list_settings: [AbsScanSetting]):
+    """ Order the entries to minimize the overhead between them.
+    Starting from the first entry, the next one is always the entry with the least
+    transition time, so that entries with the same instrument configuration are grouped.
+    Ties are broken by the size of the frequency jump, then by the given order.
+    Returns
+        order: [int]            indices of list_settings
+    """
+
+    if not list_settings:
+        return []
+    configs = [inst_config(s) for s in list_settings]
+    order = [0]
+    remaining = list(range(1, len(list_settings)))
+    while remaining:
+        last = order[-1]
+        last_setting = list_settings[last]
+        i_next = min(remaining, key=lambda i: (
+            _transition_time(last_setting, configs[last], list_settings[i], configs[i]),
+            abs(list_settings[i].freq_start - last_setting.freq_stop), i))
+        order.append(i_next)
+        remaining.remove(i_next)
+    return order
+
+
+def dwell_time(setting: AbsScanSetting, jump: float):
+    """ Wait time (in ms) before reading the lockin after a frequency jump (in MHz).
+    With auto dwell, it is the synthesizer switching time plus the time the lockin filter
+    needs to settle. The error left is setting.settle_tol of a single frequency step,
+    so a jump larger than the step waits longer. Otherwise, it is the fixed setting.dwell_time
+    """
+
+    if not setting.is_auto_dwell:
+        return setting.dwell_time
+    if jump > setting.freq_step > 0:
+        tol = setting.settle_tol * setting.freq_step / jump
+    else:
+        tol = setting.settle_tol
+    return SWITCH_TIME + settle_time(setting.tau_idx, setting.octave_idx, tol)
+
+
+def data_filename(setting: AbsScanSetting):
+    """ File name of the data of the entry, in the setting.file_fmt format,
+    numbered if the file already exists """
+
+    d = datetime.datetime.today().strftime('%Y%m%d')
+    ext = setting.file_fmt
+    filename = f'{d:s}_{setting.freq_start:0.0f}_{setting.freq_stop:0.0f}_bf{setting.buffer_len:d}{ext:s}'
+    # check if this file already exists. if so, add numbering
+    i = 0
+    while os.path.exists(filename):
+        i += 1
+        filename = f'{d:s}_{setting.freq_start:0.0f}_{setting.freq_stop:0.0f}_bf{setting.buffer_len:d}_{i:d}{ext:s}'
+    return filename
+
+
+def scan_h_info(setting: AbsScanSetting, info_syn, info_lockin):
+    """ LWA header information tuple of the entry, see lwa.save_lwa """
+
+    return (info_syn.harm, dwell_time(setting, setting.freq_step), _SENS_VAL[setting.sens_idx],
+            TAU_VAL[setting.tau_idx] * 1e-3, setting.modu_freq * 1e-3, setting.modu_amp,
+            MODU_MODE[setting.modu_mode_idx], info_lockin.ref_harm, info_lockin.ref_phase,
+            setting.freq_start, setting.freq_step, setting.avg, '')
+
+
+def sweeps_filename(filename):
+    """ File name of the single sweeps of the data file filename (.npy) """
+
+    return os.path.splitext(filename)[0] + '_sweeps.npy'
+
+
+def save_data(data: np.ndarray, setting: AbsScanSetting, filename='', h_info=(), sweeps=None):
+    """ Save data array (freq, lia_x) to a file, in the format of its suffix.
+    The .spb file also has the header information tuple h_info (see lwa.save_lwa),
+    and the single sweeps in its sweeps column, if given """
+    if not filename:
+        filename = data_filename(setting)
+    if filename.endswith(spb.SUFFIX):
+        columns = {'freq': data[:, 0], 'lia_x': data[:, 1]}
+        if sweeps is not None:
+            columns['sweeps'] = sweeps
+        spb.save_spb(filename, columns, spb.h_info_to_dict(h_info))
     else:
-        d = datetime.datetime.today().strftime('%Y%m%d')
-        filename = f'{d:s}_{setting.freq_start:0.0f}_{setting.freq_stop:0.0f}_bf{setting.buffer_len:d}.dat'
-        # check if this file already exists. if so, add numbering
-        i = 0
-        while os.path.exists(filename):
-            i += 1
-            filename = f'{d:s}_{setting.freq_start:0.0f}_{setting.freq_stop:0.0f}_bf{setting.buffer_len:d}_{i:d}.dat'
-    np.savetxt(filename, data, comments='')
\ No newline at end of file
+        np.savetxt(filename, data, comments='')
\ No newline at end of file
@@ -0,0 +1,112 @@
+#! encoding = utf-8
+
+""" Loading of the API_MAP files.
+The yaml file is parsed once into a compiled form: the API_MAP dict itself,
+plus 'reverse_presets' {preset_name: {str(value): key}} used to decode the replies.
+The compiled form is kept in memory and pickled to CACHE_DIR, so that yaml is only
+parsed again when the file changes. A cache entry is valid if the mtime and size
+of the yaml file are unchanged, or else if the sha1 of its content is unchanged.
+The returned dict is shared by all the callers and must not be modified.
+"""
+
+import os
+import pickle
+import hashlib
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'PyMMSp', 'api_map')
+# bump if the compiled form changes
+CACHE_VERSION = 1
+
+# {path: ((mtime_ns, size), api_map)}
+_MEM_CACHE = {}
+
+
+def load_api_map(api_map_file) -> dict:
+    """ Load the compiled API_MAP
+    Arguments
+        api_map_file: str or path, the API_MAP yaml file
+    Returns
+        api_map: dict
+    """
+
+    path = os.path.abspath(os.fspath(api_map_file))
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    try:
+        mem_stamp, api_map = _MEM_CACHE[path]
+        if mem_stamp == stamp:
+            return api_map
+    except KeyError:
+        pass
+    api_map = _load_disk_cache(path, stamp)
+    _MEM_CACHE[path] = (stamp, api_map)
+    return api_map
+
+
+def clear_cache(is_disk=False):
+    """ Clear the memory cache, and optionally the disk cache """
+    _MEM_CACHE.clear()
+    if is_disk and os.path.isdir(CACHE_DIR):
+        for f in os.listdir(CACHE_DIR):
+            if f.endswith('.pickle'):
+                os.remove(os.path.join(CACHE_DIR, f))
+
+
+def compile_api_map(api_map: dict) -> dict:
+    """ Add the precomputed lookup tables to the parsed API_MAP """
+    reverse_presets = {}
+    for name, preset in (api_map.get('presets') or {}).items():
+        # the first key wins if two keys share the same value
+        r = {}
+        for key, value in preset.items():
+            r.setdefault(str(value), key)
+        reverse_presets[name] = r
+    api_map['reverse_presets'] = reverse_presets
+    return api_map
+
+
+def _cache_file(path):
+    h = hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f'{os.path.basename(path):s}.{h:s}.pickle')
+
+
+def _load_disk_cache(path, stamp):
+    """ Load the compiled API_MAP from the disk cache, or parse the yaml file and update the cache """
+
+    cache_file = _cache_file(path)
+    entry = None
+    try:
+        with open(cache_file, 'rb') as f:
+            entry = pickle.load(f)
+        if entry.get('version') != CACHE_VERSION:
+            entry = None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        entry = None
+    if entry and entry['stamp'] == stamp:
+        return entry['api_map']
+
+    with open(path, 'rb') as f:
+        content = f.read()
+    sha1 = hashlib.sha1(content).hexdigest()
+    if entry and entry['sha1'] == sha1:
+        # file touched but not changed
+        api_map = entry['api_map']
+    else:
+        # yaml is only needed on a cache miss
+        import yaml
+        api_map = compile_api_map(yaml.safe_load(content.decode('utf-8')))
+    _save_disk_cache(cache_file, {'version': CACHE_VERSION, 'stamp': stamp, 'sha1': sha1, 'api_map': api_map})
+    return api_map
+
+
+def _save_disk_cache(cache_file, entry):
+    # the cache is optional: ignore the failure if the directory is not writable
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = f'{cache_file:s}.{os.getpid():d}.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        # atomic, so that a concurrent reader never sees a partial file
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
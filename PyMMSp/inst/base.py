@@ -2,13 +2,11 @@
 
 from PyQt6 import QtCore
 import queue
-import pyvisa
-import serial
+import concurrent.futures
 import socket
 from importlib.resources import files
 from time import sleep, time
 import os.path
-import yaml
 import inspect
 from PyMMSp.inst.synthesizer import Syn_Info, SYN_MODELS, SynAPI, SynSimDecoder, get_syn_info
 from PyMMSp.inst.lockin import Lockin_Info, LOCKIN_MODELS, LockinAPI, LockinSimDecoder, get_lockin_info
@@ -19,6 +17,13 @@ from PyMMSp.inst.flow import Flow_Info, FLOW_CTRL_MODELS, FlowAPI, FlowSimDecode
 from PyMMSp.inst.gauge import Gauge_Info, GAUGE_CTRL_MODELS, GaugeAPI, GaugeSimDecoder, get_gauge_info
 from PyMMSp.inst.valve import Valve_Info, VALVE_MODELS, ValveAPI, ValveSimDecoder, get_valve_info
 from PyMMSp.inst.base_simulator import SimHandle
+from PyMMSp.inst.stats import InstStats, timed, dump_stats
+from PyMMSp.inst.api_map import load_api_map
+from PyMMSp.libs.common import lazy_import
+
+# only needed once an instrument is connected
+pyvisa = lazy_import('pyvisa')
+serial = lazy_import('serial')
 
 
 INST_TYPES = (
@@ -47,6 +52,20 @@ INST_MODEL_DICT = {
     'Valve 2': VALVE_MODELS,
 }
 
+# attribute names of the handles in Handles
+_INST_HANDLE_NAMES = {
+    'Synthesizer': 'h_syn',
+    'Lock-in': 'h_lockin',
+    'AWG': 'h_awg',
+    'Oscilloscope': 'h_oscillo',
+    'Power Supply': 'h_uca',
+    'Flow Controller': 'h_flow',
+    'Gauge Controller 1': 'h_gauge1',
+    'Gauge Controller 2': 'h_gauge2',
+    'Valve 1': 'h_valve1',
+    'Valve 2': 'h_valve2',
+}
+
 CONNECTION_TYPES = (
     'Ethernet',
     'COM',
@@ -81,32 +100,79 @@ class Threads:
         self.t_valve1.join()
         self.t_valve2.join()
 
+    def gather(self, *jobs, timeout=None):
+        """ Submit jobs to their worker threads all at once, and wait for all results.
+        Jobs on different instruments run concurrently.
+        Arguments
+            jobs: tuple (thread, func, *args)
+            timeout: float, seconds. None waits forever
+        Returns
+            results: list, in the same order as jobs
+        """
+        futures = [job[0].submit(job[1], *job[2:]) for job in jobs]
+        return gather(futures, timeout=timeout)
+
+
+def gather(futures, timeout=None):
+    """ Wait for a list of futures and return their results in order.
+    The first exception raised by any job is re-raised here.
+    """
+    done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+    if not_done:
+        raise TimeoutError(f'{len(not_done):d} instrument job(s) timed out')
+    return [f.result() for f in futures]
+
 
 class _WorkerThread(QtCore.QThread):
+    """ Dedicated thread for one instrument.
+    Jobs are executed in the order of submission, so that several
+    outstanding commands to the same instrument are pipelined safely.
+    """
 
     def __init__(self, name='', parent=None):
         super().__init__(parent)
         self._name = name
         self._queue = queue.Queue()
-        self._result = None
-        self._ev_loop = QtCore.QEventLoop()
         self.start()
 
     def run(self):
         while True:
-            func, args, kwargs = self._queue.get()
+            future, func, args, kwargs = self._queue.get()
             if func is None:
                 break
-            self._result = func(*args, **kwargs)
-            self._ev_loop.quit()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as err:
+                future.set_exception(err)
+
+    def submit(self, func, *args, **kwargs):
+        """ Put the job in the queue and return immediately.
+        Returns
+            future: concurrent.futures.Future
+        """
+        future = concurrent.futures.Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
 
     def call(self, func, *args, **kwargs):
-        self._queue.put((func, args, kwargs))
-        self._ev_loop.exec()
-        return self._result
+        """ Submit the job and block until it returns.
+        In the GUI thread, the Qt events are still processed while waiting.
+        """
+        future = self.submit(func, *args, **kwargs)
+        app = QtCore.QCoreApplication.instance()
+        if app and QtCore.QThread.currentThread() is app.thread():
+            ev_loop = QtCore.QEventLoop()
+            # queued connection: the quit is delivered even if the job
+            # finishes before the loop starts
+            future.add_done_callback(lambda _: QtCore.QMetaObject.invokeMethod(
+                ev_loop, 'quit', QtCore.Qt.ConnectionType.QueuedConnection))
+            ev_loop.exec()
+        return future.result()
 
     def join(self):
-        self._queue.put((None, (), {}))
+        self._queue.put((None, None, (), {}))
         self.wait()
 
 
@@ -157,7 +223,10 @@ class Handles:
                     value.close()
 
     def connect(self, inst_type: str, connection_type: str, inst_addr: str,
-                inst_model: str, is_sim=False):
+                inst_model: str, is_sim=False, cache_age=0.):
+        """ Connect to the instrument.
+        If cache_age > 0, a ShadowCache with this staleness window (seconds) is attached to the handle
+        """
 
         if is_sim:
             if connection_type == 'Ethernet':
@@ -181,6 +250,8 @@ class Handles:
                 conn = _VISAHandle(inst_addr)
             else:
                 raise ConnectionError('Connection type not supported.')
+        if cache_age > 0:
+            conn.cache = ShadowCache(cache_age)
 
         if inst_type == 'Synthesizer':
             self.h_syn = conn
@@ -233,7 +304,27 @@ class Handles:
         else:
             raise ValueError('Instrument type not supported.')
 
+    def get_stats(self):
+        """ Communication statistics of the connected instruments
+        Returns
+            stats: dict         {inst_type: InstStats}
+        """
+        stats = {}
+        for inst_type, h_name in _INST_HANDLE_NAMES.items():
+            h = getattr(self, h_name, None)
+            if h is not None and h.stats is not None:
+                stats[inst_type] = h.stats
+        return stats
+
+    def dump_stats(self, filename):
+        """ Save the communication statistics to a json file """
+        dump_stats(self.get_stats(), filename)
+
     def refresh(self, inst_type):
+        # read the true instrument state, not the shadow
+        h = getattr(self, _INST_HANDLE_NAMES[inst_type], None)
+        if h is not None and h.cache is not None:
+            h.cache.refresh()
         if inst_type == 'Synthesizer':
             get_syn_info(self.h_syn, self.info_syn)
         elif inst_type == 'Lock-in':
@@ -252,6 +343,66 @@ class Handles:
             get_gauge_info(self.h_gauge2, self.info_gauge2)
 
 
+class ShadowCache:
+    """ Write-through shadow of the instrument state, attached to a handle as handle.cache.
+    Entries are keyed by (attribute, channel) of the API_MAP functions,
+    so that set_x and get_x of the same attribute share one entry.
+    A set_ function is skipped if the same command was sent within max_age seconds,
+    and a get_ function returns the cached value within max_age seconds.
+    Action functions (e.g. init_syn, reset) clear the whole cache,
+    because they may change any state of the instrument.
+
+    Arguments
+        max_age: float          staleness window, seconds
+    """
+
+    def __init__(self, max_age=1.):
+        self.max_age = max_age
+        # {key: (command, time)}
+        self._cmds = {}
+        # {key: (value, time)}
+        self._values = {}
+
+    def is_sent(self, key, cmd):
+        """ The same command was sent within the staleness window """
+        if key in self._cmds:
+            last_cmd, t = self._cmds[key]
+            return last_cmd == cmd and time() - t < self.max_age
+        return False
+
+    def set_sent(self, key, cmd, value=None, has_value=False):
+        """ Record a sent command. Its value is cached too if it is known """
+        t = time()
+        self._cmds[key] = (cmd, t)
+        if has_value:
+            self._values[key] = (value, t)
+        else:
+            self._values.pop(key, None)
+
+    def get(self, key):
+        """ Returns
+            is_hit: bool
+            value: the cached value
+        """
+        if key in self._values:
+            value, t = self._values[key]
+            if time() - t < self.max_age:
+                return True, value
+        return False, None
+
+    def put(self, key, value):
+        self._values[key] = (value, time())
+
+    def invalidate(self, key):
+        self._cmds.pop(key, None)
+        self._values.pop(key, None)
+
+    def refresh(self):
+        """ Forget everything, so that the next calls go to the instrument """
+        self._cmds.clear()
+        self._values.clear()
+
+
 class _BadHandle:
     """ A "bad" instrument handle class.
     Used for representing the error instrument connection.
@@ -260,6 +411,8 @@ class _BadHandle:
 
     is_active = False
     is_sim = False
+    cache = None
+    stats = None
 
     def __init__(self, addr='', port='', msg='Connection failure'):
         self.addr = addr
@@ -285,7 +438,10 @@ class _SocketHandle:
         self._ip = ip
         self._port = port
         self.msg = ''
+        self.cache = None
+        self.stats = InstStats()
 
+    @timed
     def query(self, code=None, byte=64, skip=0):
         """ Send and read
 
@@ -316,15 +472,30 @@ class _SocketHandle:
             msg = self.recv(byte, skip=skip)
             return msg
 
+    @timed
     def send(self, code):
         """ Send only """
 
         code_str = code + self._le
         self._handle.send(code_str.encode(self._enc))
 
+    @timed
     def recv(self, byte, skip=0):
         return self._handle.recv(byte)[skip:].decode(self._enc).strip()
 
+    @timed
+    def query_raw(self, code, byte):
+        """ Send and read exactly byte number of raw bytes (binary transfer) """
+
+        self.send(code)
+        data = bytearray()
+        while len(data) < byte:
+            chunk = self._handle.recv(byte - len(data))
+            if not chunk:
+                break
+            data.extend(chunk)
+        return bytes(data)
+
     def close(self):
         self._handle.close()
 
@@ -363,7 +534,10 @@ class _COMHandle:
         self._enc = encoding
         self._term = terminal_code
         self.msg = ''
+        self.cache = None
+        self.stats = InstStats()
 
+    @timed
     def query(self, code=None, byte=64, skip=0):
         """ Send and read
 
@@ -394,15 +568,28 @@ class _COMHandle:
             msg = self.recv(byte, skip=skip)
             return msg
 
+    @timed
     def send(self, code):
         """ Send only """
 
         code_str = code + self._le
         self._handle.write(code_str.encode(self._enc))
 
+    @timed
     def recv(self, byte, skip=0):
         return self._handle.read(byte)[skip:].decode(self._enc).strip()
 
+    @timed
+    def query_raw(self, code, byte):
+        """ Send and read exactly byte number of raw bytes (binary transfer) """
+
+        self.send(code)
+        data = bytes(self._handle.read(byte))
+        if len(data) < byte:
+            # pyserial returns what it has got when the read times out
+            self.stats.timeout(code)
+        return data
+
     @property
     def is_sim(self):
         return False
@@ -429,6 +616,7 @@ class _VISAHandle:
 
     Public methods
         query(code, byte, skip) -> str             query inst
+        query_raw(code, byte) -> bytes             query inst binary transfer
         send(code)                                 send code to inst
         recv(byte)                                 receive byte from inst
         close()                                    close connection
@@ -443,7 +631,10 @@ class _VISAHandle:
         self._enc = encoding
         self._term = terminal_code
         self.msg = ''
+        self.cache = None
+        self.stats = InstStats()
 
+    @timed
     def query(self, code=None, byte=64, skip=0):
         """ Send and read
 
@@ -472,15 +663,24 @@ class _VISAHandle:
             msg = self.recv(byte, skip=skip)
             return msg
 
+    @timed
     def send(self, code):
         """ Send only """
 
         code_str = code + self._le
         _ = self._handle.write(code_str.encode(self._enc))
 
+    @timed
     def recv(self, byte, skip=0):
         return self._handle.read(byte)[skip:].decode(self._enc).strip()
 
+    @timed
+    def query_raw(self, code, byte):
+        """ Send and read exactly byte number of raw bytes (binary transfer) """
+
+        self.send(code)
+        return bytes(self._handle.read_bytes(byte))
+
     def close(self):
         pass
 
@@ -500,16 +700,11 @@ class _VISAHandle:
 class DynamicSynAPI(SynAPI):
     """ Dynamic API loading API_MAP file to create real functions """
 
-    def __init__(self, api_map_file, handles):
+    def __init__(self, api_map_file):
         functions = _create_funcs(api_map_file)
-        self.handles = handles
         for name, func in functions.items():
             setattr(self, name, func)
 
-    def submit(self, func_name, handle, *args, **kwargs):
-        api_func = getattr(self, func_name)
-        self.handles.submit_task(api_func, handle, *args, **kwargs)
-
 
 class DynamicLockinAPI(LockinAPI):
     """ Dynamic API loading API_MAP file to create real functions """
@@ -565,107 +760,212 @@ class DynamicGaugeAPI(GaugeAPI):
             setattr(self, name, func)
 
 
+# {api_map_file: (api_map, functions)}, functions built from the compiled api_map
+_FUNCS_CACHE = {}
+
+
 def _create_funcs(api_map_file):
-    """ Create functions from the API_MAP file """
-    with open(api_map_file, 'r') as f:
-        api_map = yaml.safe_load(''.join(f.readlines()))
+    """ Create functions from the API_MAP file
+    Each function also carries its command encoder and reply decoder as
+    attributes (kind, encode, decode), so that the same API_MAP can drive
+    the asyncio handles in base_async.py.
+    The functions do not hold any state (the handle is passed in),
+    so they are built once per API_MAP and shared by all the connections.
+    """
+    api_map = load_api_map(api_map_file)
+    key = os.fspath(api_map_file)
+    cached = _FUNCS_CACHE.get(key)
+    # rebuild only if the API_MAP file has changed
+    if cached and cached[0] is api_map:
+        return cached[1]
     functions = {}
     for item in api_map['functions']:
         func_name = item['name']
-        arg_names = item['args']
-        kwarg_names = item['kwargs']
-        cmd = item['cmd']
+        encode = _make_encoder(item, api_map)
         if func_name.startswith('set_'):
-            # check if there is linked presets to call
-            if 'link_preset' in item:
-                # we need to find which argument(s) matches the linked
-                # preset, and replace the input value with the preset dict value
-                arg_indices = []
-                for i, arg in enumerate(arg_names):
-                    if arg == item['link_preset']:
-                        preset_dict = api_map['presets'][arg]
-                        arg_indices.append(i)
-                kwarg_indices = []
-                for i, kwarg in enumerate(kwarg_names):
-                    if kwarg == item['link_preset']:
-                        preset_dict = api_map['presets'][kwarg]
-                        kwarg_indices.append(i)
-                # to define the function, 'cmd=cmd' is essential.
-                # without this, the cmd will always be the last cmd in the item['cmd'] list
-                # instead of the correct one
-                def func(handle, *args, cmd=cmd, arg_indices=arg_indices, preset_dict=preset_dict,
-                         **kwargs):
-                    new_args = []
-                    new_kwargs = {}
-                    for i, arg in enumerate(args):
-                        if i in arg_indices:
-                            new_args.append(preset_dict[args[i]])
-                        else:
-                            new_args.append(arg)
-                    for i, kwarg in enumerate(kwargs):
-                        if kwarg in kwarg_indices:
-                            new_kwargs[kwarg] = preset_dict[kwarg[i]]
-                        else:
-                            new_kwargs[kwarg] = kwargs[kwarg]
-                    code = cmd.format(*new_args, **new_kwargs)
-                    handle.send(code)
-            else:
-                def func(handle, *args, cmd=cmd, **kwargs):
-                    code = cmd.format(*args, **kwargs)
-                    handle.send(code)
+            kind = 'set'
+            decode = None
         elif func_name.startswith('get_'):
-            # The data type choice must be done outside the function
-            # declaration. Otherwise, each function will go through the
-            # conditional statements and fail to match the correct data type.
-            # check if there is linked presets to call
-            if 'link_preset' in item:
-                # we need to find which argument(s) matches the linked
-                # preset, and replace the input value with the preset dict value
-                def func(handle, *args, cmd=cmd, preset_name=item['link_preset'], **kwargs):
-                    code = cmd.format(*args, **kwargs)
-                    value_str = handle.query(code)
-                    # find the corresponding key in preset
-                    is_found = False
-                    for key, value in api_map['presets'][preset_name].items():
-                        if str(value) == value_str:
-                            return key
-                    if not is_found:
-                        raise ValueError('Returned value not found in preset.')
+            if item['dtype'] == 'bytes':
+                # binary transfer. the caller has to tell how many bytes to read
+                kind = 'bytes'
+                decode = None
             else:
-                if item['dtype'] == 'float':
-                    def func(handle, *args, cmd=cmd, **kwargs):
-                        code = cmd.format(*args, **kwargs)
-                        value_str = handle.query(code)
-                        return float(value_str)
-                elif item['dtype'] == 'int':
-                    def func(handle, *args, cmd=cmd, **kwargs):
-                        code = cmd.format(*args, **kwargs)
-                        value_str = handle.query(code)
-                        return int(value_str)
-                elif item['dtype'] == 'bool':
-                    def func(handle, *args, cmd=cmd, **kwargs):
-                        code = cmd.format(*args, **kwargs)
-                        value_str = handle.query(code)
-                        # for boolean values, there are two possibilities
-                        # either the string is integer 0 or 1
-                        try:
-                            return bool(int(value_str))
-                        except ValueError:  # value_str is not an integer
-                            if value_str.upper() in ('ON', 'TRUE'):
-                                return True
-                            elif value_str.upper() in ('OFF', 'FALSE'):
-                                return False
-                            else:
-                                raise ValueError('Returned value not recognized.')
-                elif item['dtype'] == 'str':
-                    def func(handle, *args, cmd=cmd, **kwargs):
-                        code = cmd.format(*args, **kwargs)
-                        value_str = handle.query(code)
-                        return value_str
-                else:
-                    raise ValueError('Data type not supported.')
+                kind = 'get'
+                decode = _make_decoder(item, api_map)
         else:
-            def func(handle, *args, cmd=cmd, **kwargs):
-                pass
-        functions[func_name] = func
+            # action command without return value
+            kind = 'action'
+            decode = None
+        functions[func_name] = _make_func(kind, encode, decode, _make_shadow(item))
+    _FUNCS_CACHE[key] = (api_map, functions)
     return functions
+
+
+def _make_func(kind, encode, decode, shadow=None):
+    """ Bind the encoder and decoder into a blocking API function.
+    If the handle has a ShadowCache, the function goes through it using
+    the (key, value) functions in shadow. shadow is None for uncacheable functions
+    """
+
+    if kind == 'get':
+        def func(handle, *args, **kwargs):
+            cache = getattr(handle, 'cache', None)
+            if cache is not None and shadow and not kwargs:
+                key = shadow[0](args)
+                is_hit, value = cache.get(key)
+                if not is_hit:
+                    value = decode(handle.query(encode(*args)))
+                    cache.put(key, value)
+                return value
+            value_str = handle.query(encode(*args, **kwargs))
+            return decode(value_str)
+    elif kind == 'bytes':
+        def func(handle, *args, byte=64, **kwargs):
+            return handle.query_raw(encode(*args, **kwargs), byte)
+    elif kind == 'set':
+        def func(handle, *args, **kwargs):
+            code = encode(*args, **kwargs)
+            cache = getattr(handle, 'cache', None)
+            if cache is not None and shadow and not kwargs:
+                key = shadow[0](args)
+                if cache.is_sent(key, code):
+                    return
+                handle.send(code)
+                has_value, value = shadow[1](args)
+                cache.set_sent(key, code, value, has_value)
+            else:
+                handle.send(code)
+    else:
+        def func(handle, *args, **kwargs):
+            handle.send(encode(*args, **kwargs))
+            cache = getattr(handle, 'cache', None)
+            if cache is not None:
+                cache.refresh()
+    func.kind = kind
+    func.encode = encode
+    func.decode = decode
+    return func
+
+
+def _make_shadow(item):
+    """ Create the functions that map the arguments of a set_/get_ function
+    to its shadow cache key, and a set_ function to the value read back by get_.
+    Returns
+        (key, value): (function, function), or None if the function cannot be cached
+    """
+
+    name = item['name']
+    if not (name.startswith('set_') or name.startswith('get_')):
+        return None
+    if item.get('volatile') or item.get('dtype') in ('bytes', 'float_list'):
+        return None
+    attribute = item.get('attribute', name[4:])
+    has_chan = item.get('channel', False)
+
+    def key(args):
+        return attribute, args[0] if has_chan and args else None
+
+    unit = item.get('unit')
+
+    def value(args):
+        """ Returns
+            has_value: bool         the value is known
+            value: in the unit returned by get_
+        """
+        args = args[1:] if has_chan else args
+        if unit:
+            if len(args) != 2:
+                return False, None
+            factor = _unit_factor(unit, args[1])
+            if factor is None:
+                return False, None
+            return True, args[0] * factor
+        if len(args) != 1:
+            return False, None
+        return True, args[0]
+
+    return key, value
+
+
+def _unit_factor(unit, unit_str):
+    """ Factor to convert unit_str (e.g. 'MHz') to the base unit of the API_MAP unit spec """
+
+    base = unit['base'].upper()
+    unit_str = unit_str.upper()
+    if unit_str == base:
+        return 1
+    prefix = unit_str[:-len(base)]
+    if unit_str.endswith(base) and prefix in unit.get('prefix', {}):
+        return float(unit['prefix'][prefix])
+    return None
+
+
+def _make_encoder(item, api_map):
+    """ Create the function that formats the command code from the arguments """
+
+    cmd = item['cmd']
+    if item['name'].startswith('set_') and 'link_preset' in item:
+        # we need to find which argument(s) matches the linked
+        # preset, and replace the input value with the preset dict value
+        preset_name = item['link_preset']
+        preset_dict = api_map['presets'][preset_name]
+        arg_indices = [i for i, arg in enumerate(item['args']) if arg == preset_name]
+
+        def encode(*args, **kwargs):
+            new_args = [preset_dict[arg] if i in arg_indices else arg for i, arg in enumerate(args)]
+            new_kwargs = {key: preset_dict[value] if key == preset_name else value
+                          for key, value in kwargs.items()}
+            return cmd.format(*new_args, **new_kwargs)
+    elif item['name'].startswith('set_') and item.get('dtype') == 'float_list':
+        # the first argument is a sequence of values,
+        # which is uploaded as a comma separated list
+        elem_fmt = item['elem_fmt']
+
+        def encode(values, *args, **kwargs):
+            value_str = ','.join(elem_fmt.format(v) for v in values)
+            return cmd.format(value_str, *args, **kwargs)
+    else:
+        # the format template itself
+        encode = cmd.format
+    return encode
+
+
+def _make_decoder(item, api_map):
+    """ Create the function that converts the reply string of a get_ function """
+
+    # The data type choice must be done outside the function
+    # declaration. Otherwise, each function will go through the
+    # conditional statements and fail to match the correct data type.
+    if 'link_preset' in item:
+        # {str(value): key} of the preset
+        reverse_dict = api_map['reverse_presets'][item['link_preset']]
+
+        def decode(value_str):
+            try:
+                return reverse_dict[value_str]
+            except KeyError:
+                raise ValueError('Returned value not found in preset.') from None
+    elif item['dtype'] == 'float':
+        decode = float
+    elif item['dtype'] == 'int':
+        decode = int
+    elif item['dtype'] == 'bool':
+        def decode(value_str):
+            # for boolean values, there are two possibilities
+            # either the string is integer 0 or 1
+            try:
+                return bool(int(value_str))
+            except ValueError:  # value_str is not an integer
+                if value_str.upper() in ('ON', 'TRUE'):
+                    return True
+                elif value_str.upper() in ('OFF', 'FALSE'):
+                    return False
+                else:
+                    raise ValueError('Returned value not recognized.')
+    elif item['dtype'] == 'str':
+        def decode(value_str):
+            return value_str
+    else:
+        raise ValueError('Data type not supported.')
+    return decode
@@ -0,0 +1,278 @@
+#! encoding = utf-8
+
+""" asyncio instrument handles
+All handles share one event loop (AsyncLoop) running in a single background
+thread, which can drive every instrument slot in INST_TYPES at once,
+instead of one dedicated QThread per instrument.
+
+The Ethernet handle is asyncio-native. Serial, VISA and simulator handles
+have no asyncio interface, so the blocking handles in base.py are wrapped
+and run in the executor of the shared loop.
+
+Every operation has a timeout, and pending operations can be cancelled.
+API functions created from the API_MAP files are called through
+`await handle.call(api_func, *args)`.
+
+This module is opt-in: Handles and the scan threads still use the blocking
+handles of base.py. An asyncio handle is opened by running
+`open_handle(...)` in an AsyncLoop.
+"""
+
+import asyncio
+import threading
+import concurrent.futures
+from PyMMSp.inst.base import INST_TYPES, _COMHandle, _VISAHandle
+from PyMMSp.inst.base_simulator import SimHandle
+
+
+async def _wait_for(aw, timeout):
+    """ asyncio.wait_for raising the builtin TimeoutError, like the blocking handles.
+    Before Python 3.11, asyncio.TimeoutError is a different class """
+    try:
+        return await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f'no response within {timeout} s') from None
+
+
+class AsyncLoop:
+    """ Shared asyncio event loop running in a daemon thread """
+
+    def __init__(self, name='thread_aio'):
+        self._loop = asyncio.new_event_loop()
+        # blocking handles run here. One worker per instrument slot at most,
+        # and the threads are only created when needed
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(INST_TYPES), thread_name_prefix=name)
+        self._loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self._loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def submit(self, coro, timeout=None):
+        """ Schedule the coroutine in the loop from any other thread
+        Returns
+            future: concurrent.futures.Future
+        """
+        if timeout:
+            coro = _wait_for(coro, timeout)
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def run(self, coro, timeout=None):
+        """ Run the coroutine in the loop and block until it returns """
+        return self.submit(coro, timeout=timeout).result()
+
+    def gather(self, *coros, timeout=None):
+        """ Run several coroutines (e.g. on different instruments) concurrently,
+        and block until all of them return.
+        On timeout, all pending coroutines are cancelled.
+        Returns
+            results: list, in the same order as coros
+        """
+        async def _gather():
+            return await asyncio.gather(*coros)
+        return self.run(_gather(), timeout=timeout)
+
+    def join(self):
+        """ Stop the loop and wait for the thread to finish """
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._loop.close()
+
+
+class _AsyncHandle:
+    """ Common parts of the asyncio handles.
+    A lock makes sure that the send/receive of one query is not interleaved
+    with another query to the same instrument.
+    """
+
+    def __init__(self, timeout=1):
+        self._timeout = timeout
+        self._lock = asyncio.Lock()
+        self.msg = ''
+
+    async def call(self, api_func, *args, **kwargs):
+        """ Call an API function created by base._create_funcs on this handle """
+
+        if api_func.kind == 'get':
+            return api_func.decode(await self.query(api_func.encode(*args, **kwargs)))
+        elif api_func.kind == 'bytes':
+            byte = kwargs.pop('byte', 64)
+            return await self.query_raw(api_func.encode(*args, **kwargs), byte)
+        else:
+            await self.send(api_func.encode(*args, **kwargs))
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+
+class _AsyncSocketHandle(_AsyncHandle):
+    """ Ethernet socket connection using asyncio streams """
+
+    def __init__(self, ip, port, timeout=1, line_ending='\n', encoding='ASCII', terminal_code=None):
+        super().__init__(timeout=timeout)
+        self._ip = ip
+        self._port = port
+        self._le = line_ending
+        self._enc = encoding
+        self._term = terminal_code
+        self._reader = None
+        self._writer = None
+
+    async def open(self):
+        self._reader, self._writer = await _wait_for(
+            asyncio.open_connection(self._ip, int(self._port)), self._timeout)
+
+    async def query(self, code=None, byte=64, skip=0):
+        """ Send and read
+
+        Arguments
+            code: str               code to send for query
+            byte: int               query byte
+            skip: int               skip leading characters
+        Returns
+            msg: str                query message
+        """
+
+        async with self._lock:
+            if code:
+                await self._send(code)
+            if self._term:      # loop until get terminal char
+                ml = []
+                while True:
+                    msg = await self._recv(byte, skip=skip)
+                    ml.append(msg)
+                    if msg.endswith(self._term) or not msg:
+                        break
+                return ''.join(ml)
+            else:
+                return await self._recv(byte, skip=skip)
+
+    async def query_raw(self, code, byte):
+        """ Send and read exactly byte number of raw bytes (binary transfer) """
+
+        async with self._lock:
+            await self._send(code)
+            return await _wait_for(self._reader.readexactly(byte), self._timeout)
+
+    async def send(self, code):
+        """ Send only """
+
+        async with self._lock:
+            await self._send(code)
+
+    async def recv(self, byte, skip=0):
+        async with self._lock:
+            return await self._recv(byte, skip=skip)
+
+    async def _send(self, code):
+        code_str = code + self._le
+        self._writer.write(code_str.encode(self._enc))
+        await _wait_for(self._writer.drain(), self._timeout)
+
+    async def _recv(self, byte, skip=0):
+        data = await _wait_for(self._reader.read(byte), self._timeout)
+        return data[skip:].decode(self._enc).strip()
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            await self._writer.wait_closed()
+
+    @property
+    def addr(self):
+        return ':'.join([self._ip, self._port])
+
+    @property
+    def is_sim(self):
+        return False
+
+    @property
+    def is_active(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+
+class _AsyncExecutorHandle(_AsyncHandle):
+    """ Adapter for blocking handles (serial, VISA, simulator).
+    The blocking calls run in the executor of the event loop.
+
+    Note that a blocking call which times out cannot be interrupted:
+    it keeps the lock of this handle until the underlying driver returns,
+    so that no other command is interleaved with the hung one.
+    """
+
+    def __init__(self, handle, timeout=1):
+        super().__init__(timeout=timeout)
+        self._handle = handle
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        await self._lock.acquire()
+        fut = loop.run_in_executor(None, func, *args)
+        # release the lock only when the blocking call really returns
+        fut.add_done_callback(lambda _: self._lock.release())
+        try:
+            return await _wait_for(asyncio.shield(fut), self._timeout)
+        except TimeoutError:
+            self.msg = 'Timeout'
+            raise
+
+    async def query(self, code=None, byte=64, skip=0):
+        return await self._run(self._handle.query, code, byte, skip)
+
+    async def query_raw(self, code, byte):
+        return await self._run(self._handle.query_raw, code, byte)
+
+    async def send(self, code):
+        return await self._run(self._handle.send, code)
+
+    async def recv(self, byte, skip=0):
+        return await self._run(self._handle.recv, byte, skip)
+
+    async def close(self):
+        if hasattr(self._handle, 'close'):
+            await self._run(self._handle.close)
+
+    @property
+    def is_sim(self):
+        return self._handle.is_sim
+
+    @property
+    def is_active(self):
+        return self._handle.is_active
+
+    def set_decoder(self, decoder):
+        self._handle.set_decoder(decoder)
+
+
+async def open_handle(connection_type: str, inst_addr: str, is_sim=False, timeout=1):
+    """ Open an asyncio instrument handle. Mirrors Handles.connect
+    Returns
+        handle: _AsyncSocketHandle | _AsyncExecutorHandle
+    """
+
+    if is_sim:
+        if connection_type in ('Ethernet', 'COM', 'GPIB VISA'):
+            return _AsyncExecutorHandle(SimHandle(), timeout=timeout)
+        else:
+            raise ConnectionError('Connection type not supported.')
+    else:
+        loop = asyncio.get_running_loop()
+        if connection_type == 'Ethernet':
+            # split the IP address and port
+            ip, port = inst_addr.split(':')
+            handle = _AsyncSocketHandle(ip, port, timeout=timeout)
+            await handle.open()
+            return handle
+        elif connection_type == 'COM':
+            handle = await loop.run_in_executor(None, _COMHandle, inst_addr, timeout)
+            return _AsyncExecutorHandle(handle, timeout=timeout)
+        elif connection_type == 'GPIB VISA':
+            handle = await loop.run_in_executor(None, _VISAHandle, inst_addr, timeout)
+            return _AsyncExecutorHandle(handle, timeout=timeout)
+        else:
+            raise ConnectionError('Connection type not supported.')
@@ -6,6 +6,8 @@ because each instrument module imports the BaseSimDecoder class
 and then the base.py module imports all instrument modules
 """
 
+from PyMMSp.inst.stats import InstStats, timed
+
 
 class BaseSimDecoder:
     """ Basic simulator decoder class
@@ -48,20 +50,31 @@ class SimHandle:
         """ ignore args and kwargs passed to real instrument handle """
         self._stat = True
         self._decoder = BaseSimDecoder()
+        self.cache = None
+        self.stats = InstStats()
 
+    @timed
     def send(self, code):
         """ Interpret the code and send the result to internal buffer """
         self._decoder.interpret(code)
 
+    @timed
     def recv(self, byte=64, skip=0):
         """ To make life easier, read directly the buffer string instead of bytes """
         return self._decoder.str_out()
 
+    @timed
     def query(self, code, byte=64, skip=0):
         """ Interpret the code and send the result to internal buffer """
         self.send(code)
         return self.recv(byte, skip)
 
+    @timed
+    def query_raw(self, code, byte):
+        """ Interpret the code and read raw bytes from the internal byte buffer """
+        self.send(code)
+        return bytes(self._decoder.byte_out(byte))
+
     def close(self):
         self._stat = False
 
@@ -1,8 +1,8 @@
 #! encoding = utf-8
 from dataclasses import dataclass, fields
 from abc import ABC
-import yaml
 from PyMMSp.inst.base_simulator import BaseSimDecoder
+from PyMMSp.inst.api_map import load_api_map
 
 
 GAUGE_CTRL_MODELS = (
@@ -58,8 +58,7 @@ class GaugeSimDecoder(BaseSimDecoder):
             sep_level: str, separator of multiple levels in one command, default is :
         """
         super().__init__()
-        with open(api_map_file, 'r') as f:
-            self._api_map = yaml.safe_load(''.join(f.readlines()))
+        self._api_map = load_api_map(api_map_file)
         self._info = Gauge_Info(inst_name=inst_name)
         self._enc = enc
         self._sep_cmd = sep_cmd
@@ -1,8 +1,12 @@
 #! encoding = utf-8
 from dataclasses import dataclass, fields
 from abc import ABC
-import yaml
+from functools import lru_cache
+from math import log
+from time import perf_counter
+import numpy as np
 from PyMMSp.inst.base_simulator import BaseSimDecoder
+from PyMMSp.inst.api_map import load_api_map
 
 
 LOCKIN_MODELS = (
@@ -57,6 +61,12 @@ SAMPLE_RATE = ('1/16 Hz', '1/8 Hz', '1/4 Hz', '1/2 Hz', '1 Hz',
                '2 Hz', '4 Hz', '8 Hz', '16 Hz', '32 Hz', '64 Hz',
                '128 Hz', '256 Hz', '512 Hz', 'Trigger')
 
+# LOCKIN SAMPLE RATE LIST (IN HZ). The last 'Trigger' option has no fixed rate
+SAMPLE_RATE_VAL = (0.0625, 0.125, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# LOCKIN INTERNAL BUFFER SIZE (POINTS PER CHANNEL)
+BUFFER_MAX_PTS = 16383
+
 MODU_MODE = ('NONE', 'AM', 'FM')
 
 
@@ -83,6 +93,11 @@ class Lockin_Info:
     front1_txt: str = ''
     front2_txt: str = ''
     sample_rate_idx: int = 0
+    x: float = 0.
+    trig_start: bool = False
+    buffer_mode: int = 0
+    buffer_pts: int = 0
+    err_msg: str = ''
 
     def reset(self):
         for field in fields(self):
@@ -155,7 +170,52 @@ class LockinAPI(ABC):
     def get_err_msg(self, handle) -> str:
         pass
 
-    def get_buffer(self, handle, byte) -> str:
+    def get_sens(self, handle) -> int:
+        pass
+
+    def set_sens(self, handle, sens_idx: int):
+        pass
+
+    def get_tau(self, handle) -> int:
+        pass
+
+    def set_tau(self, handle, tau_idx: int):
+        pass
+
+    def get_octave(self, handle) -> int:
+        pass
+
+    def set_octave(self, handle, octave_idx: int):
+        pass
+
+    def get_single_x(self, handle) -> float:
+        pass
+
+    def get_sample_rate(self, handle) -> int:
+        pass
+
+    def set_sample_rate(self, handle, rate_idx: int):
+        pass
+
+    def set_trig_start(self, handle, stat: bool):
+        pass
+
+    def set_buffer_mode(self, handle, mode: int):
+        pass
+
+    def start_buffer(self, handle):
+        pass
+
+    def pause_buffer(self, handle):
+        pass
+
+    def reset_buffer(self, handle):
+        pass
+
+    def get_buffer_pts(self, handle) -> int:
+        pass
+
+    def get_buffer(self, handle, chan: int, start: int, n: int, byte=0) -> bytes:
         pass
 
 
@@ -170,16 +230,102 @@ class LockinSimDecoder(BaseSimDecoder):
             sep_level: str, separator of multiple levels in one command, default is :
         """
         super().__init__()
-        with open(api_map_file, 'r') as f:
-            self._api_map = yaml.safe_load(''.join(f.readlines()))
+        self._api_map = load_api_map(api_map_file)
         self._info = Lockin_Info(inst_name=inst_name)
         self._enc = enc
         self._sep_cmd = sep_cmd
         self._sep_level = sep_level
+        self._index = self._compile_api_map()
+        self._rng = np.random.default_rng()
+        # internal buffer: points stored before the last start, and the start time (None if paused)
+        self._buffer_n0 = 0
+        self._buffer_t0 = None
+
+    def _compile_api_map(self):
+        """ Index the API_MAP by (kind, command header), e.g. 'SENS {0:d}' -> ('set', 'SENS'),
+        kind being 'get', 'set' or 'action' """
+        index = {}
+        for item in self._api_map['functions']:
+            header = item['cmd'].upper().split(' ', 1)[0]
+            if header.endswith('?'):
+                kind = 'get'
+            elif ' ' in item['cmd']:
+                kind = 'set'
+            else:
+                kind = 'action'
+            index[kind, header] = item
+        return index
 
     def interpret(self, cmd_queue):
         """  Interpret code and return its value """
-        pass
+        # multiple commands may be separated by ;
+        # - action without return (like 'STRT')
+        # - setting value   (like 'SRAT 13')
+        # - getting value   (like 'SPTS?', 'TRCB? 1,0,100')
+        for cmd in cmd_queue.split(self._sep_cmd):
+            header, _, value_str = cmd.strip().upper().partition(' ')
+            if header.endswith('?'):
+                self._interpret_get(header, value_str.strip())
+            elif value_str:
+                self._interpret_set(header, value_str.strip())
+            elif header:
+                self._interpret_action(header)
+
+    def _interpret_get(self, header, value_str):
+        """ Interpret get value command
+        Push the response to internal buffer. The binary transfer TRCB? goes to the byte buffer
+        """
+        if header == 'TRCB?':
+            _, start, n = (int(v) for v in value_str.split(','))
+            # the instrument only transfers the points already stored
+            n = max(min(n, self._buffer_pts() - start), 0)
+            self.byte_in(self._sample(n).astype('<f4').tobytes())
+            return
+        if header == 'OUTP?':
+            self._info.x = float(self._sample(1)[0])
+        elif header == 'SPTS?':
+            self._info.buffer_pts = self._buffer_pts()
+        item = self._index.get(('get', header))
+        if item and 'attribute' in item:
+            self.str_in(str(getattr(self._info, item['attribute'])))
+
+    def _interpret_set(self, header, value_str):
+        """ Interpret set value command
+        Register the value to the internal Info class
+        """
+        item = self._index.get(('set', header))
+        if not item:
+            return
+        if item['dtype'] == 'float':
+            value = float(value_str)
+        else:
+            # in the instrument boolean value is still represented as integer
+            value = int(value_str)
+        setattr(self._info, item['attribute'], value)
+
+    def _interpret_action(self, header):
+        """ Interpret the buffer commands STRT, PAUS and REST """
+        if header == 'STRT':
+            if self._buffer_t0 is None:
+                self._buffer_t0 = perf_counter()
+        elif header == 'PAUS':
+            self._buffer_n0 = self._buffer_pts()
+            self._buffer_t0 = None
+        elif header == 'REST':
+            self._buffer_n0 = 0
+            self._buffer_t0 = None
+
+    def _buffer_pts(self):
+        """ Number of points stored in the buffer, filled at the sample rate since the last start.
+        Nothing is stored at the 'Trigger' sample rate, as the simulator receives no trigger """
+        n = self._buffer_n0
+        if self._buffer_t0 is not None and self._info.sample_rate_idx < len(SAMPLE_RATE_VAL):
+            n += int((perf_counter() - self._buffer_t0) * SAMPLE_RATE_VAL[self._info.sample_rate_idx])
+        return min(n, BUFFER_MAX_PTS)
+
+    def _sample(self, n):
+        """ n random readings, at 1% of the sensitivity """
+        return self._rng.standard_normal(n) * _SENS_VAL[self._info.sens_idx] * 1e-2
 
 
 def get_lockin_info(handle, info):
@@ -187,6 +333,63 @@ def get_lockin_info(handle, info):
     pass
 
 
+def decode_buffer(raw):
+    """ Decode the binary buffer transfer (TRCB?) of the lockin.
+    Each point is an IEEE 754 single precision float, 4 bytes, little endian.
+    Arguments
+        raw: bytes
+    Returns
+        data: np.array (float64)
+    """
+
+    n = len(raw) // 4
+    return np.frombuffer(raw, dtype='<f4', count=n).astype(np.float64)
+
+
+def buffer_acq_time(n, rate_idx):
+    """ Time (in ms) needed to fill n points in the lockin buffer """
+
+    return n / SAMPLE_RATE_VAL[rate_idx] * 1e3
+
+
+def settle_time(tau_idx, octave_idx, tol):
+    """ Time (in ms) for the lockin output to settle after a step of the input.
+    The low pass filter of slope octave_idx is (octave_idx + 1) cascaded RC stages,
+    whose step response leaves a residual of exp(-x) * sum_k<n x^k / k!, x = t / tau.
+    Arguments
+        tau_idx: int, time constant index
+        octave_idx: int, filter slope index
+        tol: float, allowed residual as a fraction of the step
+    Returns
+        t: float (ms)
+    """
+
+    return _settle_x(octave_idx + 1, tol) * TAU_VAL[tau_idx]
+
+
+@lru_cache(maxsize=4096)
+def _settle_x(n, tol):
+    """ Solve exp(-x) * sum_k<n x^k / k! = tol for x, the settling time in units of tau """
+
+    if tol >= 1:
+        return 0.
+    # g(x) = ln(residual / tol) is decreasing and concave: Newton's method from
+    # x = -ln(tol) (the solution for n = 1) overshoots once, then converges from above
+    x = -log(tol)
+    for _ in range(100):
+        terms = [1.]
+        for k in range(1, n):
+            terms.append(terms[-1] * x / k)
+        s = sum(terms)
+        g = -x + log(s) - log(tol)
+        # g'(x) = -(x^(n-1) / (n-1)!) / s
+        dx = g * s / terms[-1]
+        x += dx
+        if abs(dx) < 1e-12 * x:
+            break
+    return x
+
+
 def init_lia(handle):
     """ Initiate the lockin with default settings.
         Returns visaCode
@@ -0,0 +1,193 @@
+#! encoding = utf-8
+
+""" Communication statistics of the instrument handles.
+Every handle records the latency of each command in a fixed-bucket histogram
+(log-spaced, BUCKETS_PER_DECADE buckets per decade from MIN_LATENCY to MAX_LATENCY),
+so that recording is a constant time list increment and cheap enough to leave on.
+"""
+
+import json
+import functools
+import threading
+from math import log10, floor
+from time import perf_counter
+
+MIN_LATENCY = 1e-6      # seconds
+MAX_LATENCY = 100       # seconds
+BUCKETS_PER_DECADE = 10
+_N_BUCKETS = round(log10(MAX_LATENCY / MIN_LATENCY) * BUCKETS_PER_DECADE)
+# pyvisa error code of an I/O timeout (VI_ERROR_TMO)
+_VI_ERROR_TMO = -1073807339
+# ids of the handles in a timed call, per thread
+_BUSY = threading.local()
+
+
+class LatencyHistogram:
+    """ Fixed-bucket histogram of latencies. Bucket i covers
+    [MIN_LATENCY * 10^(i/BUCKETS_PER_DECADE), MIN_LATENCY * 10^((i+1)/BUCKETS_PER_DECADE)).
+    Values out of range go to the first or the last bucket.
+    """
+
+    def __init__(self):
+        self.counts = [0] * _N_BUCKETS
+        self.n = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+
+    def record(self, dt: float):
+        if dt > MIN_LATENCY:
+            i = min(floor(log10(dt / MIN_LATENCY) * BUCKETS_PER_DECADE), _N_BUCKETS - 1)
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.n += 1
+        self.total += dt
+        if dt < self.min:
+            self.min = dt
+        if dt > self.max:
+            self.max = dt
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else 0.
+
+    def percentile(self, q: float) -> float:
+        """ Upper edge of the bucket that holds the q-th (0-100) percentile """
+        if not self.n:
+            return 0.
+        target = q / 100 * self.n
+        cum = 0
+        for i, c in enumerate(self.counts):
+            cum += c
+            if cum >= target and c:
+                return min(bucket_edge(i + 1), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'n': self.n, 'total': self.total, 'mean': self.mean,
+                'min': self.min if self.n else 0., 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                # keep only the non-empty buckets, {lower edge: count}
+                'buckets': {f'{bucket_edge(i):.3g}': c for i, c in enumerate(self.counts) if c}}
+
+
+def bucket_edge(i: int) -> float:
+    """ Lower edge (seconds) of bucket i """
+    return MIN_LATENCY * 10 ** (i / BUCKETS_PER_DECADE)
+
+
+class CommandStats:
+    """ Statistics of one command """
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.bytes_sent = 0
+        self.bytes_recv = 0
+        self.n_timeout = 0
+        self.n_error = 0
+
+    def to_dict(self):
+        return {'latency': self.latency.to_dict(),
+                'bytes_sent': self.bytes_sent, 'bytes_recv': self.bytes_recv,
+                'n_timeout': self.n_timeout, 'n_error': self.n_error}
+
+
+class InstStats:
+    """ Statistics of one instrument handle, per command.
+    Commands are grouped by their header, i.e. the code without its arguments
+    (':FREQ:CW 1000.000HZ' -> ':FREQ:CW'), so that the number of entries stays small.
+    """
+
+    def __init__(self):
+        self.commands = {}
+
+    def get(self, code: str) -> CommandStats:
+        key = command_key(code)
+        try:
+            return self.commands[key]
+        except KeyError:
+            self.commands[key] = s = CommandStats()
+            return s
+
+    def record(self, code: str, dt: float, bytes_sent=0, bytes_recv=0):
+        s = self.get(code)
+        s.latency.record(dt)
+        s.bytes_sent += bytes_sent
+        s.bytes_recv += bytes_recv
+
+    def timeout(self, code: str):
+        self.get(code).n_timeout += 1
+
+    def error(self, code: str):
+        self.get(code).n_error += 1
+
+    def clear(self):
+        self.commands.clear()
+
+    @property
+    def total_time(self):
+        return sum(s.latency.total for s in self.commands.values())
+
+    def to_dict(self):
+        return {key: s.to_dict() for key, s in self.commands.items()}
+
+
+def command_key(code) -> str:
+    """ Header of the command code """
+    if not code:
+        return '(read)'
+    return str(code).strip().split(' ', 1)[0]
+
+
+def timed(method):
+    """ Decorator of the handle methods query, query_raw, send and recv.
+    Record the latency, bytes, timeouts and errors in handle.stats.
+    Nested calls (e.g. query calls send and recv) are only recorded by the outermost one.
+    The nesting is tracked per thread, so that the handle can be used from several threads.
+    """
+
+    is_recv = method.__name__ == 'recv'
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            busy = _BUSY.handles
+        except AttributeError:
+            busy = _BUSY.handles = set()
+        if id(self) in busy:
+            return method(self, *args, **kwargs)
+        if is_recv:
+            code = None
+        else:
+            code = args[0] if args else kwargs.get('code')
+        busy.add(id(self))
+        t0 = perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception as err:
+            if _is_timeout(err):
+                self.stats.timeout(code)
+            else:
+                self.stats.error(code)
+            raise
+        finally:
+            busy.discard(id(self))
+        self.stats.record(code, perf_counter() - t0,
+                          bytes_sent=len(code) + 1 if code else 0,
+                          bytes_recv=len(result) if result else 0)
+        return result
+
+    return wrapper
+
+
+def _is_timeout(err) -> bool:
+    # socket.timeout is TimeoutError. serial and pyvisa have their own exceptions
+    return (isinstance(err, TimeoutError) or 'timeout' in type(err).__name__.lower()
+            or getattr(err, 'error_code', None) == _VI_ERROR_TMO)
+
+
+def dump_stats(stats: dict, filename: str):
+    """ Save the statistics {inst_name: InstStats} to a json file """
+    with open(filename, 'w') as fp:
+        json.dump({name: s.to_dict() for name, s in stats.items()}, fp, indent=2)
@@ -1,9 +1,9 @@
 #! encoding = utf-8
 from dataclasses import dataclass, fields, field
 from abc import ABC
-import yaml
 import re
 from PyMMSp.inst.base_simulator import BaseSimDecoder
+from PyMMSp.inst.api_map import load_api_map
 
 
 SYN_MODELS = (
@@ -52,6 +52,12 @@ VDI_BAND_RANGE = tuple(_VDI_BAND_RANGE.values())
 
 MODU_MODE = ('NONE', 'AM', 'FM')
 
+# Maximum number of points in one uploaded frequency list
+LIST_MAX_PTS = 1601
+
+# Typical frequency switching time (in ms) of the synthesizer
+SWITCH_TIME = 10
+
 
 def yield_band_str():
     """ Yield band information string """
@@ -101,11 +107,21 @@ class Syn_Info:
     lfo_src_idx: list[int] = field(default_factory=lambda: [0, ])
     err_msg: str = ''
     remote_disp_stat: bool = False
+    freq_mode: str = 'CW'   # ['CW', 'LIST']
+    list_type: str = 'LIST'     # ['LIST', 'STEP']
+    list_freq: list[float] = field(default_factory=list)  # Hz
+    list_trig_src: str = 'IMM'  # ['IMM', 'BUS', 'EXT']
+    list_idx: int = 0   # current point in the list sweep
+    init_cont: bool = False
 
     def reset(self):
         for f in fields(self):
             setattr(self, f.name, f.default)
 
+    @property
+    def list_freq_pts(self):
+        return len(self.list_freq)
+
     @property
     def band_multi(self):
         return _VDI_BAND_MULTI[self.band_idx]
@@ -271,6 +287,59 @@ class SynAPI(ABC):
     def set_remote_disp_stat(self, handle, stat: bool):
         pass
 
+    def get_freq_mode(self, handle) -> str:
+        pass
+
+    def set_freq_mode(self, handle, mode: str):
+        pass
+
+    def get_list_type(self, handle) -> str:
+        pass
+
+    def set_list_type(self, handle, list_type: str):
+        pass
+
+    def set_list_freq(self, handle, freq_list):
+        pass
+
+    def get_list_freq_pts(self, handle) -> int:
+        pass
+
+    def get_list_trig_source(self, handle) -> str:
+        pass
+
+    def set_list_trig_source(self, handle, source: str):
+        pass
+
+    def get_init_cont(self, handle) -> bool:
+        pass
+
+    def set_init_cont(self, handle, stat: bool):
+        pass
+
+    def init_sweep(self, handle):
+        pass
+
+    def trigger(self, handle):
+        pass
+
+
+@dataclass
+class _SimCmd:
+    """ One API_MAP entry compiled for the simulator decoder """
+    pattern: re.Pattern     # matches the command header, captures the channel number
+    attribute: str = ''
+    dtype: str = ''
+    is_chan: bool = False
+    units: tuple = ()       # ((suffix, factor), ...), the longest suffix first
+    action: str = ''
+
+
+# default element used to extend the channel list of each dtype
+_CHAN_FILL = {'str': '', 'float': 0., 'int': 0, 'bool': 0}
+# numbers and format fields in a command header, replaced by # in the lookup key
+_KEY_FIELD = re.compile(r'\{[^}]*\}|\d+')
+
 
 class SynSimDecoder(BaseSimDecoder):
 
@@ -283,12 +352,71 @@ class SynSimDecoder(BaseSimDecoder):
             sep_level: str, separator of multiple levels in one command, default is :
         """
         super().__init__()
-        with open(api_map_file, 'r') as f:
-            self._api_map = yaml.safe_load(''.join(f.readlines()))
+        self._api_map = load_api_map(api_map_file)
         self._info = Syn_Info(inst_name=inst_name)
         self._enc = enc
         self._sep_cmd = sep_cmd
         self._sep_level = sep_level
+        self._index = self._compile_api_map()
+
+    def _compile_api_map(self):
+        """ Compile the API_MAP into a lookup table, so that a command is decoded
+        with one dict lookup instead of a scan of all the API_MAP entries.
+        The table is {kind: {key: [_SimCmd, ...]}}, kind being 'get', 'set' or 'action'.
+        The key is the command header with the leading level separator removed
+        and every number (or format field) replaced by #, e.g. ':AM{0:d}:STAT?' -> 'AM#:STAT?'
+        """
+        index = {'get': {}, 'set': {}, 'action': {}}
+        for item in self._api_map['functions']:
+            # compound commands (like init_syn) are never matched as a whole
+            if self._sep_cmd in item['cmd']:
+                continue
+            header = item['cmd'].upper().split(' ', 1)[0].lstrip(self._sep_level)
+            if 'action' in item:
+                kind = 'action'
+            elif header.endswith('?'):
+                kind = 'get'
+            elif ' ' in item['cmd']:
+                kind = 'set'
+            else:
+                continue
+            fields_ = re.split(r'(\{[^}]*\})', header)
+            pattern = ''.join(r'(\d+)' if f.startswith('{') else re.escape(f) for f in fields_)
+            units = ()
+            if 'unit' in item:
+                base = item['unit']['base']
+                prefix = item['unit'].get('prefix', {})
+                units = tuple(sorted([(pre + base, float(v)) for pre, v in prefix.items()] + [(base, 1.)],
+                                     key=lambda u: len(u[0]), reverse=True))
+            cmd = _SimCmd(pattern=re.compile(pattern), attribute=item.get('attribute', ''),
+                          dtype=item.get('dtype', ''), is_chan=bool(item.get('channel')),
+                          units=units, action=item.get('action', ''))
+            index[kind].setdefault(self._cmd_key(header), []).append(cmd)
+        return index
+
+    def _cmd_key(self, header):
+        """ Lookup key of the command header """
+        return _KEY_FIELD.sub('#', header.lstrip(self._sep_level))
+
+    def _find(self, kind, header):
+        """ Find the compiled commands matching the header
+        Returns
+            list of (_SimCmd, channel number or None)
+        """
+        header = header.upper().lstrip(self._sep_level)
+        found = []
+        for cmd in self._index[kind].get(self._cmd_key(header), ()):
+            m = cmd.pattern.fullmatch(header)
+            if m:
+                if not cmd.is_chan:
+                    chan = None
+                elif m.lastindex:
+                    # the channel number is the first number field
+                    chan = int(m.group(1))
+                else:
+                    chan = self._get_chan(header, self._sep_level)
+                found.append((cmd, chan))
+        return found
 
     def interpret(self, cmd_queue):
         """ Interpret code and return its value """
@@ -311,20 +439,15 @@ class SynSimDecoder(BaseSimDecoder):
         Push the response to internal buffer
         """
         # the exact command should be registered in the API_MAP.
-        # try to find it
-        for item in self._api_map['functions']:
-            if self._match_code_multilevel(item['cmd'], cmd):
-                if item['channel']:
-                    # if this attribute has channel number, pick the correct one
-                    # note that the channel number starts from 1
-                    chan = self._get_chan(cmd, self._sep_level)
-                    v = getattr(self._info, item['attribute'])[chan - 1]
-                else:
-                    v = getattr(self._info, item['attribute'])
-                self.str_in(str(v))
-                self.byte_in(str(v).encode(self._enc))
+        for item, chan in self._find('get', cmd):
+            if item.is_chan:
+                # if this attribute has channel number, pick the correct one
+                # note that the channel number starts from 1
+                v = getattr(self._info, item.attribute)[chan - 1]
             else:
-                pass
+                v = getattr(self._info, item.attribute)
+            self.str_in(str(v))
+            self.byte_in(str(v).encode(self._enc))
 
     def _interpret_set(self, cmd):
         """ Interpret set value command
@@ -332,132 +455,64 @@ class SynSimDecoder(BaseSimDecoder):
         """
         # the command code and value are separated by blank space.
         # the command code should be registered in the API_MAP.
-        code_str, value_str = cmd.upper().split(' ')
-        factor = 1  # default scaling factor
-        for item in self._api_map['functions']:
-            if (not item['cmd'].endswith('?') and
-                    self._match_code_multilevel(item['cmd'], code_str)):
-                # check if there is unit specified
-                if 'unit' in item:
-                    # check if there is unit prefixes
-                    if 'prefix' in item['unit']:
-                        is_found = False
-                        # find the prefix used in the value_str
-                        base = item['unit']['base']
-                        for pre in item['unit']['prefix'].keys():
-                            if value_str.endswith(pre+base):
-                                # strip the unit in value
-                                value_str = value_str.strip(pre+base)
-                                factor = float(item['unit']['prefix'][pre])
-                                is_found = True
-                                break
-                        if not is_found:
-                            value_str = value_str.strip(base)
-                            factor = 1
-                    else:
-                        # strip the unit in value
-                        value_str = value_str.strip(item['unit']['base'])
-                else:   # nothing to do
-                    pass
-                if item['channel']:
-                    # if this attribute has channel number, pick the correct one
-                    chan = self._get_chan(code_str, self._sep_level)
-                    # note that the channel number starts from 1
-                    # and since there is channel, the attribute should be a list
-                    # we can directly assign the value to the correct list element
-                    current_attr_list = getattr(self._info, item['attribute'])
-                    n = len(current_attr_list)
-                    # assign the value to the correct channel
-                    if item['dtype'] == 'str':
-                        # if the channel number is out of range, append the list to the correct length
-                        if chan > n:
-                            current_attr_list.extend(['',] * (chan - n))
-                        current_attr_list[chan - 1] = value_str
-                    elif item['dtype'] == 'float':
-                        # if the channel number is out of range, append the list to the correct length
-                        if chan > n:
-                            current_attr_list.extend([0., ] * (chan - n))
-                        current_attr_list[chan - 1] = float(value_str) * factor
-                    elif item['dtype'] == 'int':
-                        # if the channel number is out of range, append the list to the correct length
-                        if chan > n:
-                            current_attr_list.extend([0, ] * (chan - n))
-                        current_attr_list[chan - 1] = int(int(value_str) * factor)
-                    elif item['dtype'] == 'bool':
-                        # if the channel number is out of range, append the list to the correct length
-                        if chan > n:
-                            current_attr_list.extend([0, ] * (chan - n))
-                        # in the instrument boolean value is still represented as integer
-                        current_attr_list[chan - 1] = int(value_str)
-                else:
-                    # attribute is not a list (therefore immutable)
-                    # use the setattr to assign new value to the attribute
-                    if item['dtype'] == 'str':
-                        setattr(self._info, item['attribute'], value_str)
-                    elif item['dtype'] == 'float':
-                        setattr(self._info, item['attribute'], float(value_str) * factor)
-                    elif item['dtype'] == 'int':
-                        setattr(self._info, item['attribute'], int(int(value_str) * factor))
-                    elif item['dtype'] == 'bool':
-                        # in the instrument boolean value is still represented as integer
-                        setattr(self._info, item['attribute'], int(value_str))
+        code_str, value_str = cmd.upper().split(' ', 1)
+        value_str = value_str.strip()
+        for item, chan in self._find('set', code_str):
+            factor = 1  # default scaling factor
+            v_str = value_str
+            # strip the unit (and its prefix) in the value
+            for suffix, f in item.units:
+                if v_str.endswith(suffix):
+                    v_str = v_str[:-len(suffix)]
+                    factor = f
+                    break
+            if item.dtype == 'float_list':
+                # comma separated list, replace the whole list at once
+                setattr(self._info, item.attribute, [float(v) * factor for v in v_str.split(',')])
+                continue
+            if item.dtype == 'str':
+                value = v_str
+            elif item.dtype == 'float':
+                value = float(v_str) * factor
+            elif item.dtype == 'int':
+                value = int(int(v_str) * factor)
+            elif item.dtype == 'bool':
+                # in the instrument boolean value is still represented as integer
+                value = int(v_str)
             else:
-                pass
+                continue
+            if item.is_chan:
+                # the attribute is a list; assign the value to the channel, starting from 1.
+                # if the channel number is out of range, append the list to the correct length
+                current_attr_list = getattr(self._info, item.attribute)
+                n = len(current_attr_list)
+                if chan > n:
+                    current_attr_list.extend([_CHAN_FILL[item.dtype], ] * (chan - n))
+                current_attr_list[chan - 1] = value
+            else:
+                # attribute is not a list (therefore immutable)
+                # use the setattr to assign new value to the attribute
+                setattr(self._info, item.attribute, value)
 
     def _interpret_action(self, cmd):
         """ Interpret action command
-        Currently no direct action command is defined """
-        pass
-
-    def _match_code_multilevel(self, code_api, code_usr):
-        """ Match multi-level code
-        Arguments
-            code1: str, code from API_MAP, string formatter
-            code2: str, code from user (each level may contain channel integers
-        Returns
-            stat: bool
-        """
-        # define the replace char of : in curly brace (which is the : used in python string formatter)
-        # it needs to be different from self._sep_level
-        if self._sep_level == '-':
-            rep_char = '*'
-        else:
-            rep_char = '-'
-        list_code1 = self._replace_colon_in_curly_brace(code_api, rep_char).split(self._sep_level)
-        list_code2 = code_usr.split(self._sep_level)
-        if len(list_code1) != len(list_code2):
-            return False
-        else:
-            for code1, code2 in zip(list_code1, list_code2):
-                for char1, char2 in zip(code1, code2):
-                    # match each character until the appearance of {
-                    if char1 != '{':
-                        if char1 != char2:
-                            return False
-                        else:
-                            pass
-                    else:
-                        pass
-            return True
-
-    @staticmethod
-    def _replace_colon_in_curly_brace(str_in, rep_char):
-        """ Replace colon in curly brace with channel number
-        Arguments:
-            str_in: str, input string
-            rep_char: str, replacement character
-        """
-        new = []
-        in_brace = False
-        for char in str_in:
-            if char == '{':
-                in_brace = True
-            elif char == '}':
-                in_brace = False
-            elif char == ':' and in_brace:
-                char = rep_char
-            new.append(char)
-        return ''.join(new)
+        Actions registered with an 'action' key in the API_MAP are emulated
+        by the corresponding _act_<action> method """
+        for item, _ in self._find('action', cmd):
+            getattr(self, '_act_' + item.action)()
+
+    def _act_list_init(self):
+        """ Arm the list sweep and output the first point """
+        self._info.list_idx = 0
+        if self._info.freq_mode == 'LIST' and self._info.list_freq:
+            self._info.freq_cw = self._info.list_freq[0]
+
+    def _act_list_next(self):
+        """ Advance the list sweep by one point on trigger """
+        if self._info.freq_mode == 'LIST' and self._info.list_freq:
+            # the sweep stays at the last point once it is finished
+            self._info.list_idx = min(self._info.list_idx + 1, len(self._info.list_freq) - 1)
+            self._info.freq_cw = self._info.list_freq[self._info.list_idx]
 
     @staticmethod
     def _get_chan(cmd, sep):
@@ -0,0 +1,264 @@
+#! encoding = utf-8
+
+""" SQLite catalog of the scans in a data archive.
+Every scan of the .lwa and .spb files, and every .dat file of the batch scan,
+is one row of the scans table, with the header fields of lwa.scan_header.
+The files are parsed in parallel by a process pool. The catalog is updated incrementally:
+a file is parsed again only if its mtime or size has changed.
+
+    python -m PyMMSp.libs.catalog index D:/data --db catalog.sqlite
+    python -m PyMMSp.libs.catalog query --db catalog.sqlite --freq 240000 250000 --mod FM --since 2025-01-01
+
+Frequencies are in MHz, dates are ISO strings 'YYYY-mm-ddTHH:MM:SS'.
+The .dat files only have the frequency range, the number of points and the date (from the file name).
+"""
+
+import os
+import re
+import sqlite3
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from PyMMSp.libs import lwa, spb
+
+DEFAULT_DB = os.path.join(os.path.expanduser('~'), '.cache', 'PyMMSp', 'catalog.sqlite')
+SUFFIXES = ('.lwa', spb.SUFFIX, '.dat')
+# columns of the scans table, after the file path
+FIELDS = ('scan_num', 'comment', 'date', 'sh', 'it', 'sens', 'tau', 'mod', 'mf', 'ma',
+          'start_freq', 'stop_freq', 'step', 'pts', 'avg', 'harm', 'phase')
+# file name of daq.abs.save_data
+_RE_DAT = re.compile(r'^(\d{8})_\d+_\d+_bf\d+(_\d+)?\.dat$')
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, n_scans INTEGER, error TEXT);
+CREATE TABLE IF NOT EXISTS scans (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    scan_num INTEGER, comment TEXT, date TEXT, sh INTEGER, it REAL, sens REAL, tau REAL, mod TEXT,
+    mf REAL, ma REAL, start_freq REAL, stop_freq REAL, step REAL, pts INTEGER, avg INTEGER,
+    harm INTEGER, phase REAL);
+CREATE INDEX IF NOT EXISTS idx_scans_freq ON scans (start_freq, stop_freq);
+CREATE INDEX IF NOT EXISTS idx_scans_date ON scans (date);
+CREATE INDEX IF NOT EXISTS idx_scans_path ON scans (path);
+'''
+
+
+def connect(db_file=DEFAULT_DB) -> sqlite3.Connection:
+    """ Open the catalog, and create the tables if needed """
+
+    if os.path.dirname(db_file):
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+    conn = sqlite3.connect(db_file)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def index_archive(root, db_file=DEFAULT_DB, n_workers=None):
+    """ Index the data files under root. Only the new and the changed files are parsed,
+    and the files that do not exist anymore are removed from the catalog.
+    Arguments
+        root: str, directory
+        db_file: str, catalog file
+        n_workers: int, number of processes, default the number of CPUs. 1 to parse in this process
+    Returns
+        n_parsed: int, number of files parsed
+        n_removed: int, number of files removed
+        errors: list of (path, error message)
+    """
+
+    root = os.path.abspath(root)
+    on_disk = {}
+    for dir_path, _, file_names in os.walk(root):
+        for name in file_names:
+            if _is_data_file(name):
+                path = os.path.join(dir_path, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                on_disk[path] = (st.st_mtime_ns, st.st_size)
+
+    conn = connect(db_file)
+    try:
+        # the files of this directory tree in the catalog
+        prefix = os.path.join(root, '')
+        known = {r['path']: (r['mtime_ns'], r['size']) for r in conn.execute(
+            'SELECT path, mtime_ns, size FROM files WHERE path >= ? AND path < ?',
+            (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))}
+        removed = [p for p in known if p not in on_disk]
+        to_parse = sorted(p for p, stamp in on_disk.items() if known.get(p) != stamp)
+
+        if n_workers == 1 or len(to_parse) < 2:
+            results = map(index_file, to_parse)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(n_workers)
+            results = executor.map(index_file, to_parse, chunksize=max(1, len(to_parse) // 64))
+        errors = []
+        try:
+            with conn:
+                conn.executemany('DELETE FROM files WHERE path = ?', ((p,) for p in removed))
+                for path, rows, error in results:
+                    mtime_ns, size = on_disk[path]
+                    # replace the rows of a changed file
+                    conn.execute('DELETE FROM files WHERE path = ?', (path,))
+                    conn.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?)',
+                                 (path, mtime_ns, size, len(rows), error))
+                    conn.executemany(f'INSERT INTO scans VALUES (?{", ?" * len(FIELDS)})',
+                                     ((path,) + row for row in rows))
+                    if error:
+                        errors.append((path, error))
+        finally:
+            if executor:
+                executor.shutdown()
+    finally:
+        conn.close()
+    return len(to_parse), len(removed), errors
+
+
+def index_file(path):
+    """ Parse the scan headers of a data file. Runs in the worker processes
+    Returns
+        path: str
+        rows: list of tuples, in the order of FIELDS
+        error: str or None
+    """
+
+    try:
+        if path.endswith('.lwa'):
+            rows = _index_lwa(path)
+        elif path.endswith(spb.SUFFIX):
+            rows = _index_spb(path)
+        else:
+            rows = _index_dat(path)
+    except (OSError, ValueError, IndexError, KeyError) as err:
+        return path, [], f'{type(err).__name__:s}: {err}'
+    return path, rows, None
+
+
+def query(db_file=DEFAULT_DB, freq=None, is_cover=True, since=None, until=None, mod=None, comment=None):
+    """ Find scans in the catalog
+    Arguments
+        freq: (float, float), frequency range, MHz
+        is_cover: bool, if True, the scans must cover the whole frequency range,
+            otherwise they only need to overlap with it
+        since: str or datetime.date, earliest date
+        until: str or datetime.date, latest date, included
+        mod: str, modulation mode, e.g. 'FM'
+        comment: str, part of the comment, case-insensitive
+    Returns
+        rows: list of dict, with the path of the file and FIELDS, in the order of the date
+    """
+
+    where = []
+    args = []
+    if freq:
+        lo, hi = sorted(freq)
+        where.append('start_freq <= ? AND stop_freq >= ?')
+        args += [lo, hi] if is_cover else [hi, lo]
+    if since:
+        where.append('date >= ?')
+        args.append(_iso_date(since))
+    if until:
+        # 'T99' sorts after any time of the last day
+        where.append('date < ?')
+        args.append(_iso_date(until)[:10] + 'T99')
+    if mod:
+        where.append('mod = ?')
+        args.append(mod.upper())
+    if comment:
+        where.append('comment LIKE ?')
+        args.append(f'%{comment:s}%')
+    sql = 'SELECT * FROM scans'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY date, path, scan_num'
+    conn = connect(db_file)
+    try:
+        return [dict(r) for r in conn.execute(sql, args)]
+    finally:
+        conn.close()
+
+
+def _is_data_file(name):
+    if name.endswith('.dat'):
+        return _RE_DAT.match(name) is not None
+    return name.endswith(SUFFIXES)
+
+
+def _iso_date(d):
+    return d.isoformat() if isinstance(d, datetime.date) else str(d)
+
+
+def _index_lwa(path):
+    # the catalog must not write sidecar index files into the archive
+    entry_settings, hd_pos = lwa.scan_header(path, is_save_index=False)
+    synmulti = lwa.scan_synmulti(path, hd_pos)
+    rows = []
+    for sh, entry in zip(synmulti, entry_settings):
+        (scan_num, comment, date, time, it, sens, tc, mmode, mf, ma,
+         startf, stopf, step, pts, avg, harm, phase) = entry
+        date = datetime.datetime.strptime(f'{date:s} {time:s}', '%m-%d-%Y %H:%M:%S').isoformat()
+        rows.append((scan_num, comment, date, sh, it, sens, tc, mmode, mf, ma,
+                     startf, stopf, step, pts, avg, harm, phase))
+    return rows
+
+
+def _index_spb(path):
+    entry_settings, _ = spb.scan_header(path)
+    rows = []
+    for info, entry in zip(spb.scan_info(path), entry_settings):
+        (scan_num, comment, _, _, it, sens, tc, mmode, mf, ma,
+         startf, stopf, step, pts, avg, harm, phase) = entry
+        rows.append((scan_num, comment, info['date'], info['synmulti'], it, sens, tc, mmode, mf, ma,
+                     startf, stopf, step, pts, avg, harm, phase))
+    return rows
+
+
+def _index_dat(path):
+    """ The .dat file has no header: 2 columns, frequency and intensity """
+
+    date = datetime.datetime.strptime(_RE_DAT.match(os.path.basename(path)).group(1), '%Y%m%d')
+    with open(path, 'rb') as f:
+        lines = f.read().split(b'\n')
+    lines = [l for l in lines if l.strip()]
+    if not lines:
+        return []
+    start_freq = float(lines[0].split()[0])
+    stop_freq = float(lines[-1].split()[0])
+    pts = len(lines)
+    step = (stop_freq - start_freq) / (pts - 1) if pts > 1 else 0.
+    return [(1, '', date.isoformat(), None, None, None, None, None, None, None,
+             start_freq, stop_freq, step, pts, None, None, None)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Catalog of the scans in a data archive')
+    parser.add_argument('--db', default=DEFAULT_DB, help='catalog file')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('index', help='index (or update) a directory tree')
+    p.add_argument('root')
+    p.add_argument('--workers', type=int, default=None, help='number of processes')
+    p = sub.add_parser('query', help='find scans')
+    p.add_argument('--freq', type=float, nargs=2, metavar=('LO', 'HI'), help='frequency range, MHz')
+    p.add_argument('--overlap', action='store_true', help='scans overlapping the range instead of covering it')
+    p.add_argument('--since', help='earliest date, YYYY-mm-dd')
+    p.add_argument('--until', help='latest date, YYYY-mm-dd')
+    p.add_argument('--mod', help='modulation mode')
+    p.add_argument('--comment', help='part of the comment')
+    args = parser.parse_args(argv)
+
+    if args.cmd == 'index':
+        n_parsed, n_removed, errors = index_archive(args.root, args.db, args.workers)
+        print(f'{n_parsed:d} files parsed, {n_removed:d} removed')
+        for path, error in errors:
+            print(f'    {path:s}: {error:s}')
+    else:
+        for r in query(args.db, args.freq, not args.overlap, args.since, args.until, args.mod, args.comment):
+            print(f'{r["date"]:s}  {r["start_freq"]:12.3f} {r["stop_freq"]:12.3f}  '
+                  f'{r["mod"] or "":4s} {r["path"]:s} #{r["scan_num"]:d}  {r["comment"]:s}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#! encoding = utf-8
+
+""" Crash-safe checkpoint of batch scans.
+The checkpoint is an append-only file of json lines. Each line is one record:
+    {"type": "batch", "settings": [{...}, ...]}          the batch job starts
+    {"type": "entry", "entry": i, "filename": f}         an entry starts, its data goes to file f
+    {"type": "pt", "entry": i, "idx": j, "y": y}         a point is completed
+    {"type": "sweep", "entry": i, "y": [...]}            a sweep is completed
+    {"type": "done", "entry": i}                         an entry is saved
+    {"type": "finish"}                                   the batch job is finished
+Records are flushed right away, so they survive a crash of the program,
+and fsynced in batches, so that they survive a power loss too.
+A truncated last line (crash during the write) is ignored when loading,
+and cut off when the checkpoint is resumed, so that the new records start on a new line.
+"""
+
+import os
+import json
+from time import time
+from dataclasses import asdict
+from PyMMSp.config.config import AbsScanSetting
+
+CHECKPOINT_FILE = 'batch_scan.ckpt'
+# fsync the checkpoint every FSYNC_N records or FSYNC_INTERVAL seconds, whichever comes first
+FSYNC_N = 50
+FSYNC_INTERVAL = 5
+
+
+class CheckpointWriter:
+    """ Append records to the checkpoint file
+
+    Arguments
+        filename: str           path to the checkpoint file
+        is_resume: bool         append to an existing checkpoint instead of starting a new one
+    """
+
+    def __init__(self, filename: str, is_resume: bool = False):
+
+        self.filename = filename
+        if is_resume:
+            _cut_torn_line(filename)
+        self._fp = open(filename, 'a' if is_resume else 'w', encoding='utf-8')
+        self._n_unsynced = 0
+        self._t_synced = time()
+
+    def start_batch(self, list_settings: [AbsScanSetting]):
+        self._write({'type': 'batch', 'settings': [asdict(s) for s in list_settings]}, is_sync=True)
+
+    def start_entry(self, entry: int, filename: str = ''):
+        self._write({'type': 'entry', 'entry': entry, 'filename': filename}, is_sync=True)
+
+    def add_point(self, entry: int, idx: int, y: float):
+        self._write({'type': 'pt', 'entry': entry, 'idx': idx, 'y': float(y)})
+
+    def add_sweep(self, entry: int, y):
+        self._write({'type': 'sweep', 'entry': entry, 'y': [float(v) for v in y]}, is_sync=True)
+
+    def finish_entry(self, entry: int):
+        self._write({'type': 'done', 'entry': entry}, is_sync=True)
+
+    def finish(self):
+        """ The batch job is finished. Close and remove the checkpoint """
+        self._write({'type': 'finish'}, is_sync=True)
+        self.close()
+        os.remove(self.filename)
+
+    def close(self):
+        if not self._fp.closed:
+            self._sync()
+            self._fp.close()
+
+    def _write(self, record: dict, is_sync=False):
+        self._fp.write(json.dumps(record) + '\n')
+        self._fp.flush()
+        self._n_unsynced += 1
+        if is_sync or self._n_unsynced >= FSYNC_N or time() - self._t_synced > FSYNC_INTERVAL:
+            self._sync()
+
+    def _sync(self):
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._n_unsynced = 0
+        self._t_synced = time()
+
+
+def _cut_torn_line(filename: str):
+    """ Truncate the file after its last complete line """
+
+    with open(filename, 'r+b') as fp:
+        pos = fp.seek(0, os.SEEK_END)
+        while pos > 0:
+            n = min(pos, 4096)
+            fp.seek(pos - n)
+            i = fp.read(n).rfind(b'\n')
+            if i >= 0:
+                fp.truncate(pos - n + i + 1)
+                return
+            pos -= n
+        fp.truncate(0)
+
+
+class Checkpoint:
+    """ State of an unfinished batch job, loaded from the checkpoint file
+
+    Attributes
+        list_settings: [AbsScanSetting]     settings of all entries in the batch job
+        done: set                           indices of the saved entries
+        points: dict                        {entry: {idx: y}} completed points
+        sweeps: dict                        {entry: [[y, ...], ...]} completed sweeps
+        files: dict                         {entry: filename} data file of the started entries
+        is_finished: bool                   the batch job is finished
+    """
+
+    def __init__(self):
+        self.list_settings = []
+        self.done = set()
+        self.points = {}
+        self.sweeps = {}
+        self.files = {}
+        self.is_finished = False
+
+    @property
+    def next_entry(self) -> int:
+        """ Index of the first entry that is not saved yet """
+        i = 0
+        while i in self.done:
+            i += 1
+        return i
+
+
+def load_checkpoint(filename: str) -> Checkpoint:
+    """ Load the checkpoint file
+    Returns
+        ckpt: Checkpoint
+    """
+
+    ckpt = Checkpoint()
+    with open(filename, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # truncated line left by a crash
+                continue
+            if record['type'] == 'batch':
+                ckpt.list_settings = [AbsScanSetting(**d) for d in record['settings']]
+            elif record['type'] == 'entry':
+                entry = record['entry']
+                # an entry is only started again from scratch. A resumed entry has no new entry record
+                ckpt.points[entry] = {}
+                ckpt.sweeps[entry] = []
+                ckpt.files[entry] = record.get('filename', '')
+            elif record['type'] == 'pt':
+                ckpt.points[record['entry']][record['idx']] = record['y']
+            elif record['type'] == 'sweep':
+                ckpt.sweeps[record['entry']].append(record['y'])
+            elif record['type'] == 'done':
+                ckpt.done.add(record['entry'])
+            elif record['type'] == 'finish':
+                ckpt.is_finished = True
+    return ckpt
+
+
+def find_unfinished(dir_: str):
+    """ Look for an unfinished batch job in dir_
+    Returns
+        filename: str           path to the checkpoint file, or '' if there is none
+    """
+
+    filename = os.path.join(dir_, CHECKPOINT_FILE)
+    if os.path.isfile(filename) and not load_checkpoint(filename).is_finished:
+        return filename
+    else:
+        return ''
@@ -2,9 +2,32 @@
 
 """ Common library functions """
 
+import sys
+import importlib.util
 from datetime import timedelta
 
 
+def lazy_import(name: str):
+    """ Import a module on the first attribute access, for the heavy
+    dependencies that are not needed at startup (e.g. pyvisa).
+    Raise ImportError right away if the module is not installed.
+    """
+
+    try:
+        return sys.modules[name]
+    except KeyError:
+        pass
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
 def format_timedelta(td: timedelta) -> str:
     days = td.days
     hours, remainder = divmod(td.seconds, 3600)
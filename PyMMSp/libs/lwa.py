@@ -1,10 +1,23 @@
 #! encoding = utf-8
 
 """ JPL LWA format handler """
-import datetime
+import os
 import re
+import json
+import mmap
+import datetime
 import numpy as np
 
+# sidecar file of the header index
+INDEX_SUFFIX = '.idx'
+_INDEX_VERSION = 1
+_RE_HEADER = re.compile(rb'^DATE', re.M)
+# data block layout: {:10.3f} fields, 10 per row
+_ROW_FIELDS = 10
+_FIELD_WIDTH = 10
+# end of the third header line, after PTS and AVG
+_LINE3_END = ' 1 1  1.887  0.000 0 0 START\n'
+
 def _file_filter(file_list, pattern):
     """ Filter out file names with a given pattern """
     extract = []
@@ -29,276 +42,428 @@ def _flatten(nested_list):
     return flat
 
 
-def scan_header(filename):
+def scan_header(filename, is_save_index=True):
     """ Scan headers in the lwa file.
+    The header index is saved in a sidecar file (filename + INDEX_SUFFIX),
+    and reused as long as the size and mtime of the lwa file are unchanged.
+    If scans have been appended to the file since, only the new part is scanned.
+    Arguments
+        filename: str
+        is_save_index: bool, if False, an existing sidecar is used but not written
     Returns
         entry_settings: list of entry setting tuples. Scan # starts at 1.
-        hd_line_num: start line number of each header in the file
+        hd_pos: byte offset of each header in the file,
+                followed by the end of the last scan
     """
 
-    if filename:
-        re_header = re.compile('DATE')
-        # header's line number list
-        hd_line_num = []
-        # entry setting list
-        entry_settings = []
-
-        # open file
-        a_file = open(filename, 'r')
-        a_line = a_file.readline()
-        line_num = 1
-        scan_num = 0
-        while a_line:       # not EOF
-            # this is the header
-            if re_header.match(a_line):
-                scan_num += 1
-                hd_line_num.append(line_num)
-                _temp_list = a_line.split()
-                date = _temp_list[1]
-                time = _temp_list[3]
-                it = float(_temp_list[7])
-                sens = float(_temp_list[9])
-                tc = float(_temp_list[11])
-                mf = float(_temp_list[13])
-                ma = float(_temp_list[15])
-
-                # the following fields are newly introduced in PyMMSp
-                # make it compatible with old "standard" JPL LWA header
-                try:
-                    mmode = _temp_list[17]
-                    harm = int(_temp_list[19])
-                    phase = float(_temp_list[21])
-                except IndexError:
-                    mmode = 'UNKNOWN'
-                    harm = 0
-                    phase = 0
-
-                # move to next line to read comment
-                a_line = a_file.readline()
-                line_num += 1
-                comment = a_line.strip()    # remove the new line char
-
-                # move to next line to read freqs
-                a_line = a_file.readline()
-                line_num += 1
-                _temp_list = a_line.split()
-                startf = float(_temp_list[0])
-                step = float(_temp_list[1])
-                pts = int(_temp_list[2])
-                stopf = startf + step*pts
-                avg = int(_temp_list[3])
-
-                # append settings
-                entry_settings.append((scan_num, comment, date, time,
-                    it, sens, tc, mmode, mf, ma, startf, stopf,
-                    step, pts, avg, harm, phase))
-            else:
-                a_line = a_file.readline()
-                line_num += 1
-
-        a_file.close()
-        hd_line_num.sort()
-    else:
-        entry_settings = None
-        hd_line_num = None
-
-    return entry_settings, hd_line_num
-
-
-def export_lwa(id_list, hd_line_num, src='src.lwa', output='output.lwa'):
-    """ Export partial LWA file to new LWA file,
-        based on scan id (id starts at 0) """
-
-    srcfile = open(src, 'r')
-    outputfile = open(output, 'w')
-
-    # get line number window to be copied
-    hd_line_num.append(0)   # add 0 for the last one
-    win = lambda id_, hd: list((hd[i], hd[i+1]-1) for i in id_)
-    line_num_win = win(id_list, hd_line_num)
-    # reverse list order for pop ups
-    line_num_win.reverse()
-
-    line_num = 1
-    a_line = srcfile.readline()
-    start, stop = line_num_win.pop()
-    # start read source file
-    while a_line:   # source file not EOF
-        if (line_num >= start) and ((line_num <= stop) or (stop == -1)):
-            # write this line to output file
-            outputfile.write(a_line)
-        elif line_num > stop and stop != -1:
-            # pop the next line number window
+    if not filename:
+        return None, None
+    st = os.stat(filename)
+    idx = _load_index(filename)
+    if idx and idx['size'] == st.st_size and idx['mtime_ns'] == st.st_mtime_ns:
+        return [tuple(e) for e in idx['entry_settings']], idx['hd_pos']
+
+    entry_settings = []
+    hd_pos = []
+    if st.st_size == 0:
+        return entry_settings, [0]
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        if idx and 1 < len(idx['hd_pos']) and idx['size'] < len(mm) and \
+                all(mm[p:p + 4] == b'DATE' for p in idx['hd_pos'][:-1]):
+            # the file has grown: keep the scans before the last one, which may have been incomplete
+            entry_settings = [tuple(e) for e in idx['entry_settings'][:-1]]
+            hd_pos = idx['hd_pos'][:-2]
+            start = idx['hd_pos'][-2]
+        hd_end = start
+        for m in _RE_HEADER.finditer(mm, start):
+            pos = m.start()
+            if pos < hd_end:
+                # a comment line starting with DATE
+                continue
+            # the header is 3 lines
+            lines = []
+            hd_end = pos
+            for _ in range(3):
+                nl = mm.find(b'\n', hd_end)
+                nl = len(mm) if nl < 0 else nl + 1
+                lines.append(mm[hd_end:nl].decode('ascii', errors='replace'))
+                hd_end = nl
             try:
-                start, stop = line_num_win.pop()
-            except IndexError:
+                entry_settings.append(_parse_header(len(entry_settings) + 1, *lines))
+            except (IndexError, ValueError):
+                # truncated header at the end of the file
                 break
-        # move to next line
-        a_line = srcfile.readline()
-        line_num += 1
+            hd_pos.append(pos)
+        hd_pos.append(len(mm))
+        size = len(mm)
+    if is_save_index:
+        _save_index(filename, {'version': _INDEX_VERSION, 'size': size, 'mtime_ns': st.st_mtime_ns,
+                               'hd_pos': hd_pos, 'entry_settings': entry_settings})
+    return entry_settings, hd_pos
+
+
+def _parse_header(scan_num, line1, line2, line3):
+    """ Parse the 3 header lines of a scan into the entry setting tuple """
+
+    _temp_list = line1.split()
+    date = _temp_list[1]
+    time = _temp_list[3]
+    it = float(_temp_list[7])
+    sens = float(_temp_list[9])
+    tc = float(_temp_list[11])
+    mf = float(_temp_list[13])
+    ma = float(_temp_list[15])
+
+    # the following fields are newly introduced in PyMMSp
+    # make it compatible with old "standard" JPL LWA header
+    try:
+        mmode = _temp_list[17]
+        harm = int(_temp_list[19])
+        phase = float(_temp_list[21])
+    except IndexError:
+        mmode = 'UNKNOWN'
+        harm = 0
+        phase = 0
+
+    # second line is comment
+    comment = line2.strip()    # remove the new line char
+
+    # third line is freqs
+    _temp_list = line3.split()
+    startf = float(_temp_list[0])
+    step = float(_temp_list[1])
+    pts = int(_temp_list[2])
+    stopf = startf + step*pts
+    avg = int(_temp_list[3])
+
+    return (scan_num, comment, date, time, it, sens, tc, mmode, mf, ma,
+            startf, stopf, step, pts, avg, harm, phase)
+
+
+def scan_synmulti(filename, hd_pos):
+    """ Read the SH field of each scan, the only header field not in the entry settings
+    Returns
+        synmulti: list of int
+    """
+
+    synmulti = []
+    with open(filename, 'rb') as f:
+        for p in hd_pos[:-1]:
+            f.seek(p)
+            synmulti.append(int(f.readline().split()[5]))
+    return synmulti
+
+
+def _load_index(filename):
+    try:
+        with open(filename + INDEX_SUFFIX, 'r') as f:
+            idx = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if idx.get('version') != _INDEX_VERSION:
+        return None
+    return idx
+
+
+def _save_index(filename, idx):
+    # the index is optional: ignore the failure if the directory is not writable
+    tmp_file = filename + INDEX_SUFFIX + '.tmp'
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump(idx, f)
+        os.replace(tmp_file, filename + INDEX_SUFFIX)
+    except OSError:
+        pass
+
+
+def _read_scan(mm, hd_pos, id_):
+    """ Parse the scan #id (id starts at 0) from the mapped file
+    Returns
+        sens: float, lockin sensitivity
+        comment: str
+        x: np.array, frequency vector, unit in MHz
+        y: np.array, intensity vector, full scale 1e4
+    """
+
+    # the header is 3 lines, the data block follows
+    start = hd_pos[id_]
+    lines = []
+    for _ in range(3):
+        nl = mm.find(b'\n', start, hd_pos[id_ + 1])
+        nl = hd_pos[id_ + 1] if nl < 0 else nl + 1
+        lines.append(mm[start:nl].decode('ascii', errors='replace'))
+        start = nl
+    sens = float(lines[0].split()[9])
+    comment = lines[1].strip()
+    a_list = lines[2].split()
+    xstart = float(a_list[0])
+    xstep = float(a_list[1])
+    pts = int(a_list[2])
+    x = np.linspace(xstart, xstart + xstep*pts, num=pts, endpoint=False)
+    y = parse_data(mm[start:hd_pos[id_ + 1]], pts)
+    return sens, comment, x, y
+
+
+def parse_data(data: bytes, pts: int) -> np.ndarray:
+    """ Decode the data block of a scan.
+    The block written by save_lwa is decoded as fixed-width fields in a few numpy calls.
+    A block that does not follow the layout (e.g. a value wider than the field,
+    or pts not matching the number of values) goes through the tolerant split path.
+    Arguments
+        data: bytes, the data block
+        pts: int, number of points in the header
+    Returns
+        y: np.array
+    """
+
+    try:
+        return _parse_fixed_width(data, pts)
+    except ValueError:
+        return np.asarray(data.split(), dtype=float)
+
+
+def _parse_fixed_width(data, pts):
+    """ Decode the fixed-width data block. Raise ValueError if the block does not follow the layout """
+
+    n_rows, n_tail = divmod(pts, _ROW_FIELDS)
+    width = _ROW_FIELDS * _FIELD_WIDTH
+    eol = b'\r\n' if data[width:width + 2] == b'\r\n' else b'\n'
+    row_len = width + len(eol)
+    body_len = n_rows * row_len
+    if len(data) < body_len + n_tail * _FIELD_WIDTH:
+        raise ValueError('data block too short')
+    rows = np.frombuffer(data, dtype=np.uint8, count=body_len).reshape(n_rows, row_len)
+    if not (rows[:, width:] == np.frombuffer(eol, dtype=np.uint8)).all():
+        raise ValueError('data block is not fixed width')
+    tail = data[body_len:body_len + n_tail * _FIELD_WIDTH]
+    if data[body_len + n_tail * _FIELD_WIDTH:].strip():
+        raise ValueError('more values than pts')
+    y = np.empty(pts)
+    # the numbers are parsed in C from the fixed-width byte strings
+    y[:n_rows * _ROW_FIELDS] = rows[:, :width].copy().view(f'S{_FIELD_WIDTH:d}').astype(float).ravel()
+    y[n_rows * _ROW_FIELDS:] = np.frombuffer(tail, dtype=f'S{_FIELD_WIDTH:d}').astype(float)
+    return y
+
+
+def export_lwa(id_list, hd_pos, src='src.lwa', output='output.lwa'):
+    """ Export partial LWA file to new LWA file,
+        based on scan id (id starts at 0) """
 
-    srcfile.close()
-    outputfile.close()
+    with open(src, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            open(output, 'wb') as outputfile:
+        # keep the order in the source file
+        for id_ in sorted(id_list):
+            outputfile.write(mm[hd_pos[id_]:hd_pos[id_ + 1]])
 
 
-def export_xy(id_list, hd_line_num, src='src.lwa', output_dir='export/'):
+def export_xy(id_list, hd_pos, src='src.lwa', output_dir='export/'):
     """ Export partial LWA file to new xy files,
         based on scan id (id starts at 0) """
 
-    global ylist, sens, x, out_name
-    ylist = []
-
-    # get line number window to be copied
-    hd_line_num.append(0)   # add 0 for the last one
-    win = lambda id_, hd: list((hd[i], hd[i+1]-1) for i in id_)
-    line_num_win = win(id_list, hd_line_num)
-    # reverse list order for pop ups
-    line_num_win.reverse()
-
-    line_num = 1
-    srcfile = open(src, 'r')
-    a_line = srcfile.readline()
-    start, stop = line_num_win.pop()
-    # start read source file
-    while a_line:   # source file not EOF
-        if (line_num >= start) and ((line_num <= stop) or (stop == -1)):
-            if line_num == start: # get 1st header for sensitivity
-                a_list = a_line.split()
-                sens = float(a_list[9])
-            elif line_num == start+1: # get comment and generate file name
-                comment = a_line.split()[0]
-                out_name = output_dir + '/' + 'Scan_{:d}_{:s}.csv'.format(len(line_num_win)+1, comment)
-            elif line_num == start+2: # get 3rd header line for x array
-                a_list = a_line.split()
-                xstart = float(a_list[0])
-                xstep = float(a_list[1])
-                pts = int(a_list[2])
-                x = np.linspace(xstart, xstart + xstep*pts, num=pts, endpoint=False)
-            else:   # data lines, read data
-                # add this line to y list
-                ylist.append(a_line.split())
-        elif line_num > stop and stop != -1:    # end of this scan entry
-            # save this entry
-            # column_stack array
-            y = [i for j in ylist for i in j]
+    with open(src, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for id_ in sorted(id_list):
+            sens, comment, x, y = _read_scan(mm, hd_pos, id_)
+            # first word of the comment goes to the file name
+            out_name = output_dir + '/' + 'Scan_{:d}_{:s}.csv'.format(id_ + 1, (comment.split() or [''])[0])
             np.savetxt(out_name,
-                np.column_stack((x, np.asarray(y, dtype=float)*1e-4*sens)),
+                np.column_stack((x, y*1e-4*sens)),
                 delimiter=',', fmt=['%.3f', '%.6e'], comments='',
                 header='Frequency(MHz),LockinInten(V)')
-            # erase ylist
-            ylist = []
-            # pop the next line number window
-            try:
-                start, stop = line_num_win.pop()
-            except IndexError:
-                break
-        # move to next line
-        a_line = srcfile.readline()
-        line_num += 1
-
-    srcfile.close()
-
-    if ylist:   # if the last one is not saved yet
-        y = [i for j in ylist for i in j]
-        np.savetxt(out_name,
-            np.column_stack((x, np.asarray(y, dtype=float)*1e-4*sens)),
-            delimiter=',', fmt=['%.3f', '%.6e'], comments='',
-            header='Frequency(MHz),LockinInten(V)')
-    else:
-        pass
 
 
-def preview(id_, hd_line_num, src='src.lwa'):
+def preview(id_, hd_pos, src='src.lwa'):
     """ Preview the scan #id.
         Returns np.array (x, y)
             x, frequency vector, unit in Hz
             y, intensity vector
     """
 
-    srcfile = open(src, 'r')
-    ylist = []
-
-    # get line number window to be copied
-    hd_line_num.append(0)   # add 0 for the last one
-    line_num = 1
-    start = hd_line_num[id_]
-    stop = hd_line_num[id_+1] - 1
-
-    # start reading
-    a_line = srcfile.readline()
-    while a_line:
-        if (line_num >= start+3) and ((line_num <= stop) or (stop == -1)):
-            # add this line to y list
-            ylist.append(a_line.split())
-        elif line_num == start: # get 1st header for sensitivity
-            a_list = a_line.split()
-            sens = float(a_list[9])
-        elif line_num == start+2: # get 3rd header line for x array
-            a_list = a_line.split()
-            xstart = float(a_list[0])
-            xstep = float(a_list[1])
-            pts = int(a_list[2])
-            x = np.linspace(xstart, xstart + xstep*pts, num=pts, endpoint=False)
-            pass
-        a_line = srcfile.readline()
-        line_num += 1
-
-    srcfile.close()
-
-    # flatten ylist
-    y = [i for j in ylist for i in j]
-
-    return np.column_stack((x*1e6, np.asarray(y, dtype=float)*1e-4*sens))
-
-
-def save_lwa(filename, y, h_info):
+    with open(src, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        sens, _, x, y = _read_scan(mm, hd_pos, id_)
+
+    return np.column_stack((x*1e6, y*1e-4*sens))
+
+
+def save_lwa(filename, y, h_info, date=None):
     """ Save lockin scan in the JPL .lwa format
         Arguments
             filename: str
             y: y data, np.array
             h_info: header information tuple
               (synmulti [int], itgtime [ms], sens [V], tc [sec],
-               mod_freq [kHz], mod_depth/dev [%|kHz], mod_mode [str], lia_harm [int], lia_phase [float deg])
+               mod_freq [kHz], mod_depth/dev [%|kHz], mod_mode [str], lia_harm [int], lia_phase [float deg],
+               start_freq [MHz], step [MHz], avg [int], comment [str])
+            date: datetime.datetime, date of the scan, default now
         Lwa header format:
             DATE mm-dd-year TIME hh:mm:ss SH %d IT %g SENS %g TAU %g MF %.3f MA %.3f MOD [NONE|AM|FM] HARM %d PHA %.2f
             [COMMENT]
             [START FREQ MHZ %.3f] [STEP MHZ %.6f] [PTS %d] [AVG %d] 1 1 1.887 0.000 0 0 START
     """
 
-    d = datetime.datetime.today()
-    synmulti, itgtime, sens, tc, mod_freq, mod_depth, mod_mode, lia_harm, lia_phase, start_freq, step, avg, comment = h_info
+    d = date or datetime.datetime.today()
     # rescale y based on sensitivity, full scale is 1e4
-    y = y / sens * 1e4
-
-    with open(filename, 'a') as f:
-        # write first line
-        f.write('DATE ' + d.strftime('%m-%d-%Y'))
-        f.write(' TIME ' + d.strftime('%H:%M:%S'))
-        f.write(' SH {:d}'.format(synmulti))
-        f.write(' IT {:.3g}'.format(itgtime))
-        f.write(' SENS {:.3g}'.format(sens))
-        f.write(' TAU {:.3g}'.format(tc))
-        f.write(' MF {:.3f}'.format(mod_freq))
-        f.write(' MA {:.3f}'.format(mod_depth))
-        f.write(' MOD {:s}'.format(mod_mode))
-        f.write(' HARM {:d}'.format(lia_harm))
-        f.write(' PHA {:.2f}'.format(lia_phase))
-
-        # write second line
-        f.write('\n {:s}'.format(comment))
-
-        # write third line
-        f.write('\n {:.3f}   {:.6f}  {:d}'.format(start_freq, step, len(y)))
-        f.write(' {:d} 1 1  1.887  0.000 0 0 START\n'.format(avg))
-
-        # write y data
-        fmt = '{:10.3f}'*10     # 10 numbers each row
-        for i in range(len(y)//10):
-            f.write(fmt.format(*y[i*10:(i+1)*10]))
-            f.write('\n')
-        # for the last row which may not have 10 numbers. Avoid index error
-        for i in range(len(y) - len(y)//10*10):
-            f.write('{:10.3f}'.format(y[len(y)//10*10+i]))
-        f.write('\n')
+    y = np.asarray(y) / h_info[2] * 1e4
+    # one write for the whole scan
+    with open(filename, 'ab') as f:
+        f.write(_format_header(d, h_info, len(y), h_info[11]) + format_data(y))
 
     return None
+
+
+class LWAWriter:
+    """ Write a scan to the LWA file while it is acquired, so that the data is on disk during long scans.
+    The header is written first. Each call of write() writes the data acquired so far,
+    and patches PTS and AVG in the header, so that the file is a valid LWA file after each call.
+    The scan must stay the last one of the file until the writer is closed.
+
+    Arguments
+        filename: str
+        h_info: tuple, see save_lwa. avg is the target number of averages
+        pts: int, number of points of the scan
+        date: datetime.datetime, date of the scan, default now
+    """
+
+    def __init__(self, filename, h_info, pts, date=None):
+
+        self.filename = filename
+        self.h_info = h_info
+        self._sens = h_info[2]
+        self._w_pts = len(str(pts))
+        self._w_avg = len(str(h_info[11]))
+        # 'a' mode does not allow to write in place
+        open(filename, 'ab').close()
+        self._fp = open(filename, 'r+b')
+        self._start = self._fp.seek(0, os.SEEK_END)
+        header = _format_header(date or datetime.datetime.today(), h_info, 0, 0, self._w_pts, self._w_avg)
+        self._data_pos = self._start + len(header)
+        self._count_pos = self._data_pos - len(_LINE3_END) - self._w_pts - 1 - self._w_avg
+        self._fp.write(header + b'\n')
+        self._fp.flush()
+        # complete rows on disk, and the byte offset of the row after them
+        self._n_rows = 0
+        self._row_pos = self._data_pos
+        self._avg = 0
+
+    def write(self, y, avg):
+        """ Write the data acquired so far.
+        If avg is unchanged and y extends the data written before, only the new rows are written.
+        Otherwise, the data block is rewritten.
+        Arguments
+            y: np.array, average of the acquired sweeps, the first len(y) points of the scan
+            avg: int, number of sweeps in y
+        """
+
+        n = len(y)
+        if len(str(n)) > self._w_pts or len(str(avg)) > self._w_avg:
+            raise ValueError('More points or averages than the header has room for')
+        # rescale y based on sensitivity, full scale is 1e4
+        y = np.asarray(y) / self._sens * 1e4
+        if avg != self._avg or n < self._n_rows * _ROW_FIELDS:
+            self._n_rows = 0
+            self._row_pos = self._data_pos
+        n_rows = n // _ROW_FIELDS
+        # drop the new line of the empty last row
+        rows = format_data(y[self._n_rows * _ROW_FIELDS:n_rows * _ROW_FIELDS])[:-1]
+        self._fp.seek(self._row_pos)
+        self._fp.write(rows + format_data(y[n_rows * _ROW_FIELDS:]))
+        self._fp.truncate()
+        self._fp.seek(self._count_pos)
+        self._fp.write(f'{n:<{self._w_pts}d} {avg:<{self._w_avg}d}'.encode('ascii'))
+        self._fp.flush()
+        self._n_rows = n_rows
+        self._row_pos += len(rows)
+        self._avg = avg
+
+    def close(self):
+        if not self._fp.closed:
+            self._fp.close()
+
+    def discard(self):
+        """ Remove the scan from the file and close """
+        if not self._fp.closed:
+            self._fp.truncate(self._start)
+            self._fp.close()
+
+
+def _format_header(d, h_info, pts, avg, w_pts=0, w_avg=0):
+    """ Format the 3 header lines.
+    w_pts and w_avg are the minimum widths of the PTS and AVG fields, so that they can be patched in place
+    Returns
+        header: bytes
+    """
+
+    synmulti, itgtime, sens, tc, mod_freq, mod_depth, mod_mode, lia_harm, lia_phase, start_freq, step, _, comment = h_info
+    line1 = (f'DATE {d.strftime("%m-%d-%Y")} TIME {d.strftime("%H:%M:%S")} SH {synmulti:d}'
+             f' IT {itgtime:.3g} SENS {sens:.3g} TAU {tc:.3g} MF {mod_freq:.3f} MA {mod_depth:.3f}'
+             f' MOD {mod_mode:s} HARM {lia_harm:d} PHA {lia_phase:.2f}')
+    line3 = f' {start_freq:.3f}   {step:.6f}  {pts:<{w_pts}d} {avg:<{w_avg}d}{_LINE3_END:s}'
+    return f'{line1:s}\n {comment:s}\n{line3:s}'.encode('ascii', errors='replace')
+
+
+def format_data(y) -> bytes:
+    """ Format the data block: {:10.3f} fields, 10 per row, and a new line at the end.
+    The digits of the full rows are computed with numpy for the whole block at once.
+    The output is the same as str.format: values too wide for the field, nan and inf,
+    and the values whose rounding numpy cannot decide exactly, are formatted by python.
+    Arguments
+        y: np.array, rescaled intensity
+    Returns
+        data: bytes
+    """
+
+    y = np.asarray(y, dtype=float)
+    n_rows = len(y) // _ROW_FIELDS
+    # the last row may not have 10 numbers. It always ends with a new line, even if empty
+    tail = _format_data_py(y[n_rows * _ROW_FIELDS:])
+    if n_rows == 0:
+        return tail
+    y = y[:n_rows * _ROW_FIELDS]
+    with np.errstate(invalid='ignore', over='ignore'):
+        y1000 = y * 1000
+        q = np.rint(y1000)
+        # |y| < 1e6, so that the value fits in the field even with the sign
+        is_fit = np.abs(q) < 1e9 - 1
+    if not is_fit.all():
+        return _format_data_py(y)[:-1] + tail
+    # y * 1000 has a rounding error, which can move a value that is close to .5 across the rounding boundary
+    tol = np.abs(y1000).max() * 1e-15 + 1e-300
+    for i in np.flatnonzero(np.abs(np.abs(y1000 - q) - 0.5) <= tol):
+        q[i] = int('{:.3f}'.format(y[i]).replace('.', ''))
+
+    # < 1e9, 32-bit division is faster
+    a = np.abs(q).astype(np.uint32).ravel()
+    # one contiguous row per character position, which is faster than writing the columns
+    chars = np.empty((_FIELD_WIDTH, a.size), dtype=np.uint8)
+    chars[6] = ord('.')
+    n_blank = np.zeros(a.size, dtype=np.uint8)
+    for col in (9, 8, 7, 5, 4, 3, 2, 1, 0):
+        # the integer part has at least 1 digit, the leading zeros are blank
+        is_blank = (a == 0) if col < 5 else None
+        a, r = np.divmod(a, 10)
+        if is_blank is None:
+            chars[col] = r + ord('0')
+        else:
+            chars[col] = np.where(is_blank, ord(' '), r + ord('0'))
+            n_blank += is_blank
+    i_neg = np.flatnonzero(np.signbit(y))
+    if (n_blank[i_neg] == 0).any():
+        # no room for the sign
+        return _format_data_py(y)[:-1] + tail
+    chars[n_blank[i_neg] - 1, i_neg] = ord('-')
+
+    rows = np.empty((n_rows, _ROW_FIELDS * _FIELD_WIDTH + 1), dtype=np.uint8)
+    rows[:, :-1].reshape(n_rows, _ROW_FIELDS, _FIELD_WIDTH)[...] = \
+        chars.reshape(_FIELD_WIDTH, n_rows, _ROW_FIELDS).transpose(1, 2, 0)
+    rows[:, -1] = ord('\n')
+    return rows.tobytes() + tail
+
+
+def _format_data_py(y):
+    """ Format the data block with str.format """
+
+    fmt = '{:10.3f}'*10     # 10 numbers each row
+    n_rows = len(y) // _ROW_FIELDS
+    lines = [fmt.format(*y[i*10:(i+1)*10]) for i in range(n_rows)]
+    lines.append(''.join('{:10.3f}'.format(v) for v in y[n_rows*10:]))
+    return ('\n'.join(lines) + '\n').encode('ascii')
@@ -0,0 +1,285 @@
+#! encoding = utf-8
+
+""" PyMMSp binary spectrum format (.spb), the binary companion of the JPL LWA format.
+The file is a sequence of scan records, so that scans can be appended like in LWA.
+Each record is
+    MAGIC           8 bytes
+    header length   uint64 little-endian
+    header          JSON utf-8, padded with spaces so that the columns are 8-byte aligned
+    columns         raw little-endian float64/float32 arrays, one after another
+The header JSON holds the scan information (same fields as the LWA header),
+and for each column its dtype, shape and byte offset from the start of the columns.
+Columns
+    freq            frequency, MHz
+    lia_x           lockin X, V
+    lia_y           lockin Y, V (optional)
+    sweeps          lockin X of each sweep, V, shape (avg, pts) (optional)
+The values are stored as measured: no rescaling and no rounding.
+"""
+
+import os
+import json
+import struct
+import datetime
+import numpy as np
+from PyMMSp.libs import lwa
+
+SUFFIX = '.spb'
+MAGIC = b'PMSPB\x00\x00\x01'
+_LEN = struct.Struct('<Q')
+_ALIGN = 8
+COLUMNS = ('freq', 'lia_x', 'lia_y', 'sweeps')
+# information fields, in the order of the h_info tuple of lwa.save_lwa
+INFO_FIELDS = ('synmulti', 'itgtime', 'sens', 'tc', 'mod_freq', 'mod_depth', 'mod_mode',
+               'lia_harm', 'lia_phase', 'start_freq', 'step', 'avg', 'comment')
+
+
+def h_info_to_dict(h_info, date=None) -> dict:
+    """ Convert the lwa.save_lwa header tuple to the information dict
+    Arguments
+        h_info: tuple, see lwa.save_lwa
+        date: datetime.datetime, default now
+    Returns
+        info: dict
+    """
+
+    info = dict(zip(INFO_FIELDS, h_info))
+    info['date'] = (date or datetime.datetime.today()).isoformat(timespec='seconds')
+    return info
+
+
+def save_spb(filename, columns: dict, info: dict):
+    """ Append a scan to the .spb file
+    Arguments
+        filename: str
+        columns: dict {name: np.array}. float32 arrays are kept, the others are saved as float64
+        info: dict, scan information, see h_info_to_dict
+    """
+
+    arrays = {}
+    for name, a in columns.items():
+        a = np.asarray(a)
+        dtype = np.dtype('<f4') if a.dtype == np.float32 else np.dtype('<f8')
+        arrays[name] = np.ascontiguousarray(a, dtype=dtype)
+    header, _ = _record_header(info, {name: (a.dtype, a.shape) for name, a in arrays.items()})
+
+    with open(filename, 'ab') as f:
+        # records are aligned as long as the file is only written by save_spb
+        f.write(header)
+        for a in arrays.values():
+            f.write(a.data)
+            f.write(b'\x00' * (-a.nbytes % _ALIGN))
+
+
+class SPBWriter:
+    """ Append a scan of known length to the .spb file, in chunks, without holding it in memory.
+    The columns are 1D, and are filled with nan until written.
+
+    Arguments
+        filename: str
+        pts: int, number of points
+        info: dict, scan information, see h_info_to_dict
+        columns: tuple of column names
+        dtype: str, dtype of the columns
+    """
+
+    def __init__(self, filename, pts, info, columns=('freq', 'lia_x'), dtype='<f8'):
+
+        self._dtype = np.dtype(dtype)
+        header, col_hd = _record_header(info, {name: (self._dtype, (pts,)) for name in columns})
+        open(filename, 'ab').close()
+        self._fp = open(filename, 'r+b')
+        start = self._fp.seek(0, os.SEEK_END)
+        self._fp.write(header)
+        self._offset = {name: start + len(header) + c['offset'] for name, c in col_hd.items()}
+        block = np.full(min(pts, 1 << 20), np.nan, dtype=self._dtype)
+        for name in columns:
+            self._fp.seek(self._offset[name])
+            for k in range(0, pts, max(len(block), 1)):
+                self._fp.write(block[:pts - k].data)
+            self._fp.write(b'\x00' * (-pts * self._dtype.itemsize % _ALIGN))
+
+    def write(self, k0, **arrays):
+        """ Write the points k0, k0 + 1, ... of the columns given as keywords """
+        for name, a in arrays.items():
+            self._fp.seek(self._offset[name] + k0 * self._dtype.itemsize)
+            self._fp.write(np.ascontiguousarray(a, dtype=self._dtype).data)
+
+    def close(self):
+        if not self._fp.closed:
+            self._fp.close()
+
+
+def _record_header(info, columns):
+    """ Build the record header
+    Arguments
+        info: dict
+        columns: dict {name: (dtype, shape)}
+    Returns
+        header: bytes, from MAGIC to the start of the columns
+        col_hd: dict, the column layout in the header
+    """
+
+    col_hd = {}
+    offset = 0
+    for name, (dtype, shape) in columns.items():
+        col_hd[name] = {'dtype': np.dtype(dtype).str, 'shape': list(shape), 'offset': offset}
+        # keep every column aligned
+        offset += -(-int(np.prod(shape)) * np.dtype(dtype).itemsize // _ALIGN) * _ALIGN
+    header = json.dumps({'info': info, 'columns': col_hd, 'nbytes': offset}).encode('utf-8')
+    # pad so that the columns start at an aligned offset from the record start
+    header += b' ' * (-(len(MAGIC) + _LEN.size + len(header)) % _ALIGN)
+    return MAGIC + _LEN.pack(len(header)) + header, col_hd
+
+
+def scan_header(filename):
+    """ Scan the record headers in the .spb file. Only the headers are read.
+    Returns
+        entry_settings: list of entry setting tuples, same as lwa.scan_header. Scan # starts at 1.
+        hd_pos: byte offset of each record in the file,
+                followed by the end of the last record
+    """
+
+    if not filename:
+        return None, None
+    entry_settings = []
+    hd_pos = []
+    end = 0
+    for pos, end, hd in _iter_headers(filename):
+        hd_pos.append(pos)
+        entry_settings.append(_entry_setting(len(hd_pos), hd['info'], hd['columns']))
+    hd_pos.append(end)
+    return entry_settings, hd_pos
+
+
+def scan_info(filename):
+    """ Read the information dict of each scan in the .spb file. Only the headers are read.
+    Returns
+        infos: list of dict
+    """
+
+    return [hd['info'] for _, _, hd in _iter_headers(filename)]
+
+
+def read_scan(id_, hd_pos, src='src.spb', is_mmap=True):
+    """ Read the scan #id (id starts at 0)
+    Arguments
+        id_: int
+        hd_pos: list, from scan_header
+        src: str, filename
+        is_mmap: bool, if True, the columns are read-only memory maps of the file,
+            and the data is only read from the disk when it is accessed
+    Returns
+        info: dict
+        columns: dict {name: np.array}
+    """
+
+    with open(src, 'rb') as f:
+        f.seek(hd_pos[id_])
+        hd, data_pos = _read_header(f)
+        if is_mmap:
+            buf = np.memmap(f, dtype=np.uint8, mode='r', offset=data_pos, shape=(hd['nbytes'],))
+        else:
+            buf = np.frombuffer(f.read(hd['nbytes']), dtype=np.uint8)
+    columns = {}
+    for name, c in hd['columns'].items():
+        dtype = np.dtype(c['dtype'])
+        n = int(np.prod(c['shape'])) * dtype.itemsize
+        columns[name] = buf[c['offset']:c['offset'] + n].view(dtype).reshape(c['shape'])
+    return hd['info'], columns
+
+
+def preview(id_, hd_pos, src='src.spb'):
+    """ Preview the scan #id, same as lwa.preview.
+        Returns np.array (x, y)
+            x, frequency vector, unit in Hz
+            y, intensity vector, V
+    """
+
+    _, columns = read_scan(id_, hd_pos, src=src, is_mmap=False)
+    return np.column_stack((columns['freq'] * 1e6, columns['lia_x']))
+
+
+def lwa_to_spb(src, output, dtype='<f8'):
+    """ Convert a LWA file to a .spb file
+    Arguments
+        src: str, LWA file
+        output: str, .spb file. Scans are appended if it exists
+        dtype: str, dtype of the lockin columns
+    """
+
+    entry_settings, hd_pos = lwa.scan_header(src)
+    synmulti = lwa.scan_synmulti(src, hd_pos)
+    for i, entry in enumerate(entry_settings):
+        (_, comment, date, time, it, sens, tc, mmode, mf, ma,
+         startf, _, step, pts, avg, harm, phase) = entry
+        data = lwa.preview(i, hd_pos, src=src)
+        info = dict(zip(INFO_FIELDS, (synmulti[i], it, sens, tc, mf, ma, mmode, harm, phase,
+                                      startf, step, avg, comment)))
+        info['date'] = datetime.datetime.strptime(f'{date:s} {time:s}', '%m-%d-%Y %H:%M:%S').isoformat()
+        save_spb(output, {'freq': data[:, 0] * 1e-6, 'lia_x': data[:, 1].astype(dtype)}, info)
+
+
+def spb_to_lwa(src, output):
+    """ Convert a .spb file to a LWA file. The intensity is rounded to the LWA precision
+    Arguments
+        src: str, .spb file
+        output: str, LWA file. Scans are appended if it exists
+    """
+
+    _, hd_pos = scan_header(src)
+    for id_ in range(len(hd_pos) - 1):
+        info, columns = read_scan(id_, hd_pos, src=src)
+        h_info = tuple(info[k] for k in INFO_FIELDS)
+        lwa.save_lwa(output, columns['lia_x'], h_info, date=datetime.datetime.fromisoformat(info['date']))
+
+
+def _read_header(f):
+    """ Read the record header at the current position of f
+    Returns
+        hd: dict
+        data_pos: int, file offset of the columns
+    """
+
+    pos = f.tell()
+    b = f.read(len(MAGIC) + _LEN.size)
+    if b[:len(MAGIC)] != MAGIC[:len(b)]:
+        raise ValueError(f'No .spb record at byte {pos:d}')
+    if len(b) < len(MAGIC) + _LEN.size:
+        raise EOFError
+    hd_len, = _LEN.unpack_from(b, len(MAGIC))
+    b_hd = f.read(hd_len)
+    if len(b_hd) < hd_len:
+        raise EOFError
+    return json.loads(b_hd), pos + len(b) + hd_len
+
+
+def _iter_headers(filename):
+    """ Iterate over (start, end, header) of the records, skipping the columns """
+
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        pos = 0
+        while pos < size:
+            f.seek(pos)
+            try:
+                hd, data_pos = _read_header(f)
+            except EOFError:
+                # incomplete last record, e.g. still being written
+                break
+            if data_pos + hd['nbytes'] > size:
+                break
+            end = data_pos + hd['nbytes']
+            yield pos, end, hd
+            pos = end
+
+
+def _entry_setting(scan_num, info, columns):
+    """ Build the entry setting tuple of lwa.scan_header from the information dict """
+
+    d = datetime.datetime.fromisoformat(info['date'])
+    pts = columns['freq']['shape'][0]
+    return (scan_num, info['comment'], d.strftime('%m-%d-%Y'), d.strftime('%H:%M:%S'),
+            info['itgtime'], info['sens'], info['tc'], info['mod_mode'], info['mod_freq'], info['mod_depth'],
+            info['start_freq'], info['start_freq'] + info['step'] * pts, info['step'], pts, info['avg'],
+            info['lia_harm'], info['lia_phase'])
@@ -0,0 +1,252 @@
+#! encoding = utf-8
+
+""" Stitch overlapping scans into one spectrum.
+The frequency ranges of the scans are indexed in an interval tree. The merged spectrum is
+computed on a regular frequency grid, one chunk at a time: only the scans overlapping the
+chunk are loaded, and a scan is released as soon as the chunks have passed its range.
+Where scans overlap, their intensities are interpolated on the grid and averaged with weights:
+    'avg'       the number of averages of the scan
+    'noise'     1/sigma^2, sigma measured from the point to point differences of the scan
+    'equal'     1
+Frequencies are in MHz, intensities in V.
+"""
+
+import datetime
+from dataclasses import dataclass
+import numpy as np
+from PyMMSp.libs import lwa, spb
+
+WEIGHTS = ('avg', 'noise', 'equal')
+
+
+@dataclass(frozen=True)
+class ScanRef:
+    """ A scan in a data file, loaded on demand """
+
+    path: str
+    id_: int            # index in the file, starts at 0
+    start: float        # MHz
+    stop: float         # MHz, last point
+    step: float = 0.    # MHz
+    avg: int = 1
+
+
+class IntervalTree:
+    """ Static centered interval tree
+
+    Arguments
+        intervals: list of (lo, hi, item)
+    """
+
+    def __init__(self, intervals):
+
+        self._root = self._build(sorted(intervals, key=lambda iv: iv[0]))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        center = intervals[len(intervals) // 2][0]
+        left = [iv for iv in intervals if iv[1] < center]
+        right = [iv for iv in intervals if iv[0] > center]
+        here = [iv for iv in intervals if iv[0] <= center <= iv[1]]
+        # node: center, intervals sorted by lo, intervals sorted by hi descending, left, right
+        return (center, here, sorted(here, key=lambda iv: iv[1], reverse=True),
+                self._build(left), self._build(right))
+
+    def overlap(self, lo, hi) -> list:
+        """ Items of the intervals overlapping [lo, hi] """
+
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            center, by_lo, by_hi, left, right = node
+            if hi < center:
+                for iv in by_lo:
+                    if iv[0] > hi:
+                        break
+                    found.append(iv[2])
+                stack.append(left)
+            elif lo > center:
+                for iv in by_hi:
+                    if iv[1] < lo:
+                        break
+                    found.append(iv[2])
+                stack.append(right)
+            else:
+                found.extend(iv[2] for iv in by_lo)
+                stack.append(left)
+                stack.append(right)
+        return found
+
+
+def scans_from_files(paths) -> [ScanRef]:
+    """ List the scans of .lwa, .spb and .dat files """
+
+    scans = []
+    for path in paths:
+        if path.endswith('.lwa') or path.endswith(spb.SUFFIX):
+            reader = spb if path.endswith(spb.SUFFIX) else lwa
+            entry_settings, _ = reader.scan_header(path)
+            for i, entry in enumerate(entry_settings):
+                startf, step, pts, avg = entry[10], entry[12], entry[13], entry[14]
+                scans.append(ScanRef(path, i, startf, startf + step * (pts - 1), step, max(avg, 1)))
+        else:
+            x = np.loadtxt(path, usecols=0, ndmin=1)
+            step = (x.max() - x.min()) / (len(x) - 1) if len(x) > 1 else 0.
+            scans.append(ScanRef(path, 0, float(x.min()), float(x.max()), float(step)))
+    return scans
+
+
+def scans_from_catalog(rows) -> [ScanRef]:
+    """ Convert the rows of catalog.query """
+
+    # the stop frequency of the LWA header is one step after the last point
+    return [ScanRef(r['path'], r['scan_num'] - 1, r['start_freq'],
+                    r['start_freq'] + r['step'] * (r['pts'] - 1) if r['step'] else r['stop_freq'],
+                    r['step'] or 0., max(r['avg'] or 1, 1)) for r in rows]
+
+
+def stitch(scans, step=None, freq_range=None, weight='avg', chunk_pts=100000):
+    """ Merge the scans, chunk by chunk
+    Arguments
+        scans: list of ScanRef
+        step: float, MHz, step of the merged spectrum. Default the smallest step of the scans
+        freq_range: (float, float), MHz. Default the range of all scans
+        weight: str, one of WEIGHTS
+        chunk_pts: int, number of points per chunk
+    Yields
+        x: np.array, MHz
+        y: np.array, V. nan where no scan covers the frequency
+    """
+
+    if weight not in WEIGHTS:
+        raise ValueError(f'weight must be one of {WEIGHTS}')
+    if not scans:
+        return
+    tree = IntervalTree([(s.start, s.stop, s) for s in scans])
+    f_lo, step, n_total = grid(scans, step, freq_range, tree)
+    loader = _Loader(weight)
+    for k0 in range(0, n_total, chunk_pts):
+        x = f_lo + step * np.arange(k0, min(k0 + chunk_pts, n_total))
+        num = np.zeros_like(x)
+        den = np.zeros_like(x)
+        for s in tree.overlap(x[0], x[-1]):
+            xs, ys, w = loader.load(s)
+            i0 = np.searchsorted(x, xs[0], side='left')
+            i1 = np.searchsorted(x, xs[-1], side='right')
+            num[i0:i1] += w * np.interp(x[i0:i1], xs, ys)
+            den[i0:i1] += w
+        # the chunks go up in frequency: the scans below this chunk are not needed anymore
+        loader.release(x[-1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            yield x, num / den
+
+
+def grid(scans, step=None, freq_range=None, tree=None):
+    """ Frequency grid of the merged spectrum, see stitch
+    Returns
+        f_lo: float, MHz, first frequency
+        step: float, MHz
+        n_total: int, number of points
+    """
+
+    f_lo, f_hi = freq_range or (min(s.start for s in scans), max(s.stop for s in scans))
+    if step is None:
+        tree = tree or IntervalTree([(s.start, s.stop, s) for s in scans])
+        step = min(s.step for s in tree.overlap(f_lo, f_hi) if s.step > 0)
+    return f_lo, step, int(round((f_hi - f_lo) / step)) + 1
+
+
+def stitch_to_file(scans, output, step=None, freq_range=None, **kwargs):
+    """ Merge the scans into a file.
+    A .spb output has the columns freq and lia_x, with nan where no scan covers the frequency.
+    Otherwise, the output is a text file of 2 columns, frequency (MHz) and intensity (V),
+    without the frequencies not covered by any scan.
+    Arguments
+        scans: list of ScanRef
+        output: str
+        step, freq_range, kwargs: see stitch
+    Returns
+        n: int, number of points written
+    """
+
+    f_lo, step, n_total = grid(scans, step, freq_range)
+    chunks = stitch(scans, step=step, freq_range=(f_lo, f_lo + step * (n_total - 1)), **kwargs)
+    n = 0
+    if output.endswith(spb.SUFFIX):
+        info = dict.fromkeys(spb.INFO_FIELDS, 0)
+        info.update(mod_mode='UNKNOWN', start_freq=f_lo, step=step, comment=f'stitched from {len(scans):d} scans',
+                    date=datetime.datetime.today().isoformat(timespec='seconds'))
+        w = spb.SPBWriter(output, n_total, info)
+        try:
+            for x, y in chunks:
+                w.write(n, freq=x, lia_x=y)
+                n += len(x)
+        finally:
+            w.close()
+        return n
+
+    with open(output, 'w') as f:
+        f.write('Frequency(MHz) LockinInten(V)\n')
+        for x, y in chunks:
+            is_valid = np.isfinite(y)
+            np.savetxt(f, np.column_stack((x[is_valid], y[is_valid])), fmt=['%.6f', '%.6e'])
+            n += is_valid.sum()
+    return int(n)
+
+
+def noise_sigma(y) -> float:
+    """ Estimate the noise of a spectrum from the median of the point to point differences,
+    which is insensitive to the lines and the baseline """
+    d = np.abs(np.diff(y))
+    return float(np.median(d) / 0.6745 / np.sqrt(2)) if len(d) else 0.
+
+
+class _Loader:
+    """ Load the scans on demand, and keep them until they are released """
+
+    def __init__(self, weight):
+        self._weight = weight
+        self._active = {}
+        # {path: hd_pos}
+        self._hd_pos = {}
+
+    def load(self, s: ScanRef):
+        """ Returns x (MHz), y (V), weight """
+        try:
+            return self._active[s]
+        except KeyError:
+            pass
+        x, y = self._read(s)
+        if self._weight == 'avg':
+            w = s.avg
+        elif self._weight == 'noise':
+            sigma = noise_sigma(y)
+            w = 1 / sigma ** 2 if sigma > 0 else 1.
+        else:
+            w = 1.
+        self._active[s] = (x, y, w)
+        return x, y, w
+
+    def release(self, freq):
+        """ Release the scans that end below freq """
+        for s in [s for s in self._active if s.stop < freq]:
+            del self._active[s]
+
+    def _read(self, s: ScanRef):
+        path = s.path
+        if path.endswith('.lwa') or path.endswith(spb.SUFFIX):
+            reader = spb if path.endswith(spb.SUFFIX) else lwa
+            if path not in self._hd_pos:
+                self._hd_pos[path] = reader.scan_header(path)[1]
+            data = reader.preview(s.id_, self._hd_pos[path], src=path)
+            x, y = data[:, 0] * 1e-6, data[:, 1]
+        else:
+            data = np.loadtxt(path, ndmin=2)
+            x, y = data[:, 0], data[:, 1]
+        # np.interp needs increasing x
+        order = np.argsort(x, kind='stable')
+        return x[order], y[order]
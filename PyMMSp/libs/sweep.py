@@ -0,0 +1,109 @@
+#! encoding = utf-8
+
+""" Multi-sweep averaging.
+Every sweep is kept in a preallocated 2-D array (n_sweeps, n_pts), which is
+memory-mapped to a .npy file for large scans.
+The mean and variance of the accepted sweeps are updated online (Welford),
+and a sweep whose residual against the running mean is too large
+(e.g. a sudden baseline jump) is rejected from the average.
+"""
+
+import os
+import tempfile
+import numpy as np
+
+# arrays larger than this (in bytes) are memory-mapped
+MEMMAP_MIN_BYTES = 64 * 1024 * 1024
+
+
+class SweepStack:
+    """ Store all sweeps of a scan and average them online
+
+    Arguments
+        n_sweeps: int           max number of sweeps
+        n_pts: int              number of points per sweep
+        reject_thresh: float    reject a sweep if its rms residual against the running mean
+                                exceeds reject_thresh times the expected one. 0 disables rejection
+        filename: str           memory-map the sweeps to this .npy file, which is kept after close.
+                                If not given, a temporary file is used for large scans only,
+                                and the sweeps are lost after close
+    """
+
+    def __init__(self, n_sweeps: int, n_pts: int, reject_thresh: float = 0, filename: str = ''):
+
+        self.reject_thresh = reject_thresh
+        self._tmp_file = ''
+        if not filename and n_sweeps * n_pts * 8 > MEMMAP_MIN_BYTES:
+            fd, filename = tempfile.mkstemp(suffix='.npy')
+            os.close(fd)
+            self._tmp_file = filename
+        if filename:
+            self.sweeps = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64,
+                                                    shape=(n_sweeps, n_pts))
+            self.sweeps[:] = np.nan
+        else:
+            self.sweeps = np.full((n_sweeps, n_pts), np.nan)
+        self.accepted = np.zeros(n_sweeps, dtype=bool)
+        self.n_taken = 0
+        # Welford running stats of the accepted sweeps
+        self.n_avg = 0
+        self.mean = np.zeros(n_pts)
+        self._m2 = np.zeros(n_pts)
+
+    def add_sweep(self, y: np.ndarray) -> bool:
+        """ Store a finished sweep, and add it to the average unless rejected
+        Returns
+            is_accepted: bool
+        """
+
+        self.sweeps[self.n_taken] = y
+        is_accepted = not self.is_drift(y)
+        if is_accepted:
+            self.n_avg += 1
+            delta = y - self.mean
+            self.mean += delta / self.n_avg
+            self._m2 += delta * (y - self.mean)
+        self.accepted[self.n_taken] = is_accepted
+        self.n_taken += 1
+        return is_accepted
+
+    def is_drift(self, y: np.ndarray) -> bool:
+        """ Check if the sweep y deviates too much from the running mean.
+        The rms residual of a new sweep is expected to be sigma * sqrt(1 + 1/n),
+        where sigma is the typical single-sweep noise estimated from the accepted sweeps.
+        """
+
+        if self.reject_thresh <= 0 or self.n_avg < 2:
+            return False
+        sigma = np.sqrt(np.mean(self.var))
+        res = np.sqrt(np.mean((y - self.mean) ** 2))
+        return res > self.reject_thresh * sigma * np.sqrt(1 + 1 / self.n_avg)
+
+    @property
+    def var(self) -> np.ndarray:
+        """ Per-point variance of a single sweep """
+        if self.n_avg < 2:
+            return np.full_like(self.mean, np.nan)
+        return self._m2 / (self.n_avg - 1)
+
+    @property
+    def err(self) -> np.ndarray:
+        """ Per-point standard error of the mean """
+        if self.n_avg < 2:
+            return np.full_like(self.mean, np.nan)
+        return np.sqrt(self.var / self.n_avg)
+
+    def is_converged(self, tol: float) -> bool:
+        """ All points reach the target standard error tol. tol <= 0 never converges """
+        return tol > 0 and self.n_avg >= 2 and np.max(self.err) < tol
+
+    def close(self):
+        """ Release the memory map and remove the temporary file.
+        Save the sweeps before calling this if they are needed. """
+        if isinstance(self.sweeps, np.memmap):
+            self.sweeps.flush()
+        if self._tmp_file:
+            # the file cannot be removed on Windows while it is still mapped
+            self.sweeps = None
+            os.remove(self._tmp_file)
+            self._tmp_file = ''
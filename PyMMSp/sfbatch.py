@@ -0,0 +1,229 @@
+# encoding = utf-8
+""" Batch spectral fitting with sflib, on a pool of processes.
+
+The tasks are read from a manifest, a json lines file with one task per line:
+    {"file": "scan1.csv", "init": [240012.3, 0.3, 1e-3], "ftype": 0, "der": 2}
+Keys
+    file            spectrum file, relative to the manifest directory
+    init            initial guess, (mu, width, A) for each peak
+    ftype           0 (or "gaussian") / 1 (or "lorentzian"), default 0
+    der             derivative order, 0-4, default 0
+    peak            number of peaks, default len(init) // 3
+    deg             order of the polynomial baseline, default 0
+    boxwin          boxcar smooth window, default 1
+    rescale         rescale factor of the intensity, default 1
+    smooth_edge     see sflib.fit_spectrum, default false
+
+Each task runs read_file -> fit_spectrum -> save_fit / save_log, and the results
+of all tasks are collected in one csv table, one row per peak.
+
+    python -m PyMMSp.sfbatch manifest.jsonl --out fits --workers 8 --timeout 60
+"""
+
+import os
+import csv
+import json
+import argparse
+import multiprocessing
+import multiprocessing.connection
+from time import perf_counter
+import numpy as np
+from PyMMSp import sflib
+
+FTYPES = {'gaussian': 0, 'lorentzian': 1}
+PAR_NAMES = (('mu', 'sigma', 'A'), ('mu', 'gamma', 'A'))
+SUMMARY_FILE = 'fit_summary.csv'
+SUMMARY_FIELDS = ('file', 'status', 'error', 'ftype', 'der', 'peak_idx', 'mu', 'mu_err',
+                  'width', 'width_err', 'A', 'A_err', 'noise', 'elapsed')
+# fit_stat of sflib
+STATUS = {0: 'ok', 1: 'fit failed', 2: 'file not found', 3: 'unsupported file format', 4: 'baseline fit failed'}
+
+
+def load_manifest(filename) -> list:
+    """ Load the tasks of the manifest. The file paths are made relative to the manifest directory """
+
+    tasks = []
+    root = os.path.dirname(os.path.abspath(filename))
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() and not line.lstrip().startswith('#'):
+                task = json.loads(line)
+                task['file'] = os.path.join(root, task['file'])
+                tasks.append(task)
+    return tasks
+
+
+def fit_task(task: dict, out_dir=None) -> dict:
+    """ Fit one spectrum, and save the fit and the log to out_dir
+    Arguments
+        task: dict, see the manifest keys
+        out_dir: str, default the directory of the spectrum file
+    Returns
+        result: dict {'file', 'status', 'error', 'ftype', 'der', 'popt', 'uncertainty', 'noise', 'elapsed'}
+    """
+
+    t0 = perf_counter()
+    ftype = task.get('ftype', 0)
+    ftype = FTYPES[ftype.lower()] if isinstance(ftype, str) else int(ftype)
+    der = int(task.get('der', 0))
+    init = np.asarray(task['init'], dtype=float)
+    peak = int(task.get('peak', len(init) // 3))
+    result = {'file': task['file'], 'status': 'ok', 'error': '', 'ftype': ftype, 'der': der,
+              'popt': [], 'uncertainty': [], 'noise': None}
+    try:
+        xdata, ydata, stat = sflib.read_file(task['file'], task.get('boxwin', 1), task.get('rescale', 1))
+        if not stat:
+            f = sflib.Function(ftype, der, peak)
+            popt, uncertainty, noise, ppoly, stat = sflib.fit_spectrum(
+                f, xdata, ydata, init, task.get('deg', 0), task.get('smooth_edge', False))
+        if stat:
+            result['status'] = STATUS.get(stat, 'failed')
+        else:
+            baseline = np.polyval(ppoly, xdata - np.median(xdata))
+            fit = f.get_func()(xdata, *popt) + baseline
+            name = os.path.splitext(os.path.basename(task['file']))[0]
+            out_name = os.path.join(out_dir or os.path.dirname(task['file']), 'Fit' + name)
+            sflib.save_fit(out_name + '.csv', np.column_stack((xdata, ydata, fit, baseline)),
+                           popt, ftype, der, peak)
+            sflib.save_log(out_name + '.log', popt, uncertainty, ppoly, ftype, der, peak, PAR_NAMES[ftype])
+            result.update(popt=[float(p) for p in popt], uncertainty=[float(u) for u in uncertainty],
+                          noise=float(noise))
+    except Exception as err:
+        # a bad task must not stop the batch
+        result.update(status='error', error=f'{type(err).__name__:s}: {err}')
+    result['elapsed'] = perf_counter() - t0
+    return result
+
+
+def fit_batch(tasks, out_dir=None, n_workers=None, timeout=None, progress=None) -> list:
+    """ Fit the tasks on a pool of processes
+    Arguments
+        tasks: list of dict, see load_manifest
+        out_dir: str, output directory of the fits and the summary table, default the current directory
+        n_workers: int, number of processes, default the number of CPUs. 1 to fit in this process
+        timeout: float, seconds. A task running longer is stopped by killing its process.
+            Not applied if n_workers is 1
+        progress: callable(n_done, n_total, result), called after each task
+    Returns
+        results: list of result dicts of fit_task, in the order of the tasks
+    """
+
+    out_dir = out_dir or os.getcwd()
+    os.makedirs(out_dir, exist_ok=True)
+    if n_workers == 1:
+        results = []
+        for task in tasks:
+            results.append(fit_task(task, out_dir))
+            if progress:
+                progress(len(results), len(tasks), results[-1])
+    else:
+        results = _fit_pool(tasks, out_dir, n_workers or os.cpu_count(), timeout, progress)
+    save_summary(os.path.join(out_dir, SUMMARY_FILE), results)
+    return results
+
+
+def save_summary(filename, results):
+    """ Save the results in a csv table, one row per peak (one row if the fit failed) """
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for r in results:
+            row = {k: r.get(k) for k in ('file', 'status', 'error', 'der', 'noise')}
+            row['ftype'] = ('gaussian', 'lorentzian')[r['ftype']] if r.get('ftype') in (0, 1) else r.get('ftype')
+            row['elapsed'] = f'{r["elapsed"]:.3f}' if r.get('elapsed') is not None else ''
+            popt = r.get('popt') or []
+            unc = r.get('uncertainty') or [None] * len(popt)
+            if not popt:
+                writer.writerow(row)
+            for k in range(len(popt) // 3):
+                row.update(peak_idx=k + 1, mu=popt[3 * k], width=popt[3 * k + 1], A=popt[3 * k + 2],
+                           mu_err=unc[3 * k], width_err=unc[3 * k + 1], A_err=unc[3 * k + 2])
+                writer.writerow(row)
+
+
+def _run_task(conn, task, out_dir):
+    """ Fit one task in a child process, and send the result back """
+    try:
+        conn.send(fit_task(task, out_dir))
+    finally:
+        conn.close()
+
+
+def _fit_pool(tasks, out_dir, n_workers, timeout, progress):
+    """ Run each task in its own process, at most n_workers processes at a time.
+    A task running over the timeout is stopped by terminating its process,
+    which leaves the other tasks untouched.
+    """
+
+    results = [None] * len(tasks)
+    todo = iter(enumerate(tasks))
+    # {task: (process, receiving end of the pipe, start time)}
+    running = {}
+    n_done = 0
+    while True:
+        while len(running) < n_workers:
+            i, task = next(todo, (None, None))
+            if task is None:
+                break
+            conn, child_conn = multiprocessing.Pipe(duplex=False)
+            proc = multiprocessing.Process(target=_run_task, args=(child_conn, task, out_dir), daemon=True)
+            proc.start()
+            child_conn.close()
+            running[i] = (proc, conn, perf_counter())
+        if not running:
+            break
+        # wait for a result, a process exit, or the next timeout
+        if timeout:
+            wait_time = max(min(t0 for _, _, t0 in running.values()) + timeout - perf_counter(), 0)
+        else:
+            wait_time = None
+        multiprocessing.connection.wait([c for _, c, _ in running.values()]
+                                        + [p.sentinel for p, _, _ in running.values()], wait_time)
+        now = perf_counter()
+        for i, (proc, conn, t0) in list(running.items()):
+            is_alive = proc.is_alive()
+            if conn.poll():
+                try:
+                    results[i] = conn.recv()
+                except EOFError:
+                    results[i] = _failed(tasks[i], 'error', 'worker stopped', now - t0)
+            elif not is_alive:
+                results[i] = _failed(tasks[i], 'error', f'worker exit code {proc.exitcode}', now - t0)
+            elif timeout and now - t0 > timeout:
+                proc.terminate()
+                results[i] = _failed(tasks[i], 'timeout', f'over {timeout:g} s', now - t0)
+            else:
+                continue
+            proc.join()
+            conn.close()
+            del running[i]
+            n_done += 1
+            if progress:
+                progress(n_done, len(tasks), results[i])
+    return results
+
+
+def _failed(task, status, error, elapsed):
+    return {'file': task['file'], 'status': status, 'error': error, 'ftype': task.get('ftype', 0),
+            'der': task.get('der', 0), 'popt': [], 'uncertainty': [], 'noise': None, 'elapsed': elapsed}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch spectral fitting')
+    parser.add_argument('manifest', help='json lines file of the tasks')
+    parser.add_argument('--out', default='.', help='output directory')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--timeout', type=float, default=None, help='time limit per task, s')
+    args = parser.parse_args(argv)
+
+    def _progress(n_done, n_total, result):
+        print(f'[{n_done:d}/{n_total:d}] {result["status"]:10s} {result["file"]:s} {result["error"]:s}')
+
+    results = fit_batch(load_manifest(args.manifest), args.out, args.workers, args.timeout, _progress)
+    n_ok = sum(r['status'] == 'ok' for r in results)
+    print(f'{n_ok:d}/{len(results):d} fits succeeded, summary in {os.path.join(args.out, SUMMARY_FILE):s}')
+
+
+if __name__ == '__main__':
+    main()
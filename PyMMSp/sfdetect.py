@@ -0,0 +1,454 @@
+# encoding = utf-8
+""" Automatic line detection for sflib, to reduce a full survey to a line list.
+
+The spectrum is cross-correlated with the lineshape template of sflib.Function,
+for a few trial widths (the matched filter of a line). The correlation is done by
+FFT, overlap-add, so that millions of points take a fraction of a second.
+The noise of the filter output is estimated from its median absolute deviation,
+which is insensitive to the lines, and the lines are the local maxima of SNR above
+the threshold. The filter output of a strong line has sidelobes: from the strongest
+line down, the output predicted from the line and its template is subtracted
+from the weaker peaks nearby, which are kept only if they are still above the threshold.
+The template gives for each line an initial guess (mu, width, A).
+The spectrum is then cut into independent windows: the lines closer than the fit
+window are grouped, and each window is fitted by sflib.fit_spectrum, on a pool of processes.
+The lines whose fitted amplitude is not significant are dropped, and the window is fitted again.
+
+    python -m PyMMSp.sfdetect survey.csv --der 2 --width 0.2 0.5 --snr 6 --out lines.csv --workers 8
+
+The x values must be increasing and about evenly spaced (a survey on a frequency grid).
+"""
+
+import os
+import csv
+import argparse
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from time import perf_counter
+import numpy as np
+from scipy.signal import oaconvolve, find_peaks
+from PyMMSp import sflib
+from PyMMSp.sfbatch import FTYPES, STATUS
+
+# columns of the detected lines
+LINE_FIELDS = ('mu', 'width', 'A', 'snr')
+LINE_LIST_FIELDS = ('window', 'x_start', 'x_stop', 'status', 'error', 'peak_idx', 'mu', 'mu_err',
+                    'width', 'width_err', 'A', 'A_err', 'snr', 'noise')
+# half width of the templates, in units of the width, gaussian / lorentzian
+_TEMPLATE_HW = (6., 12.)
+# half width of the fit window around a line, in units of the width, gaussian / lorentzian.
+# sflib.base takes the data beyond 4 sigma / 2.5 gamma as baseline
+WINDOW_HW = (8., 6.)
+# median absolute deviation to sigma
+_MAD_SIGMA = 1.4826
+# line widths fitted from widths[0] / _WIDTH_EXT to widths[-1] * _WIDTH_EXT, see _fit_lines
+_WIDTH_EXT = 1.5
+_N_WIDTH_GRID = 256
+# relative error of the predicted filter output of a line, and passes of refinement, see _deblend
+_SIDELOBE_TOL = 0.25
+_N_DEBLEND = 2
+
+
+@dataclass(frozen=True)
+class Window:
+    """ A part of the spectrum fitted on its own """
+
+    i0: int             # first index
+    i1: int             # end index, excluded
+    init: tuple         # initial guess, (mu, width, A) of each line
+    snr: tuple          # detection SNR of each line
+
+    @property
+    def peak(self):
+        return len(self.init) // 3
+
+
+def detect(x, y, ftype=0, der=0, widths=None, snr=5., sign=1, noise_block=None) -> np.ndarray:
+    """ Detect the lines by matched filtering
+    Arguments
+        x: np.array, increasing, about evenly spaced
+        y: np.array
+        ftype: int, 0 gaussian / 1 lorentzian
+        der: int, derivative order, 0-4
+        widths: list of float, trial widths (sigma or gamma) in x unit. Default 2, 4, 8, 16 steps.
+            The width of a line is interpolated between the trial widths
+        snr: float, detection threshold
+        sign: 1 / -1, sign of the lines, for the spectra recorded upside down
+        noise_block: int, estimate the noise in blocks of this many points, if it varies
+            along the spectrum. Default one estimate for the whole spectrum
+    Returns
+        lines: np.array, shape (n, 4), columns LINE_FIELDS, in the order of mu
+    """
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    step = float(np.median(np.diff(x)))
+    if not step > 0:
+        raise ValueError('x must be increasing')
+    widths = step * np.array([2., 4., 8., 16.]) if widths is None else np.sort(np.asarray(widths, dtype=np.float64))
+    f = sflib.Function(ftype, der, 1).get_func()
+
+    def _profile(w, frac=0.):
+        # line of width w centered at frac steps from the central point
+        hw = max(int(np.ceil(_TEMPLATE_HW[ftype] * w / step)), 1)
+        return f(step * (np.arange(-hw, hw + 1) - frac), 0., w, 1.)
+
+    # remove the constant baseline, the templates take care of the rest
+    y = y - np.median(y)
+    # SNR of each template, shape (widths, points)
+    snrs = np.empty((len(widths), len(y)))
+    tpls = []
+    sigmas = []
+    for k, w in enumerate(widths):
+        # a zero-sum template is blind to the baseline offset
+        tpl = _profile(w)
+        tpl -= tpl.mean()
+        tpls.append(tpl)
+        # correlation = convolution with the reversed template. The reflected edges
+        # keep the edge baseline out of the filter output
+        hw = len(tpl) // 2
+        c = oaconvolve(np.pad(y, hw, mode='reflect' if len(y) > hw else 'edge'), tpl[::-1], mode='valid')
+        sigmas.append(robust_sigma(c, noise_block))
+        snrs[k] = sign * c / sigmas[-1]
+    # one peak per line: the filter output of a line is about the line width wide
+    idx, _ = find_peaks(snrs.max(axis=0), height=snr, distance=max(int(round(widths[0] / step)), 1))
+    s = snrs[:, idx]
+    # line center between the points, vertex of the parabola through the peak of the best template
+    k = s.argmax(axis=0)
+    y0, y1, y2 = snrs[k, np.maximum(idx - 1, 0)], snrs[k, idx], snrs[k, np.minimum(idx + 1, len(y) - 1)]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.clip(np.nan_to_num(0.5 * (y0 - y2) / (y0 - 2 * y1 + y2)), -0.5, 0.5)
+    del snrs
+    sigma = np.array([np.broadcast_to(sg, y.shape)[idx] for sg in sigmas])
+
+    width, amp, s, is_kept = _deblend(idx, frac, s, sigma, _responses(widths, tpls, _profile), tpls, _profile, snr)
+    return np.column_stack((x[idx] + frac * step, width, sign * amp, s.max(axis=0)))[is_kept]
+
+
+def _responses(widths, tpls, profile):
+    """ Response of the templates to a line of unit amplitude, on a fine grid of widths
+    Returns
+        grid: np.array, widths of the line
+        resp: np.array, filter output at the line center, shape (grid, templates)
+    """
+
+    if len(widths) > 1:
+        grid = np.geomspace(widths[0] / _WIDTH_EXT, widths[-1] * _WIDTH_EXT, _N_WIDTH_GRID)
+    else:
+        grid = widths
+    return grid, np.array([[np.dot(_centered(profile(w), len(tpl)), tpl) for tpl in tpls] for w in grid])
+
+
+def _fit_lines(responses, s, sigma):
+    """ Width and amplitude of the peaks from their SNR for each template.
+    The width is the one of the grid whose response is the most similar to the SNR of the peak,
+    and the amplitude is the least square scale of the response
+    Arguments
+        responses: (grid, resp), see _responses
+        s: np.array, SNR, shape (templates, peaks)
+        sigma: np.array, noise of the output of the templates at the peaks, shape as s
+    Returns
+        width: np.array
+        amp: np.array, times the sign of the lines
+    """
+
+    grid, resp = responses
+    # in SNR unit, shape (grid, templates, peaks)
+    rho = resp[:, :, np.newaxis] / sigma[np.newaxis]
+    dot = np.einsum('gkp,kp->gp', rho, s)
+    norm2 = np.einsum('gkp,gkp->gp', rho, rho)
+    g = np.argmax(dot / np.sqrt(norm2), axis=0)
+    cols = np.arange(s.shape[1])
+    return grid[g], dot[g, cols] / norm2[g, cols]
+
+
+def _centered(a, n):
+    """ The n central points of a, zero padded if a is shorter """
+    if len(a) >= n:
+        k = (len(a) - n) // 2
+        return a[k:k + n]
+    k = (n - len(a)) // 2
+    return np.pad(a, (k, n - len(a) - k))
+
+
+def _deblend(idx, frac, s, sigma, responses, tpls, profile, snr):
+    """ Separate the lines from the filter output of their neighbours.
+    The filter output of a line extends beyond the line, with sidelobes: the peaks near a strong
+    line may be nothing but its sidelobes, and the SNR of blended lines is biased.
+    From the strongest peak down, each line is fitted (see _fit_lines), and its predicted output
+    is subtracted from the SNR of the weaker peaks nearby. Then each line is fitted again with
+    the output of all its neighbours subtracted. A peak is kept if its remaining SNR is above snr
+    plus a fraction of the subtracted SNR, for the error of the prediction.
+    Arguments
+        idx: np.array, increasing indices of the peaks
+        frac: np.array, line centers from idx, in steps
+        s: np.array, SNR of the peaks for each template, shape (templates, peaks)
+        sigma: np.array, noise of the output of the templates at the peaks, shape as s
+        responses: see _responses
+        tpls: list of np.array, zero-sum templates
+        profile: callable(width, frac), line profile of unit amplitude
+        snr: float, detection threshold
+    Returns
+        width, amp: np.array, amplitude times the sign of the lines
+        s: np.array, SNR with the output of the neighbours subtracted
+        is_kept: np.array of bool
+    """
+
+    reach = len(profile(responses[0][-1])) // 2 + len(tpls[-1]) // 2
+    lo = np.searchsorted(idx, idx - reach, side='left')
+    hi = np.searchsorted(idx, idx + reach, side='right')
+    width = np.zeros(len(idx))
+    amp = np.zeros(len(idx))
+
+    def _output(j, near):
+        # SNR of the line j at the peaks near, shape (templates, near)
+        p = profile(width[j], frac[j])
+        out = np.zeros((len(tpls), len(near)))
+        for k, tpl in enumerate(tpls):
+            f_out = _filter_output(p, tpl)
+            d = idx[near] - idx[j] + len(p) // 2 + len(tpl) // 2
+            is_in = (d >= 0) & (d < len(f_out))
+            out[k, is_in] = amp[j] * f_out[d[is_in]] / sigma[k, near[is_in]]
+        return out
+
+    clean = s.copy()
+    predicted = np.zeros_like(s)
+    is_kept = np.ones(len(idx), dtype=bool)
+    is_done = np.zeros(len(idx), dtype=bool)
+    for j in np.argsort(-s.max(axis=0), kind='stable'):
+        is_done[j] = True
+        if not is_kept[j]:
+            continue
+        width[j], amp[j] = (v[0] for v in _fit_lines(responses, clean[:, j:j + 1], sigma[:, j:j + 1]))
+        near = np.arange(lo[j], hi[j])
+        near = near[~is_done[near] & is_kept[near]]
+        if len(near):
+            out = _output(j, near)
+            clean[:, near] -= out
+            predicted[:, near] += np.abs(out)
+            is_kept[near] = np.any(clean[:, near] - _SIDELOBE_TOL * predicted[:, near] >= snr, axis=0)
+
+    for _ in range(_N_DEBLEND):
+        kept = np.flatnonzero(is_kept)
+        clean = s.copy()
+        predicted = np.zeros_like(s)
+        for j in kept:
+            near = np.arange(lo[j], hi[j])
+            near = near[is_kept[near] & (near != j)]
+            if len(near):
+                out = _output(j, near)
+                clean[:, near] -= out
+                predicted[:, near] += np.abs(out)
+        width[kept], amp[kept] = _fit_lines(responses, clean[:, kept], sigma[:, kept])
+        is_kept[kept] = np.any(clean[:, kept] - _SIDELOBE_TOL * predicted[:, kept] >= snr, axis=0)
+    return width, amp, clean, is_kept
+
+
+def _filter_output(profile, tpl):
+    """ Output of the template filter for a line profile, centered at len(profile) // 2 + len(tpl) // 2 """
+    return np.convolve(profile, tpl[::-1])
+
+
+def robust_sigma(c, block=None):
+    """ Noise of c from the median absolute deviation, for the whole array,
+    or for each block of points (returned for each point) """
+
+    if not block or block >= len(c):
+        sigma = _MAD_SIGMA * np.median(np.abs(c - np.median(c)))
+        return sigma if sigma > 0 else 1.
+    n_blocks = -(-len(c) // block)
+    b = np.full(n_blocks * block, np.nan)
+    b[:len(c)] = c
+    b = b.reshape(n_blocks, block)
+    sigma = _MAD_SIGMA * np.nanmedian(np.abs(b - np.nanmedian(b, axis=1)[:, np.newaxis]), axis=1)
+    sigma[~(sigma > 0)] = 1.
+    return np.repeat(sigma, block)[:len(c)]
+
+
+def segment(x, lines, ftype=0, max_peak=None) -> [Window]:
+    """ Group the lines into independent fit windows. Lines are grouped when their windows overlap
+    Arguments
+        x: np.array, increasing
+        lines: np.array, from detect
+        ftype: int, 0 gaussian / 1 lorentzian
+        max_peak: int, start a new window rather than growing a window over this many lines
+    Returns
+        windows: list of Window
+    """
+
+    lo = lines[:, 0] - WINDOW_HW[ftype] * lines[:, 1]
+    hi = lines[:, 0] + WINDOW_HW[ftype] * lines[:, 1]
+    order = np.argsort(lo, kind='stable')
+    lines, lo, hi = lines[order], lo[order], hi[order]
+    windows = []
+    k0 = 0
+    stop = -np.inf
+    for k in range(len(lines) + 1):
+        if k == len(lines) or lo[k] > stop or (max_peak and k - k0 >= max_peak):
+            if k > k0:
+                group = lines[k0:k]
+                windows.append(Window(int(np.searchsorted(x, lo[k0], side='left')),
+                                      int(np.searchsorted(x, stop, side='right')),
+                                      tuple(float(v) for v in group[:, :3].ravel()),
+                                      tuple(float(v) for v in group[:, 3])))
+            k0 = k
+            stop = -np.inf
+        if k < len(lines):
+            stop = max(stop, hi[k])
+    return windows
+
+
+def fit_window(x, y, window: Window, ftype=0, der=0, deg=0, min_sig=3.) -> dict:
+    """ Fit one window. The lines fitted with an amplitude below min_sig times its uncertainty
+    are removed one by one, the least significant first, and the window is fitted again.
+    If the fit fails, the line of the lowest detection SNR is removed
+    Arguments
+        x, y: np.array, the data of the window, x[window.i0:window.i1]
+        window: Window
+        ftype, der: see sflib.Function
+        deg: int, order of the polynomial baseline
+        min_sig: float, minimum significance of the fitted amplitude. 0 to keep all lines
+    Returns
+        result: dict {'window', 'status', 'error', 'popt', 'uncertainty', 'noise', 'snr', 'elapsed'}
+            snr: list, the detection SNR of the fitted lines
+    """
+
+    t0 = perf_counter()
+    result = {'window': window, 'status': 'ok', 'error': '', 'popt': [], 'uncertainty': [], 'noise': None,
+              'snr': []}
+    try:
+        init = np.array(window.init)
+        snr = list(window.snr)
+        while True:
+            f = sflib.Function(ftype, der, len(init) // 3)
+            popt, uncertainty, noise, ppoly, stat = sflib.fit_spectrum(f, x, y, init, deg)
+            if len(init) == 3 or not min_sig:
+                break
+            if stat:
+                k = int(np.argmin(snr))
+            else:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    sig = np.nan_to_num(np.abs(popt[2::3]) / uncertainty[2::3])
+                k = int(np.argmin(sig))
+                if sig[k] >= min_sig:
+                    break
+            init = np.delete(init, np.s_[3 * k:3 * k + 3])
+            del snr[k]
+        if stat:
+            result['status'] = STATUS.get(stat, 'failed')
+        else:
+            result.update(popt=[float(p) for p in popt], uncertainty=[float(u) for u in uncertainty],
+                          noise=float(noise), snr=snr)
+    except Exception as err:
+        # a bad window must not stop the survey
+        result.update(status='error', error=f'{type(err).__name__:s}: {err}')
+    result['elapsed'] = perf_counter() - t0
+    return result
+
+
+def fit_windows(x, y, windows, ftype=0, der=0, deg=0, min_sig=3., n_workers=None, progress=None) -> list:
+    """ Fit the windows on a pool of processes
+    Arguments
+        x, y: np.array, the whole spectrum
+        windows: list of Window
+        ftype, der, deg, min_sig: see fit_window
+        n_workers: int, number of processes, default the number of CPUs. 1 to fit in this process
+        progress: callable(n_done, n_total, result), called after each window
+    Returns
+        results: list of result dicts of fit_window, in the order of the windows
+    """
+
+    results = [None] * len(windows)
+    if n_workers == 1 or len(windows) < 2:
+        for i, w in enumerate(windows):
+            results[i] = fit_window(x[w.i0:w.i1], y[w.i0:w.i1], w, ftype, der, deg, min_sig)
+            if progress:
+                progress(i + 1, len(windows), results[i])
+        return results
+    with ProcessPoolExecutor(n_workers) as executor:
+        futures = {executor.submit(fit_window, x[w.i0:w.i1], y[w.i0:w.i1], w, ftype, der, deg, min_sig): i
+                   for i, w in enumerate(windows)}
+        for n_done, fut in enumerate(as_completed(futures), start=1):
+            i = futures[fut]
+            results[i] = fut.result()
+            if progress:
+                progress(n_done, len(windows), results[i])
+    return results
+
+
+def reduce_survey(x, y, ftype=0, der=0, widths=None, snr=5., deg=0, n_workers=None, progress=None, **kwargs):
+    """ Detect, segment and fit a survey
+    Arguments
+        see detect, segment and fit_windows.
+        kwargs: sign, noise_block of detect, max_peak of segment, min_sig of fit_window
+    Returns
+        windows: list of Window
+        results: list of result dicts of fit_window
+    """
+
+    max_peak = kwargs.pop('max_peak', None)
+    min_sig = kwargs.pop('min_sig', 3.)
+    lines = detect(x, y, ftype, der, widths, snr, **kwargs)
+    windows = segment(x, lines, ftype, max_peak)
+    return windows, fit_windows(x, y, windows, ftype, der, deg, min_sig, n_workers, progress)
+
+
+def save_line_list(filename, x, results):
+    """ Save the results in a csv table, one row per line (one row per window if the fit failed) """
+
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=LINE_LIST_FIELDS)
+        writer.writeheader()
+        for i, r in enumerate(results):
+            w = r['window']
+            row = {'window': i + 1, 'x_start': x[w.i0], 'x_stop': x[w.i1 - 1],
+                   'status': r['status'], 'error': r['error'], 'noise': r['noise']}
+            popt = r['popt']
+            unc = r['uncertainty'] or [None] * len(popt)
+            if not popt:
+                writer.writerow(row)
+            for k in range(len(popt) // 3):
+                row.update(peak_idx=k + 1, mu=popt[3 * k], width=popt[3 * k + 1], A=popt[3 * k + 2],
+                           mu_err=unc[3 * k], width_err=unc[3 * k + 1], A_err=unc[3 * k + 2], snr=r['snr'][k])
+                writer.writerow(row)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Automatic line detection and fit of a survey')
+    parser.add_argument('file', help='spectrum file, see sflib.read_file')
+    parser.add_argument('--out', default=None, help='line list csv, default <file>_lines.csv')
+    parser.add_argument('--ftype', default='gaussian', choices=tuple(FTYPES), help='lineshape family')
+    parser.add_argument('--der', type=int, default=0, help='derivative order, 0-4')
+    parser.add_argument('--width', type=float, nargs='+', default=None, help='trial widths, x unit')
+    parser.add_argument('--snr', type=float, default=5., help='detection threshold')
+    parser.add_argument('--negative', action='store_true', help='the lines are upside down')
+    parser.add_argument('--noise-block', type=int, default=None, help='points per noise estimate')
+    parser.add_argument('--deg', type=int, default=0, help='order of the polynomial baseline')
+    parser.add_argument('--max-peak', type=int, default=None, help='maximum lines per window')
+    parser.add_argument('--min-sig', type=float, default=3., help='minimum significance of the fitted amplitude')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    args = parser.parse_args(argv)
+
+    x, y, stat = sflib.read_file(args.file)
+    if stat:
+        parser.exit(1, f'{args.file:s}: {STATUS[stat]:s}\n')
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+
+    def _progress(n_done, n_total, result):
+        if result['status'] != 'ok' or n_done == n_total or not n_done % 100:
+            print(f'[{n_done:d}/{n_total:d}] {result["status"]:s} {result["error"]:s}')
+
+    t0 = perf_counter()
+    windows, results = reduce_survey(x, y, FTYPES[args.ftype], args.der, args.width, args.snr, args.deg,
+                                     args.workers, _progress, sign=-1 if args.negative else 1,
+                                     noise_block=args.noise_block, max_peak=args.max_peak, min_sig=args.min_sig)
+    out = args.out or os.path.splitext(args.file)[0] + '_lines.csv'
+    save_line_list(out, x, results)
+    n_ok = sum(r['status'] == 'ok' for r in results)
+    n_lines = sum(len(r['popt']) // 3 for r in results)
+    print(f'{n_lines:d} lines in {n_ok:d}/{len(windows):d} windows, {perf_counter() - t0:.1f} s, saved in {out:s}')
+
+
+if __name__ == '__main__':
+    main()
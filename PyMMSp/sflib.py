@@ -8,6 +8,7 @@ attempts to auto recognize lineshapes and numbers of peaks. It fails.
 Therefore this version only has manual mode, which requires the user to
 tell the script initial guesses. This version also handles better on SnR
 calculation. Fit up to 4-th derivative.
+The automatic detection of the lines is done separately, in sfdetect.
 
 The script supports comma, tab and space delimited xy files with any
 number of lines of header information.
@@ -21,28 +22,52 @@ from scipy.optimize import curve_fit
 from scipy.optimize import leastsq
 from math import pi
 from math import isinf
+from math import factorial
 from scipy import interpolate
 
 # ----------------------------------------
 # ---- Class and Function Declaration ----
 # ----------------------------------------
 
+# Line profiles, [ftype][der]: (norm, width scale, polynomial, is gaussian).
+# The der-th derivative is A/(norm*w^(der+1)) * P(t) * envelope(t), where
+# w = width scale * width, t = (x-mu)/w, and P(t) is the polynomial in t^2
+# (coefficients, highest power first), times t if der is odd.
+# Gaussian: envelope exp(-t^2/2), P = (-1)^der * Hermite He_der.
+# Lorentzian: w = gamma/2, envelope 1/(1+t^2)^(der+1).
+_PROFILES = (
+    tuple((np.sqrt(2*pi), 1., poly, True) for poly in
+          ((1.,), (-1.,), (1., -1.), (-1., 3.), (1., -6., 3.))),
+    tuple((pi, 0.5, poly, False) for poly in
+          ((1.,), (-2.,), (6., -2.), (-24., 24.), (120., -240., 24.))),
+)
+# number of elements of the (peak, chunk) working arrays
+_CHUNK_SIZE = 1 << 16
+
+
 class Function:
     """ Function class stores all sorts of function form. In spectroscopic
     context, gaussian/lorentzian function families are supported. Also,
     up to second derivative of these functions are defined to descibe the
     common spectra lineshape obtained by spectroscopic experiments.
     Coefficients are defined so as 0-derivative functions are normalized.
+    The analytic Jacobian of each function form is given by get_jac.
     The user may add more customized funtion form to it.
     """
 
     # Class variable: function family name list. User may add their own.
-    def __init__(self, ftype, der, peak):
+    def __init__(self, ftype, der, peak, dtype=np.float64, reuse_buffers=False):
         # Three attributes denote the function type, order of derivatives
         # and number of peaks.
         self.ftype = ftype
         self.der = der
         self.peak = peak
+        # float32 halves the memory traffic of long spectra. x is then
+        # shifted to its center, and the precision is relative to its span
+        self.dtype = np.dtype(dtype)
+        # keep the scratch arrays between calls (not thread safe)
+        self.reuse_buffers = reuse_buffers
+        self._buffers = None
 
     def get_func(self):
         # get gaussian function family
@@ -71,113 +96,131 @@ class Function:
             elif self.der == 4:
                 return self.lder4
 
+    def get_jac(self):
+        # get the Jacobian of get_func, for curve_fit(jac=)
+        if not self.ftype:
+            return self.gjac
+        if self.ftype == 1:
+            return self.ljac
+
     # Gaussian family functions. Integrate[g(x; mu, sigma, A)] = A
     def gder0(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma)*np.exp(-(x-mu)**2/(2*sigma**2))
-        return g
+        return self._eval(x, p, 0, 0)
 
     def gder1(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += -A*(x-mu)/(np.sqrt(2*pi)*sigma**3)*np.exp(-(x-mu)**2/(2*sigma**2))
-        return g
+        return self._eval(x, p, 0, 1)
 
     def gder2(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma**3)*(np.exp(-(x-mu)**2/(2*sigma**2))
-                                             *((x-mu)**2/(sigma**2)-1))
-        return g
+        return self._eval(x, p, 0, 2)
 
     def gder3(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma**5)*(x-mu)*np.exp(
-                 -(x-mu)**2/(2*sigma**2))*(3-((x-mu)/sigma)**2)
-        return g
+        return self._eval(x, p, 0, 3)
 
     def gder4(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma**5)*(3-6*((x-mu)/sigma)**2+
-                 ((x-mu)/sigma)**4)*np.exp(-(x-mu)**2/(2*sigma**2))
-        return g
+        return self._eval(x, p, 0, 4)
 
     # Lorentzian family functions. Integrate[l(x; mu, gamma, A)] = A
     # gamma is FWHM
     def lder0(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma/(2*pi*((x-mu)**2+gamma**2/4))
-        return l
+        return self._eval(x, p, 1, 0)
 
     def lder1(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += -A*gamma*(x-mu)/(pi*((x-mu)**2+gamma**2/4)**2)
-        return l
+        return self._eval(x, p, 1, 1)
 
     def lder2(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma*(-3*(x-mu)**2+gamma**2/4)/(pi*((x-mu)**2+gamma**2/4)**3)
-        return l
+        return self._eval(x, p, 1, 2)
 
     def lder3(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma*(x-mu)/(pi*((x-mu)**2+gamma**2/4)**4)*(
-                 3*(x-mu)**2+5*gamma**2/4)
-        return l
+        return self._eval(x, p, 1, 3)
 
     def lder4(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma/(pi*((x-mu)**2+gamma**2/4)**5)*(
-                 5*gamma**4/256-13*((x-mu)*gamma)**2/2-15*(x-mu)**4)
-        return l
+        return self._eval(x, p, 1, 4)
+
+    def _eval(self, x, p, ftype, der):
+        """ Evaluate all peaks at once, in chunks of x, as
+            sum_k A_k/(norm*w_k^(der+1)) * P(t) * envelope(t),  t = (x-mu_k)/w_k
+        see _PROFILES. The working arrays are (peak, chunk) """
+
+        norm, w_scale, poly, is_gauss = _PROFILES[ftype][der]
+        shape = np.shape(x)
+        x = np.asarray(x, dtype=np.float64).ravel()
+        mu, width, A = np.reshape(np.asarray(p[:3*self.peak], dtype=np.float64),
+                                  (self.peak, 3)).T
+        w = width*w_scale
+        if self.dtype != np.float64 and len(x):
+            # float32 cannot hold the absolute frequencies: shift the origin
+            x0 = (x[0]+x[-1])/2
+            x = x - x0
+            mu = mu - x0
+        x = x.astype(self.dtype, copy=False)
+        mu = mu.astype(self.dtype)[:, np.newaxis]
+        inv_w = (1/w).astype(self.dtype)[:, np.newaxis]
+        amp = (A/(norm*w**(der+1))).astype(self.dtype)
+
+        chunk = max(_CHUNK_SIZE//max(self.peak, 1), 1)
+        buf = self._buffers
+        if buf is None or buf.shape[1:] != (self.peak, chunk) or buf.dtype != self.dtype:
+            buf = np.empty((3, self.peak, chunk), dtype=self.dtype)
+            if self.reuse_buffers:
+                self._buffers = buf
+        y = np.empty(len(x), dtype=self.dtype)
+        for k0 in range(0, len(x), chunk):
+            m = min(chunk, len(x)-k0)
+            t, s, q = buf[:, :, :m]
+            np.subtract(x[k0:k0+m], mu, out=t)
+            t *= inv_w
+            np.square(t, out=s)
+            # polynomial in t^2, times t for the odd derivatives
+            q.fill(poly[0])
+            for c in poly[1:]:
+                q *= s
+                q += c
+            if der % 2:
+                q *= t
+            # envelope exp(-t^2/2) or 1/(1+t^2)^(der+1)
+            if is_gauss:
+                np.multiply(s, -0.5, out=t)
+                np.exp(t, out=t)
+                q *= t
+            else:
+                s += 1
+                np.reciprocal(s, out=s)
+                for _ in range(der+1):
+                    q *= s
+            np.dot(amp, q, out=y[k0:k0+m])
+        return y.reshape(shape)
+
+    # Jacobians: partial derivatives of the der-th derivative function
+    # with respect to (mu, width, A) of each peak, shape (len(x), 3*peak).
+    # d/dmu of the n-th derivative is minus the (n+1)-th derivative.
+    def gjac(self, x, *p):
+        # g_n = A*(-1)^n*He_n(t)*phi(t)/sigma^(n+1), t = (x-mu)/sigma,
+        # He_n the probabilists' Hermite polynomials, phi the unit gaussian
+        n = self.der
+        mu, sigma, A = np.reshape(p[:3*self.peak], (self.peak, 3)).T
+        t = (np.asarray(x, dtype=float)[:, np.newaxis] - mu)/sigma
+        # He_n and He_n+1 by the recurrence He_k+1 = t*He_k - k*He_k-1
+        he_n, he_n1 = np.ones_like(t), t
+        for k in range(1, n+1):
+            he_n, he_n1 = he_n1, t*he_n1 - k*he_n
+        c = (-1)**n/(np.sqrt(2*pi)*sigma**(n+2))*np.exp(-t**2/2)
+        jac = np.empty((t.shape[0], 3*self.peak))
+        jac[:, 0::3] = A*c*he_n1
+        jac[:, 1::3] = A*c*(t*he_n1-(n+1)*he_n)
+        jac[:, 2::3] = c*sigma*he_n
+        return jac
+
+    def ljac(self, x, *p):
+        # l_n = A/pi*Im[(-1)^n*n!/z^(n+1)], z = x-mu-i*gamma/2
+        n = self.der
+        mu, gamma, A = np.reshape(p[:3*self.peak], (self.peak, 3)).T
+        z = np.asarray(x, dtype=float)[:, np.newaxis] - mu - 0.5j*gamma
+        w = (-1)**n*factorial(n+1)/(pi*z**(n+2))
+        jac = np.empty(z.shape[:1] + (3*self.peak,))
+        jac[:, 0::3] = A*w.imag
+        jac[:, 1::3] = A*w.real/2
+        jac[:, 2::3] = (w*z).imag/(n+1)
+        return jac
 
 
 def base(xdata, popt, f):
@@ -319,7 +362,8 @@ def read_file(file_name, boxwin=1, rescale=1):
         ydata = ydata * rescale
     if boxwin > 1:
         ydata = box_smooth(ydata, boxwin)
-        xdata = xdata[boxwin/2:-boxwin/2]
+        # box_smooth drops boxwin-1 points
+        xdata = xdata[(boxwin-1)//2:len(xdata)-boxwin//2]
 
     return xdata, ydata, fit_stat
 
@@ -402,7 +446,7 @@ def save_log(out_name, popt, uncertainty, ppoly, ftype, der, peak, parname):
 # >>>>>>>>>> fit routine functions >>>>>>>>>>
 # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
 
-def fit_spectrum(f, xdata, ydata, init, deg, smooth_edge=False, THRESHOLD=1e-2):
+def fit_spectrum(f, xdata, ydata, init, deg, smooth_edge=False, THRESHOLD=1e-2, max_iter=100):
     """ spectral fitting routine.
 
     Arguments:
@@ -415,6 +459,8 @@ def fit_spectrum(f, xdata, ydata, init, deg, smooth_edge=False, THRESHOLD=1e-2):
     Keyword Arguments:
     deg -- orders of polynomial for the baseline fit. Default is 0
     THRESHOLD -- converge threshold
+    max_iter -- maximum number of baseline / line fit iterations.
+                The fit fails if it has not converged
 
     Returns:
     popt -- optimized parameter vector
@@ -435,8 +481,13 @@ def fit_spectrum(f, xdata, ydata, init, deg, smooth_edge=False, THRESHOLD=1e-2):
 
     baseline_idx = base(xdata, init, f)
     diff = 1
+    n_iter = 0
 
     while diff > THRESHOLD:
+        if n_iter == max_iter:
+            # a line running away, e.g. fitting the baseline with an ever wider peak
+            return [], [], 0, [], 1
+        n_iter += 1
         residual = ydata - f.get_func()(xdata, *init)
         try:
             ppoly = np.polyfit(xdata[baseline_idx] - np.median(xdata),
@@ -450,10 +501,11 @@ def fit_spectrum(f, xdata, ydata, init, deg, smooth_edge=False, THRESHOLD=1e-2):
 
         # Let's fit curve
         try:
-            popt, pcov = curve_fit(f.get_func(), xdata, ydata_db, init)
+            popt, pcov = curve_fit(f.get_func(), xdata, ydata_db, init,
+                                   jac=f.get_jac())
         except (TypeError, ValueError, RuntimeError):
             stat = 1                   # error_1: fit failed
-            return [], [], 0, [], fit_stat
+            return [], [], 0, [], stat
 
         # update residual and initial vector
         residual = ydata_db - f.get_func()(xdata, *popt)
@@ -0,0 +1,191 @@
+#! encoding = utf-8
+
+""" Throughput benchmark of the batch scan on the instrument simulators.
+ThreadBatchScan.run() is driven headless in the calling thread, with the synthesizer
+and lockin simulators answering after a configurable latency.
+Reports points/second, the time spent in each stage and the peak memory,
+and writes the results to a json file.
+
+    python -m PyMMSp.test.bench_scan --pts 1000 10000 100000 --latency 0 --out bench.json
+
+Stages
+    tune            synthesizer frequency command
+    dwell           wait for the lockin to settle
+    read            lockin reading
+    save            saving the data file
+    emit            emission of the progress and data signals
+    other           everything else: checkpoint, loop overhead
+"""
+
+import os
+import json
+import argparse
+import tempfile
+import platform
+import tracemalloc
+from time import perf_counter, sleep
+import numpy as np
+
+from PyMMSp.config.config import Prefs, AbsScanSetting
+from PyMMSp.inst.base import Handles, Threads
+from PyMMSp.inst.base_simulator import BaseSimDecoder
+from PyMMSp.daq import abs as daq_abs
+
+STAGES = ('tune', 'dwell', 'read', 'save', 'emit')
+
+
+class _LatencyDecoder:
+    """ Wrap a simulator decoder, and delay every command by latency seconds """
+
+    def __init__(self, decoder, latency=0.):
+        self._decoder = decoder
+        self._latency = latency
+
+    def interpret(self, code):
+        if self._latency > 0:
+            sleep(self._latency)
+        self._decoder.interpret(code)
+
+    def __getattr__(self, item):
+        return getattr(self._decoder, item)
+
+
+class _LockinBenchDecoder(BaseSimDecoder):
+    """ Minimal lockin simulator: every query returns a random reading """
+
+    def __init__(self):
+        super().__init__()
+        self._rng = np.random.default_rng(0)
+
+    def interpret(self, code):
+        if code.strip().endswith('?') or '? ' in code:
+            self.str_in(f'{self._rng.random():.6e}')
+
+
+class _BenchBatchScan(daq_abs.ThreadBatchScan):
+    """ ThreadBatchScan timing each stage """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stage_time = dict.fromkeys(STAGES, 0.)
+
+    def _tune_freq(self, *args):
+        t0 = perf_counter()
+        super()._tune_freq(*args)
+        self.stage_time['tune'] += perf_counter() - t0
+
+    def _dwell(self, *args):
+        t0 = perf_counter()
+        super()._dwell(*args)
+        self.stage_time['dwell'] += perf_counter() - t0
+
+    def _read_point(self, *args):
+        t0 = perf_counter()
+        y = super()._read_point(*args)
+        self.stage_time['read'] += perf_counter() - t0
+        return y
+
+    def _emit_progress(self, *args):
+        t0 = perf_counter()
+        super()._emit_progress(*args)
+        self.stage_time['emit'] += perf_counter() - t0
+
+    def _emit_sweep(self, *args, **kwargs):
+        t0 = perf_counter()
+        super()._emit_sweep(*args, **kwargs)
+        self.stage_time['emit'] += perf_counter() - t0
+
+
+def connect_sim(latency=0.):
+    """ Connect the synthesizer and lockin simulators
+    Returns
+        handles: Handles
+    """
+
+    handles = Handles()
+    handles.connect('Synthesizer', 'GPIB VISA', 'GPIB0::19::INSTR', 'Agilent_E8257D', is_sim=True)
+    handles.connect('Lock-in', 'GPIB VISA', 'GPIB0::8::INSTR', 'SR830', is_sim=True)
+    handles.h_syn.set_decoder(_LatencyDecoder(handles.h_syn._decoder, latency))
+    handles.h_lockin.set_decoder(_LatencyDecoder(_LockinBenchDecoder(), latency))
+    return handles
+
+
+def run_scan(n_pts, latency=0., is_multi_sweep=False, is_list_sweep=False, is_mem=False):
+    """ Run one batch entry of n_pts points
+    Returns
+        result: dict
+    """
+
+    prefs = Prefs()
+    handles = connect_sim(latency)
+    threads = Threads()
+    setting = AbsScanSetting(freq_start=100000, freq_stop=100000 + n_pts * 0.001, freq_step=0.001,
+                             avg=2 if is_multi_sweep else 1, is_press=False,
+                             is_multi_sweep=is_multi_sweep, is_list_sweep=is_list_sweep)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # data files and the checkpoint go to the temporary directory
+        prefs.tmp_dir = tmp_dir
+        os.chdir(tmp_dir)
+        t = _BenchBatchScan(prefs, handles, threads, [setting])
+        save_data = daq_abs.save_data
+
+        def _timed_save(*args, **kwargs):
+            t0 = perf_counter()
+            save_data(*args, **kwargs)
+            t.stage_time['save'] += perf_counter() - t0
+
+        daq_abs.save_data = _timed_save
+        if is_mem:
+            tracemalloc.start()
+        try:
+            t0 = perf_counter()
+            # run in this thread: no event loop is needed
+            t.run()
+            total = perf_counter() - t0
+            peak = tracemalloc.get_traced_memory()[1] if is_mem else None
+        finally:
+            if is_mem:
+                tracemalloc.stop()
+            daq_abs.save_data = save_data
+            os.chdir(cwd)
+            threads.join_all()
+    n_taken = n_pts * setting.avg
+    stage_time = dict(t.stage_time)
+    stage_time['other'] = total - sum(stage_time.values())
+    return {'n_pts': n_pts, 'n_readings': n_taken, 'latency': latency,
+            'is_multi_sweep': is_multi_sweep, 'is_list_sweep': is_list_sweep,
+            'total_time': total, 'pts_per_s': n_taken / total,
+            'stage_time': stage_time, 'peak_mem_bytes': peak}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Batch scan throughput benchmark on the simulators')
+    parser.add_argument('--pts', type=float, nargs='+', default=[1e3, 1e4, 1e5],
+                        help='number of points per scan (1e3 to 1e6)')
+    parser.add_argument('--latency', type=float, default=0., help='simulated latency per command, ms')
+    parser.add_argument('--multi-sweep', action='store_true', help='use the multi-sweep mode')
+    parser.add_argument('--list-sweep', action='store_true', help='use the synthesizer list sweep')
+    parser.add_argument('--no-mem', action='store_true',
+                        help='skip the second pass that measures the peak memory')
+    parser.add_argument('--out', default='bench_scan.json', help='output json file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for n in args.pts:
+        kwargs = dict(latency=args.latency * 1e-3, is_multi_sweep=args.multi_sweep,
+                      is_list_sweep=args.list_sweep)
+        # tracemalloc slows python down, so the memory is measured in a separate pass
+        result = run_scan(int(n), **kwargs)
+        if not args.no_mem:
+            result['peak_mem_bytes'] = run_scan(int(n), is_mem=True, **kwargs)['peak_mem_bytes']
+        results.append(result)
+        print(f'{int(n):>8d} pts  {result["pts_per_s"]:10.1f} pts/s  ' +
+              '  '.join(f'{k} {v:.3f}s' for k, v in result['stage_time'].items()))
+    with open(args.out, 'w') as fp:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                   'results': results}, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#! encoding = utf-8
+
+""" Startup time benchmark of the launcher, checked against a time budget.
+Each measurement runs in a fresh interpreter, so that it is a cold start
+(apart from the OS file cache):
+    import          python -X importtime -c "import PyMMSp.ctrl.main"
+    first window    process start -> MainWindow shown and the event loop running
+
+    python -m PyMMSp.test.bench_startup --n 5 --offscreen --out bench_startup.json
+
+The exit code is 1 if the median of a measurement exceeds its budget.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from statistics import median
+from time import perf_counter
+
+# seconds
+BUDGET = {'import': 1.5, 'first_window': 3.0}
+# modules that should not be imported before an instrument is connected
+LAZY_MODULES = ('pyvisa', 'serial', 'yaml', 'scipy')
+
+_FIRST_WINDOW = '''
+import sys
+import json
+from PyQt6 import QtCore, QtWidgets
+from PyMMSp.ctrl.main import MainWindow
+app = QtWidgets.QApplication(sys.argv)
+win = MainWindow()
+win.show()
+# runs once the event loop has processed the show event
+QtCore.QTimer.singleShot(0, app.quit)
+app.exec()
+# the stubs of lazy_import are in sys.modules, but are only executed on the first attribute access
+print(json.dumps(sorted(m for m, mod in list(sys.modules.items())
+                        if m.split('.')[0] in {lazy} and type(mod).__name__ != '_LazyModule')))
+'''
+
+
+def import_time():
+    """ Import the main window module with -X importtime
+    Returns
+        total: float, seconds
+        top: list of (module, self time in seconds, cumulative time in seconds), slowest first
+    """
+
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import PyMMSp.ctrl.main'],
+                       capture_output=True, text=True, check=True)
+    rows = []
+    for line in p.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cum_us, name = line[len('import time:'):].split('|')
+        # one space after the separator, then 2 more per nesting level
+        rows.append((name[1:].rstrip(), int(self_us) * 1e-6, int(cum_us) * 1e-6))
+    # the top level imports are not indented, their cumulative times add up to the total.
+    # the ones up to site belong to the interpreter startup
+    names = [r[0] for r in rows]
+    start = names.index('site') + 1 if 'site' in names else 0
+    total = sum(r[2] for r in rows[start:] if not r[0].startswith(' '))
+    top = sorted(((name.strip(), s, c) for name, s, c in rows[start:]), key=lambda r: r[1], reverse=True)
+    return total, top
+
+
+def first_window_time(env=None):
+    """ Start the main window in a new process
+    Returns
+        t: float, seconds from the process start to the first event loop iteration
+        lazy: list of the LAZY_MODULES (and their submodules) executed at this point
+    """
+
+    code = _FIRST_WINDOW.format(lazy=set(LAZY_MODULES))
+    t0 = perf_counter()
+    p = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=env)
+    t = perf_counter() - t0
+    return t, json.loads(p.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Launcher startup time benchmark')
+    parser.add_argument('--n', type=int, default=5, help='number of repeats')
+    parser.add_argument('--offscreen', action='store_true', help='use the Qt offscreen platform')
+    parser.add_argument('--no-window', action='store_true', help='only measure the import time')
+    parser.add_argument('--top', type=int, default=15, help='number of the slowest imports to report')
+    parser.add_argument('--out', default='bench_startup.json', help='output json file')
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    if args.offscreen:
+        env['QT_QPA_PLATFORM'] = 'offscreen'
+    t_import = []
+    top = []
+    for _ in range(args.n):
+        total, top = import_time()
+        t_import.append(total)
+    result = {'python': sys.version.split()[0], 'budget': BUDGET,
+              'import': {'median': median(t_import), 'runs': t_import},
+              'slowest_imports': [{'module': m, 'self': s, 'cumulative': c} for m, s, c in top[:args.top]]}
+    if not args.no_window:
+        t_window = []
+        lazy = []
+        for _ in range(args.n):
+            t, lazy = first_window_time(env)
+            t_window.append(t)
+        result['first_window'] = {'median': median(t_window), 'runs': t_window}
+        result['eager_lazy_modules'] = lazy
+
+    over = [k for k, v in BUDGET.items() if k in result and result[k]['median'] > v]
+    result['over_budget'] = over
+    for k in BUDGET:
+        if k in result:
+            print(f'{k:<14s} {result[k]["median"]:6.3f} s  (budget {BUDGET[k]:.1f} s)')
+    for m, s, c in top[:args.top]:
+        print(f'    {s:7.3f} s self  {c:7.3f} s cum  {m}')
+    if result.get('eager_lazy_modules'):
+        print('imported at startup:', ', '.join(result['eager_lazy_modules']))
+    with open(args.out, 'w') as fp:
+        json.dump(result, fp, indent=2)
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+#! encoding = utf-8
+
+""" Unit test of the absorption scan helper functions """
+
+import os
+import unittest
+import tempfile
+from unittest import mock
+import numpy as np
+from PyMMSp.config.config import Prefs, AbsScanSetting
+from PyMMSp.inst.base import Handles, Threads
+from PyMMSp.libs import lwa, spb
+from PyMMSp.libs.checkpoint import CheckpointWriter, load_checkpoint, find_unfinished, CHECKPOINT_FILE
+from PyMMSp.inst.lockin import settle_time
+from PyMMSp.inst.synthesizer import SWITCH_TIME
+from PyMMSp.daq.abs import (dwell_time, inst_config, config_delta, transition_time, estimate_overhead,
+                             plan_batch, CMD_TIME, ThreadBatchScan, data_filename, sweeps_filename)
+
+
+def _setting(freq_start, **kwargs):
+    return AbsScanSetting(freq_start=freq_start, freq_stop=freq_start + 1, freq_step=0.1, **kwargs)
+
+
+class TestDwellTime(unittest.TestCase):
+
+    def test_dwell_time(self):
+        setting = AbsScanSetting(freq_start=100, freq_stop=101, freq_step=0.1, tau_idx=4, dwell_time=50)
+        self.assertEqual(dwell_time(setting, 10.), 50)
+        setting = AbsScanSetting(freq_start=100, freq_stop=101, freq_step=0.1, tau_idx=4, octave_idx=2,
+                                 is_auto_dwell=True, settle_tol=0.01)
+        t_step = dwell_time(setting, 0.1)
+        self.assertAlmostEqual(t_step, SWITCH_TIME + settle_time(4, 2, 0.01))
+        # a 10 step jump leaves 10 times less residual
+        self.assertAlmostEqual(dwell_time(setting, 1.), SWITCH_TIME + settle_time(4, 2, 0.001))
+        self.assertEqual(dwell_time(setting, 0.05), t_step)
+
+
+class TestBatchPlan(unittest.TestCase):
+
+    def test_inst_config(self):
+        config = inst_config(_setting(100, modu_mode_idx=2, modu_freq=20000, modu_amp=100, sens_idx=5))
+        self.assertEqual(config[('syn', 'set_fm_stat')], (1, True))
+        self.assertEqual(config[('syn', 'set_fm_dev')], (1, 100, 'KHZ'))
+        self.assertEqual(config[('lockin', 'set_sens')], (5,))
+        self.assertNotIn(('syn', 'set_am_freq'), config)
+        self.assertNotIn(('lockin', 'set_sample_rate'), config)
+        config = inst_config(_setting(100, is_lockin_buffer=True, sample_rate_idx=8))
+        self.assertEqual(config[('syn', 'set_modu_stat')], (False,))
+        self.assertEqual(config[('lockin', 'set_sample_rate')], (8,))
+
+    def test_config_delta(self):
+        config = inst_config(_setting(100, sens_idx=5))
+        self.assertEqual(config_delta(None, config), config)
+        self.assertEqual(config_delta(config, config), {})
+        delta = config_delta(config, inst_config(_setting(200, sens_idx=6, tau_idx=1)))
+        self.assertEqual(delta, {('lockin', 'set_sens'): (6,), ('lockin', 'set_tau'): (1,)})
+
+    def test_estimate_overhead(self):
+        s0 = _setting(100, dwell_time=10)
+        s1 = _setting(200, dwell_time=20, sens_idx=1)
+        n_cmd = len(inst_config(s0))
+        self.assertEqual(transition_time(None, s0), n_cmd * CMD_TIME + 10)
+        self.assertEqual(transition_time(s0, s1), CMD_TIME + 20)
+        self.assertAlmostEqual(estimate_overhead([s0, s1], [0, 1]), (n_cmd * CMD_TIME + 10 + CMD_TIME + 20) * 1e-3)
+        self.assertAlmostEqual(estimate_overhead([s0, s1], [1, 0]), (n_cmd * CMD_TIME + 20 + CMD_TIME + 10) * 1e-3)
+
+    def test_plan_batch(self):
+        self.assertEqual(plan_batch([]), [])
+        # the entries of the same lockin setting are grouped, closest frequency first
+        list_settings = [_setting(100, sens_idx=1), _setting(400, sens_idx=2), _setting(300, sens_idx=1),
+                         _setting(200, sens_idx=2), _setting(150, sens_idx=1)]
+        order = plan_batch(list_settings)
+        self.assertEqual(order, [0, 4, 2, 1, 3])
+        self.assertLess(estimate_overhead(list_settings, order),
+                        estimate_overhead(list_settings, range(len(list_settings))))
+        # auto dwell: the planner stays fast
+        list_settings = [_setting(100 + 7 * (i * 37 % 200), tau_idx=i % 4, octave_idx=i % 3, sens_idx=i % 5,
+                                  is_auto_dwell=True, settle_tol=1e-3) for i in range(200)]
+        order = plan_batch(list_settings)
+        self.assertEqual(sorted(order), list(range(200)))
+
+
+
+class TestBatchScan(unittest.TestCase):
+    """ Run ThreadBatchScan headless in this thread, on the simulators """
+
+    def setUp(self):
+        self.prefs = Prefs(is_test=True)
+        self.handles = Handles()
+        self.handles.connect('Synthesizer', 'GPIB VISA', 'GPIB0::19::INSTR', 'Agilent_E8257D', is_sim=True)
+        self.handles.connect('Lock-in', 'GPIB VISA', 'GPIB0::8::INSTR', 'SR830', is_sim=True)
+        self.threads = Threads()
+        self.cwd = os.getcwd()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.prefs.tmp_dir = self.tmp_dir.name
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+        self.threads.join_all()
+
+    def _run(self, setting, on_progress=None, checkpoint=None):
+        """ Run the batch of one entry
+        Arguments
+            on_progress: function(thread, n_done) called after each reading
+            checkpoint: Checkpoint to resume
+        Returns
+            plotted: list of (x, y) sent to the live plot
+            averaged: list of the running mean sent after each sweep
+        """
+        t = ThreadBatchScan(self.prefs, self.handles, self.threads, [setting], checkpoint=checkpoint)
+        plotted = []
+        averaged = []
+        t.sig_data_ready.connect(lambda x, y: plotted.append((x, y)))
+        t.sig_avg_ready.connect(lambda x, y, err: averaged.append(y))
+        if on_progress:
+            t.sig_this_progress.connect(lambda n_done: on_progress(t, n_done))
+        t.run()
+        return plotted, averaged
+
+    @staticmethod
+    def _read_lwa(filename):
+        """ Returns
+            pts, avg: int, of the last scan in the file
+            y: np.array
+        """
+        entry_settings, hd_pos = lwa.scan_header(filename, is_save_index=False)
+        y = lwa.preview(len(entry_settings) - 1, hd_pos, src=filename)[:, 1]
+        return entry_settings[-1][13], entry_settings[-1][14], y
+
+    def test_sweeps_saved(self):
+        setting = AbsScanSetting(freq_start=100000, freq_stop=100000.005, freq_step=0.001, avg=3,
+                                 dwell_time=0, is_press=False, is_multi_sweep=True)
+        filename = data_filename(setting)
+        self._run(setting)
+        data = np.loadtxt(filename)
+        sweeps = np.load(sweeps_filename(filename))
+        self.assertEqual(sweeps.shape, (3, len(data)))
+        self.assertTrue(np.allclose(sweeps.mean(axis=0), data[:, 1]))
+
+    def test_plot_sweep(self):
+        # the live plot gets the whole sweep, not only the last point
+        setting = AbsScanSetting(freq_start=100000, freq_stop=100000.005, freq_step=0.001, avg=1,
+                                 dwell_time=0, is_press=False)
+        filename = data_filename(setting)
+        plotted, _ = self._run(setting)
+        data = np.loadtxt(filename)
+        x, y = plotted[-1]
+        self.assertTrue(np.array_equal(x, data[:, 0]))
+        self.assertTrue(np.allclose(y, data[:, 1]))
+        # every point updates the plot without throttling
+        setting.avg = 2
+        setting.is_multi_sweep = True
+        with mock.patch('PyMMSp.daq.abs.PLOT_INTERVAL', 0):
+            plotted, _ = self._run(setting)
+        n = len(data)
+        self.assertEqual([len(x) for x, y in plotted], list(range(1, n + 1)) * 2)
+        # the first sweep goes up, the second one goes down from the end
+        self.assertEqual(plotted[0][0][0], data[0, 0])
+        self.assertEqual(plotted[n][0][0], data[-1, 0])
+
+
+    def test_lwa_partial(self):
+        # the averaged sweeps are on disk after each sweep
+        setting = AbsScanSetting(freq_start=100000, freq_stop=100000.005, freq_step=0.001, avg=3, sens_idx=26,
+                                 dwell_time=0, is_press=False, is_multi_sweep=True, file_fmt='.lwa')
+        filename = data_filename(setting)
+        self.assertTrue(filename.endswith('.lwa'))
+        n = len(np.arange(setting.freq_start, setting.freq_stop, setting.freq_step))
+        partial = {}
+
+        def on_progress(t, n_done):
+            # the first point of each sweep after the first one
+            if n_done % n == 1 and n_done > 1:
+                partial[n_done // n] = self._read_lwa(filename)
+
+        _, averaged = self._run(setting, on_progress=on_progress)
+        self.assertEqual(sorted(partial), [1, 2])
+        for k, (pts, avg, y) in partial.items():
+            self.assertEqual((pts, avg), (n, k))
+            # the .lwa data has 3 decimals of sens * 1e-4
+            self.assertTrue(np.allclose(y, averaged[k - 1], atol=1e-7))
+        pts, avg, y = self._read_lwa(filename)
+        self.assertEqual((pts, avg), (n, 3))
+        self.assertTrue(np.allclose(y, averaged[-1], atol=1e-7))
+
+    def test_lwa_single_sweep(self):
+        setting = AbsScanSetting(freq_start=100000, freq_stop=100000.005, freq_step=0.001, avg=2, sens_idx=26,
+                                 dwell_time=0, is_press=False, file_fmt='.lwa')
+        filename = data_filename(setting)
+        partial = []
+        with mock.patch('PyMMSp.daq.abs.SAVE_INTERVAL', 0):
+            self._run(setting, on_progress=lambda t, n_done: partial.append(self._read_lwa(filename)[0]))
+        # the points written before the current one, 2 readings per point
+        n = len(np.arange(setting.freq_start, setting.freq_stop, setting.freq_step))
+        self.assertEqual(partial, [i // 2 for i in range(2 * n)])
+        pts, avg, y = self._read_lwa(filename)
+        self.assertEqual((pts, avg), (n, 2))
+        self.assertEqual(len(y), n)
+
+    def test_abort(self):
+        setting = AbsScanSetting(freq_start=100000, freq_stop=100000.005, freq_step=0.001, avg=3, sens_idx=26,
+                                 dwell_time=0, is_press=False, is_multi_sweep=True, file_fmt='.lwa')
+        filename = data_filename(setting)
+        n_done = []
+
+        def on_progress(t, n):
+            n_done.append(n)
+            if n == 7:
+                t.abort()
+
+        self._run(setting, on_progress=on_progress)
+        # the scan stops at the next point, and its partial data is discarded
+        self.assertEqual(n_done[-1], 7)
+        self.assertFalse(os.path.exists(filename))
+        self.assertFalse(os.path.exists(sweeps_filename(filename)))
+        self.assertEqual(find_unfinished(self.prefs.tmp_dir), '')
+
+
+    def test_lwa_resume(self):
+        # the partial scan of the interrupted entry is replaced by the resumed one
+        setting = AbsScanSetting(freq_start=100000, freq_stop=100000.005, freq_step=0.001, avg=3, sens_idx=26,
+                                 dwell_time=0, is_press=False, is_multi_sweep=True, file_fmt='.lwa')
+        filename = data_filename(setting)
+        n = len(np.arange(setting.freq_start, setting.freq_stop, setting.freq_step))
+        y0 = np.linspace(0.1, 0.2, n)
+        writer = CheckpointWriter(os.path.join(self.prefs.tmp_dir, CHECKPOINT_FILE))
+        writer.start_batch([setting])
+        writer.start_entry(0, filename)
+        writer.add_sweep(0, y0)
+        writer.close()
+        lwa.save_lwa(filename, y0, (1, 0, 1, 0, 0, 0, 'NONE', 1, 0, 100000, 0.001, 1, ''))
+        _, averaged = self._run(setting, checkpoint=load_checkpoint(os.path.join(self.prefs.tmp_dir, CHECKPOINT_FILE)))
+        entry_settings, _ = lwa.scan_header(filename, is_save_index=False)
+        self.assertEqual(len(entry_settings), 1)
+        pts, avg, y = self._read_lwa(filename)
+        self.assertEqual((pts, avg), (n, 3))
+        self.assertTrue(np.allclose(y, averaged[-1], atol=1e-7))
+        # the sweep of the checkpoint is in the average
+        self.assertEqual(len(averaged), 2)
+
+
+    def test_spb(self):
+        setting = AbsScanSetting(freq_start=100000, freq_stop=100000.005, freq_step=0.001, avg=3, sens_idx=26,
+                                 dwell_time=0, is_press=False, is_multi_sweep=True, file_fmt='.spb')
+        filename = data_filename(setting)
+        self.assertTrue(filename.endswith(spb.SUFFIX))
+        _, averaged = self._run(setting)
+        entry_settings, hd_pos = spb.scan_header(filename)
+        self.assertEqual(len(entry_settings), 1)
+        info, columns = spb.read_scan(0, hd_pos, src=filename, is_mmap=False)
+        n = len(columns['freq'])
+        self.assertEqual(info['avg'], 3)
+        self.assertEqual(columns['freq'][0], setting.freq_start)
+        # kept as measured
+        self.assertTrue(np.array_equal(columns['lia_x'], averaged[-1]))
+        self.assertEqual(columns['sweeps'].shape, (3, n))
+        self.assertTrue(np.allclose(columns['sweeps'].mean(axis=0), columns['lia_x']))
+        # the single sweep has no sweeps column
+        setting.is_multi_sweep = False
+        filename = data_filename(setting)
+        self._run(setting)
+        _, hd_pos = spb.scan_header(filename)
+        _, columns = spb.read_scan(0, hd_pos, src=filename, is_mmap=False)
+        self.assertEqual(sorted(columns), ['freq', 'lia_x'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#! encoding = utf-8
+
+""" Unit test of the API_MAP loading and cache """
+
+import os
+import shutil
+import unittest
+import tempfile
+from importlib.resources import files
+from PyMMSp.inst import api_map
+
+
+class TestAPIMap(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self._cache_dir = api_map.CACHE_DIR
+        api_map.CACHE_DIR = os.path.join(self.dir.name, 'cache')
+        api_map.clear_cache()
+        self.filename = os.path.join(self.dir.name, 'API_MAP_Agilent_E8257D.yaml')
+        shutil.copy(files('PyMMSp.inst').joinpath('API_MAP_Agilent_E8257D.yaml'), self.filename)
+
+    def tearDown(self):
+        api_map.CACHE_DIR = self._cache_dir
+        api_map.clear_cache()
+        self.dir.cleanup()
+
+    def test_reverse_presets(self):
+        d = api_map.load_api_map(self.filename)
+        for name, preset in d['presets'].items():
+            for key, value in preset.items():
+                self.assertEqual(preset[d['reverse_presets'][name][str(value)]], value)
+
+    def test_cache(self):
+        d = api_map.load_api_map(self.filename)
+        self.assertIs(api_map.load_api_map(self.filename), d)
+        # reload from the disk cache
+        api_map.clear_cache()
+        self.assertEqual(api_map.load_api_map(self.filename), d)
+        # touched but unchanged: still valid
+        st = os.stat(self.filename)
+        os.utime(self.filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        api_map.clear_cache()
+        self.assertEqual(api_map.load_api_map(self.filename), d)
+
+    def test_invalidate(self):
+        d = api_map.load_api_map(self.filename)
+        with open(self.filename, 'a') as f:
+            f.write('\n  - name: get_new\n    cmd: "NEW?"\n    dtype: str\n')
+        st = os.stat(self.filename)
+        os.utime(self.filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        d_new = api_map.load_api_map(self.filename)
+        self.assertEqual(len(d_new['functions']), len(d['functions']) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#! encoding = utf-8
+
+""" Unit test of the instrument worker threads """
+
+import unittest
+import asyncio
+from time import sleep, perf_counter
+from importlib.resources import files
+from PyMMSp.inst.base import Threads, gather, DynamicSynAPI, Handles
+from PyMMSp.inst.base_async import AsyncLoop, open_handle
+from PyMMSp.inst.synthesizer import SynSimDecoder
+
+
+class TestWorkerThread(unittest.TestCase):
+
+    def setUp(self):
+        self.threads = Threads()
+
+    def tearDown(self):
+        self.threads.join_all()
+
+    def test_call(self):
+        self.assertEqual(self.threads.t_syn.call(pow, 2, 3), 8)
+
+    def test_submit_pipeline(self):
+        # jobs to the same instrument are executed in submission order
+        log = []
+        futures = [self.threads.t_lockin.submit(log.append, i) for i in range(20)]
+        gather(futures)
+        self.assertEqual(log, list(range(20)))
+
+    def test_gather_concurrent(self):
+        # jobs on different instruments run at the same time
+        t0 = perf_counter()
+        results = self.threads.gather((self.threads.t_syn, lambda: sleep(0.2) or 1),
+                                      (self.threads.t_lockin, lambda: sleep(0.2) or 2),
+                                      (self.threads.t_flow, lambda: sleep(0.2) or 3))
+        elapsed = perf_counter() - t0
+        self.assertEqual(results, [1, 2, 3])
+        # one job delay, well below the 0.6 s they take one after another
+        self.assertLess(elapsed, 0.4)
+
+    def test_exception(self):
+        future = self.threads.t_gauge1.submit(int, 'not a number')
+        with self.assertRaises(ValueError):
+            future.result()
+        # the worker survives the exception
+        self.assertEqual(self.threads.t_gauge1.call(int, '1'), 1)
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.threads.gather((self.threads.t_valve1, sleep, 0.5), timeout=0.05)
+
+
+class TestAsyncHandle(unittest.TestCase):
+
+    def setUp(self):
+        self.aio = AsyncLoop()
+        self.api_map = files('PyMMSp.inst').joinpath('API_MAP_Agilent_E8257D.yaml')
+        self.api = DynamicSynAPI(self.api_map)
+
+    def tearDown(self):
+        self.aio.join()
+
+    def _open_sim(self):
+        h = self.aio.run(open_handle('GPIB VISA', 'GPIB0::19::INSTR', is_sim=True))
+        h.set_decoder(SynSimDecoder(self.api_map, 'Agilent_E8257D'))
+        return h
+
+    def test_call(self):
+        h = self._open_sim()
+
+        async def _job():
+            await h.call(self.api.set_cw_freq, 1e9, 'Hz')
+            return await h.call(self.api.get_cw_freq)
+
+        self.assertEqual(self.aio.run(_job(), timeout=1), 1e9)
+
+    def test_gather(self):
+        h1 = self._open_sim()
+        h2 = self._open_sim()
+
+        async def _job(h, level):
+            await h.call(self.api.set_power_level, level, 'dBm')
+            return await h.call(self.api.get_power_level)
+
+        self.assertEqual(self.aio.gather(_job(h1, -10), _job(h2, -20), timeout=1), [-10, -20])
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.aio.run(asyncio.sleep(0.5), timeout=0.05)
+
+
+class TestShadowCache(unittest.TestCase):
+
+    def setUp(self):
+        self.h = Handles()
+        self.h.connect('Synthesizer', 'GPIB VISA', 'GPIB0::19::INSTR', 'Agilent_E8257D',
+                       is_sim=True, cache_age=10)
+        self.api = self.h.api_syn
+        # count the commands that reach the instrument
+        self.sent = []
+        send = self.h.h_syn.send
+
+        def _send(code):
+            self.sent.append(code)
+            send(code)
+
+        self.h.h_syn.send = _send
+
+    def test_skip_write(self):
+        self.api.set_power_stat(self.h.h_syn, True)
+        self.api.set_power_stat(self.h.h_syn, True)
+        self.assertEqual(len(self.sent), 1)
+        self.api.set_power_stat(self.h.h_syn, False)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_read_after_write(self):
+        self.api.set_cw_freq(self.h.h_syn, 1e3, 'MHz')
+        self.assertEqual(self.api.get_cw_freq(self.h.h_syn), 1e9)
+        self.api.set_am_stat(self.h.h_syn, 1, True)
+        self.assertTrue(self.api.get_am_stat(self.h.h_syn, 1))
+        # only the two set commands are sent
+        self.assertEqual(len(self.sent), 2)
+
+    def test_channel(self):
+        self.api.set_am_stat(self.h.h_syn, 1, True)
+        self.api.set_am_stat(self.h.h_syn, 2, True)
+        self.assertEqual(len(self.sent), 2)
+
+    def test_invalidate(self):
+        self.api.set_power_stat(self.h.h_syn, True)
+        self.api.trigger(self.h.h_syn)
+        self.api.set_power_stat(self.h.h_syn, True)
+        self.assertEqual(len(self.sent), 3)
+        self.h.refresh('Synthesizer')
+        self.api.set_power_stat(self.h.h_syn, True)
+        self.assertEqual(len(self.sent), 4)
+
+    def test_stale(self):
+        self.h.h_syn.cache.max_age = 0
+        self.api.set_power_stat(self.h.h_syn, True)
+        self.api.set_power_stat(self.h.h_syn, True)
+        self.assertEqual(len(self.sent), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
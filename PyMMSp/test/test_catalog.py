@@ -0,0 +1,66 @@
+#! encoding = utf-8
+
+""" Unit test of the archive catalog """
+
+import os
+import datetime
+import unittest
+import tempfile
+import numpy as np
+from PyMMSp.libs import catalog, lwa, spb
+
+
+def _h_info(start_freq, mod_mode='FM', comment=''):
+    return 6, 60, 0.01, 0.003, 15., 60., mod_mode, 2, 0., start_freq, 0.1, 1, comment
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.dir.name, 'data')
+        os.makedirs(os.path.join(self.root, '2024'))
+        self.db = os.path.join(self.dir.name, 'catalog.sqlite')
+        y = np.zeros(101)
+        f = os.path.join(self.root, '2024', 'a.lwa')
+        lwa.save_lwa(f, y, _h_info(240000., comment='OCS'), date=datetime.datetime(2024, 3, 1, 12))
+        lwa.save_lwa(f, y, _h_info(250000., 'AM'), date=datetime.datetime(2024, 3, 2, 12))
+        spb.save_spb(os.path.join(self.root, 'b' + spb.SUFFIX),
+                     {'freq': 239990. + np.arange(201) * 0.1, 'lia_x': np.zeros(201)},
+                     spb.h_info_to_dict(_h_info(239990.), date=datetime.datetime(2025, 1, 5)))
+        np.savetxt(os.path.join(self.root, '20230105_240000_240010_bf0.dat'),
+                   np.column_stack((240000. + np.arange(11), np.zeros(11))))
+        # not a data file
+        with open(os.path.join(self.root, 'notes.dat'), 'w') as fp:
+            fp.write('x')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_index(self):
+        self.assertEqual(catalog.index_archive(self.root, self.db, n_workers=2), (3, 0, []))
+        self.assertEqual(len(catalog.query(self.db)), 4)
+        # no sidecar index in the archive
+        self.assertFalse(os.path.exists(os.path.join(self.root, '2024', 'a.lwa' + lwa.INDEX_SUFFIX)))
+        # unchanged
+        self.assertEqual(catalog.index_archive(self.root, self.db, n_workers=1), (0, 0, []))
+        # appended and removed
+        lwa.save_lwa(os.path.join(self.root, '2024', 'a.lwa'), np.zeros(11), _h_info(100000.))
+        os.remove(os.path.join(self.root, 'b' + spb.SUFFIX))
+        self.assertEqual(catalog.index_archive(self.root, self.db, n_workers=1), (1, 1, []))
+        self.assertEqual(len(catalog.query(self.db)), 4)
+
+    def test_query(self):
+        catalog.index_archive(self.root, self.db, n_workers=1)
+        rows = catalog.query(self.db, freq=(240000., 240005.))
+        self.assertEqual([r['date'][:10] for r in rows], ['2023-01-05', '2024-03-01', '2025-01-05'])
+        rows = catalog.query(self.db, freq=(240000., 240005.), mod='fm', since='2024-01-01', until='2024-12-31')
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['comment'], rows[0]['sh'], rows[0]['pts']), ('OCS', 6, 101))
+        # overlapping only
+        self.assertEqual(len(catalog.query(self.db, freq=(240005., 250001.))), 0)
+        self.assertEqual(len(catalog.query(self.db, freq=(240005., 250001.), is_cover=False)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#! encoding = utf-8
+
+""" Unit test of the batch scan checkpoint """
+
+import os
+import unittest
+import tempfile
+from PyMMSp.config.config import AbsScanSetting
+from PyMMSp.libs.checkpoint import CheckpointWriter, load_checkpoint, find_unfinished, CHECKPOINT_FILE
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, CHECKPOINT_FILE)
+        self.list_settings = [AbsScanSetting(freq_start=100, freq_stop=101, freq_step=0.1),
+                              AbsScanSetting(freq_start=200, freq_stop=201, freq_step=0.1,
+                                             avg=4, is_multi_sweep=True)]
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_resume(self):
+        writer = CheckpointWriter(self.filename)
+        writer.start_batch(self.list_settings)
+        writer.start_entry(0)
+        for idx in range(10):
+            writer.add_point(0, idx, idx * 0.5)
+        writer.finish_entry(0)
+        writer.start_entry(1, 'scan_1.lwa')
+        writer.add_sweep(1, [1., 2., 3.])
+        writer.close()
+        # a crash in the middle of a write leaves a truncated line
+        with open(self.filename, 'a') as fp:
+            fp.write('{"type": "sweep", "entry": 1, "y": [1.')
+
+        self.assertEqual(find_unfinished(self.dir.name), self.filename)
+        ckpt = load_checkpoint(self.filename)
+        self.assertEqual(ckpt.list_settings, self.list_settings)
+        self.assertEqual(ckpt.done, {0})
+        self.assertEqual(ckpt.next_entry, 1)
+        self.assertEqual(ckpt.sweeps[1], [[1., 2., 3.]])
+        self.assertEqual(ckpt.files, {0: '', 1: 'scan_1.lwa'})
+        self.assertFalse(ckpt.is_finished)
+
+    def test_resume_twice(self):
+        writer = CheckpointWriter(self.filename)
+        writer.start_batch(self.list_settings)
+        writer.start_entry(0)
+        writer.add_point(0, 0, 1.)
+        writer.close()
+        # the resumed entry keeps the points taken before
+        writer = CheckpointWriter(self.filename, is_resume=True)
+        writer.add_point(0, 1, 2.)
+        writer.close()
+        ckpt = load_checkpoint(self.filename)
+        self.assertEqual(ckpt.points[0], {0: 1., 1: 2.})
+        self.assertEqual(ckpt.next_entry, 0)
+
+    def test_resume_torn_line(self):
+        writer = CheckpointWriter(self.filename)
+        writer.start_batch(self.list_settings)
+        writer.start_entry(0)
+        writer.add_point(0, 0, 1.)
+        writer.close()
+        with open(self.filename, 'a') as fp:
+            fp.write('{"type": "pt", "entry": 0, "idx": 1, "y": 2.')
+        # the points taken after the resume are not lost to the torn line
+        writer = CheckpointWriter(self.filename, is_resume=True)
+        for idx in range(1, 5):
+            writer.add_point(0, idx, idx + 1.)
+        writer.close()
+        ckpt = load_checkpoint(self.filename)
+        self.assertEqual(ckpt.points[0], {0: 1., 1: 2., 2: 3., 3: 4., 4: 5.})
+        # a checkpoint torn at its first line
+        with open(self.filename, 'w') as fp:
+            fp.write('{"type": "ba')
+        writer = CheckpointWriter(self.filename, is_resume=True)
+        writer.start_batch(self.list_settings)
+        writer.close()
+        self.assertEqual(load_checkpoint(self.filename).list_settings, self.list_settings)
+
+    def test_finish(self):
+        writer = CheckpointWriter(self.filename)
+        writer.start_batch(self.list_settings)
+        writer.finish()
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(find_unfinished(self.dir.name), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#! encoding = utf-8
+
+""" Unit test of the lockin helper functions """
+
+import unittest
+from math import exp, factorial
+from time import sleep
+import numpy as np
+from PyMMSp.inst.base import Handles
+from PyMMSp.inst.lockin import settle_time, decode_buffer, buffer_acq_time, TAU_VAL
+
+
+def _residual(n, x):
+    return exp(-x) * sum(x ** k / factorial(k) for k in range(n))
+
+
+class TestSettleTime(unittest.TestCase):
+
+    def test_settle_time(self):
+        for octave_idx in range(4):
+            for tol in (0.5, 1e-2, 1e-4, 1e-8):
+                t = settle_time(4, octave_idx, tol)
+                x = t / TAU_VAL[4]
+                self.assertAlmostEqual(_residual(octave_idx + 1, x) / tol, 1., places=9)
+        # one RC stage: exponential decay
+        self.assertAlmostEqual(settle_time(0, 0, exp(-3)), 3 * TAU_VAL[0])
+        # steeper filters settle slower, tighter tolerance takes longer
+        self.assertLess(settle_time(4, 0, 1e-3), settle_time(4, 3, 1e-3))
+        self.assertLess(settle_time(4, 1, 1e-2), settle_time(4, 1, 1e-3))
+        self.assertEqual(settle_time(4, 1, 1.), 0.)
+
+
+class TestBuffer(unittest.TestCase):
+
+    def test_decode_buffer(self):
+        data = np.array([0., 1.5, -2.25e-6, 3.0517578125e-05], dtype='<f4')
+        self.assertTrue(np.array_equal(decode_buffer(data.tobytes()), data.astype(np.float64)))
+        self.assertEqual(decode_buffer(data.tobytes()).dtype, np.float64)
+        # an incomplete trailing point is dropped
+        self.assertEqual(len(decode_buffer(data.tobytes()[:-1])), 3)
+        self.assertEqual(len(decode_buffer(b'')), 0)
+
+    def test_buffer_acq_time(self):
+        # 0.0625 Hz and 512 Hz
+        self.assertEqual(buffer_acq_time(1, 0), 16000.)
+        self.assertEqual(buffer_acq_time(512, 13), 1000.)
+        self.assertEqual(buffer_acq_time(0, 13), 0.)
+
+    def test_sim_buffer(self):
+        h = Handles()
+        h.connect('Lock-in', 'GPIB VISA', 'GPIB0::8::INSTR', 'SR830', is_sim=True)
+        api = h.api_lockin
+        api.set_sample_rate(h.h_lockin, 13)
+        self.assertEqual(api.get_sample_rate(h.h_lockin), 13)
+        api.reset_buffer(h.h_lockin)
+        self.assertEqual(api.get_buffer_pts(h.h_lockin), 0)
+        api.start_buffer(h.h_lockin)
+        sleep(buffer_acq_time(20, 13) * 1e-3)
+        api.pause_buffer(h.h_lockin)
+        n = api.get_buffer_pts(h.h_lockin)
+        self.assertGreaterEqual(n, 20)
+        # the count stays while the buffer is paused
+        sleep(buffer_acq_time(5, 13) * 1e-3)
+        self.assertEqual(api.get_buffer_pts(h.h_lockin), n)
+        raw = api.get_buffer(h.h_lockin, 1, 0, n, byte=4 * n)
+        self.assertEqual(len(raw), 4 * n)
+        self.assertEqual(len(decode_buffer(raw)), n)
+        # only the stored points are transferred
+        self.assertEqual(len(api.get_buffer(h.h_lockin, 1, n - 2, 10, byte=40)), 8)
+        self.assertIsInstance(api.get_single_x(h.h_lockin), float)
+        api.reset_buffer(h.h_lockin)
+        self.assertEqual(api.get_buffer_pts(h.h_lockin), 0)
+        # nothing is stored at the trigger sample rate
+        api.set_sample_rate(h.h_lockin, 14)
+        api.start_buffer(h.h_lockin)
+        sleep(0.01)
+        self.assertEqual(api.get_buffer_pts(h.h_lockin), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#! encoding = utf-8
+
+""" Unit test of the LWA file handler """
+
+import os
+import datetime
+import unittest
+import tempfile
+import numpy as np
+from PyMMSp.libs import lwa
+
+_HEADER = ('DATE 01-02-2024 TIME 10:00:{:02d} SH 1 IT 60 SENS 0.01 TAU 0.003 '
+           'MF 15.000 MA 60.000 MOD FM HARM 2 PHA 0.00\n'
+           ' scan{:d} comment\n'
+           ' {:.3f}   {:.6f}  {:d} 1 1 1  1.887  0.000 0 0 START\n')
+
+
+_H_INFO = (6, 60, 0.01, 0.003, 15., 60., 'FM', 2, 0., 100000., 0.1, 3, 'scan comment')
+
+
+def _write_scan(f, i, y):
+    f.write(_HEADER.format(i, i, 100000. + i * 100, 0.1, len(y)))
+    for j in range(0, len(y), 10):
+        f.write(''.join('{:10.3f}'.format(v) for v in y[j:j + 10]) + '\n')
+
+
+class TestLWA(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'test.lwa')
+        self.ys = [np.arange(25) * (i + 1) for i in range(3)]
+        with open(self.filename, 'w') as f:
+            for i, y in enumerate(self.ys):
+                _write_scan(f, i, y)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_scan_header(self):
+        entry_settings, hd_pos = lwa.scan_header(self.filename)
+        self.assertEqual(len(entry_settings), 3)
+        self.assertEqual(entry_settings[1][:2], (2, 'scan1 comment'))
+        self.assertEqual(entry_settings[1][13], 25)
+        self.assertEqual(hd_pos[-1], os.path.getsize(self.filename))
+        self.assertTrue(os.path.isfile(self.filename + lwa.INDEX_SUFFIX))
+        # reuse the index
+        self.assertEqual(lwa.scan_header(self.filename), (entry_settings, hd_pos))
+
+    def test_append(self):
+        lwa.scan_header(self.filename)
+        with open(self.filename, 'a') as f:
+            _write_scan(f, 3, np.ones(7))
+        entry_settings, hd_pos = lwa.scan_header(self.filename)
+        self.assertEqual([e[0] for e in entry_settings], [1, 2, 3, 4])
+        self.assertEqual(len(hd_pos), 5)
+
+    def test_preview(self):
+        _, hd_pos = lwa.scan_header(self.filename)
+        data = lwa.preview(2, hd_pos, src=self.filename)
+        self.assertEqual(data.shape, (25, 2))
+        self.assertAlmostEqual(data[0, 0], 100200e6)
+        np.testing.assert_allclose(data[:, 1], self.ys[2] * 1e-6)
+
+    def test_export_lwa(self):
+        _, hd_pos = lwa.scan_header(self.filename)
+        output = os.path.join(self.dir.name, 'out.lwa')
+        lwa.export_lwa([2, 0], hd_pos, src=self.filename, output=output)
+        entry_settings, _ = lwa.scan_header(output)
+        self.assertEqual([e[1] for e in entry_settings], ['scan0 comment', 'scan2 comment'])
+
+    def test_parse_data(self):
+        y = np.random.default_rng(0).uniform(-9999., 9999., 23).round(3)
+        text = ''.join(''.join('{:10.3f}'.format(v) for v in y[j:j + 10]) + '\n' for j in range(0, 23, 10))
+        for eol in ('\n', '\r\n'):
+            data = text.replace('\n', eol).encode('ascii')
+            np.testing.assert_array_equal(lwa._parse_fixed_width(data, 23), y)
+            np.testing.assert_array_equal(lwa.parse_data(data, 23), y)
+
+    def test_parse_data_fallback(self):
+        # a value wider than the field
+        data = '{:10.3f}{:10.3f}\n'.format(123456789., 1.).encode('ascii')
+        self.assertRaises(ValueError, lwa._parse_fixed_width, data, 2)
+        np.testing.assert_array_equal(lwa.parse_data(data, 2), [123456789., 1.])
+        # not fixed width
+        np.testing.assert_array_equal(lwa.parse_data(b' 1.0 2.0\n 3.0\n', 3), [1., 2., 3.])
+
+    def test_format_data(self):
+        rng = np.random.default_rng(0)
+        for y in (rng.uniform(-99999., 999999., 1003), np.arange(-200, 200) / 400, np.arange(20.), np.array([]),
+                  # rounding of the decimal ties, -0, sign with 5 integer digits
+                  np.array([0.0005, -0.0005, 1.0005, 2.0015, -0., -99999.9994, 999999.9994, -1e-9, 0.4996, 9.9996]),
+                  # python fallback: too wide for the field, nan
+                  np.r_[np.arange(15.), 1e7], np.r_[np.nan, np.arange(15.)], np.r_[-100000., np.arange(15.)]):
+            self.assertEqual(lwa.format_data(y), lwa._format_data_py(y))
+
+    def test_writer(self):
+        y = np.random.default_rng(0).normal(size=123) * 1e-3
+        date = datetime.datetime(2024, 1, 2, 10, 0, 0)
+        output = os.path.join(self.dir.name, 'out.lwa')
+        lwa.save_lwa(output, y, _H_INFO, date=date)
+        stream = os.path.join(self.dir.name, 'stream.lwa')
+        w = lwa.LWAWriter(stream, _H_INFO, len(y), date=date)
+        w.write(y[:37], 1)
+        # a valid file with the partial data
+        entry_settings, hd_pos = lwa.scan_header(stream)
+        self.assertEqual(entry_settings[0][13:15], (37, 1))
+        np.testing.assert_allclose(lwa.preview(0, hd_pos, src=stream)[:, 1], y[:37], atol=1e-9)
+        w.write(y[:40], 1)
+        w.write(y * 2, 2)
+        w.write(y, 3)
+        w.close()
+        with open(output, 'rb') as f1, open(stream, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        # discard the scan being written
+        w = lwa.LWAWriter(stream, _H_INFO, len(y), date=date)
+        w.write(y, 1)
+        w.discard()
+        self.assertEqual(os.path.getsize(stream), os.path.getsize(output))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#! encoding = utf-8
+
+""" Unit test of the log summary of ReadPySpecLog """
+
+import os
+import csv
+import tempfile
+import unittest
+import numpy as np
+from PyMMSp import sflib, ReadPySpecLog
+
+
+class TestReadPySpecLog(unittest.TestCase):
+
+    def test_read_logs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            names = [os.path.join(tmp, 'Fit{:d}.log'.format(i)) for i in range(2)]
+            sflib.save_log(names[0], [300., 0.5, 2., 100., 0.3, -1.], [0.01, 0.02, 0.1, 0.01, 0.02, 0.1],
+                           [0.1], 0, 2, 2, ('mu', 'sigma', 'A'))
+            # the set with a nan uncertainty is kept in line
+            sflib.save_log(names[1], [200., 0.4, 1., 250., 0.4, 1.], [0.01, np.nan, 0.1, 0.01, 0.02, 0.1],
+                           [0.2, 0.1], 1, 0, 2, ('mu', 'gamma', 'A'))
+            file_name, pars = ReadPySpecLog.read_logs(names)
+            self.assertEqual(file_name, [names[0], names[1], names[1], names[0]])
+            np.testing.assert_allclose(pars[:, 0], (100., 200., 250., 300.))
+            np.testing.assert_allclose(pars[0], (100., 0.01, 0.3, 0.02, -1., 0.1))
+            self.assertTrue(np.isnan(pars[1, 3]))
+
+            out_name = os.path.join(tmp, 'summary.csv')
+            ReadPySpecLog.main(names + ['-o', out_name])
+            with open(out_name, newline='') as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(len(rows), 4)
+            self.assertEqual(rows[0]['filename'], names[0])
+            self.assertEqual(rows[0]['A'], '-1.000000')
+
+            out_name = os.path.join(tmp, 'spectra.txt')
+            ReadPySpecLog.main(names + ['-o', out_name, '-spectra'])
+            xy = np.loadtxt(out_name)
+            # the strongest line in SnR
+            self.assertAlmostEqual(xy[np.argmax(xy[:, 1]), 0], 3., places=3)
+
+    def test_regulate(self):
+        rng = np.random.default_rng(0)
+        x = np.sort(rng.uniform(0., 10., 1000))
+        y = rng.normal(size=1000)
+        xy = ReadPySpecLog.regulate(x, y, resol=0.5, rescale_x=1.)
+        step_num = np.ceil((x - x.min()) / 0.5)
+        self.assertEqual(len(xy), len(np.unique(step_num)))
+        for k in (0, 7, len(xy) - 1):
+            sel = np.isclose(x.min() + step_num * 0.5, xy[k, 0])
+            self.assertAlmostEqual(xy[k, 1], y[sel].mean())
+
+    def test_synth_spectrum(self):
+        rng = np.random.default_rng(1)
+        mu = rng.uniform(100., 200., 200)
+        sigma = rng.uniform(0.2, 1., 200)
+        a = rng.uniform(1., 10., 200)
+        x, y = ReadPySpecLog.synth_spectrum(mu, sigma, a, resol=0.05)
+        y_ref = np.zeros_like(x)
+        for line in zip(mu, sigma, a):
+            sel = np.abs(x - line[0]) <= 10 * line[1]
+            y_ref[sel] += ReadPySpecLog.g(x[sel], *line)
+        np.testing.assert_allclose(y, y_ref, atol=0.02 * y_ref.max())
+        # the points beyond 10 sigma of every line are left out
+        self.assertTrue(np.all(np.abs(x[:, np.newaxis] - mu).min(axis=1) <= 10 * sigma.max()))
+        self.assertAlmostEqual(x[0], (mu - 10 * sigma).min(), delta=0.05)
+        # the area of a narrow line is kept
+        x, y = ReadPySpecLog.synth_spectrum([10.03], [0.001], [2.], resol=0.1)
+        self.assertAlmostEqual(y.sum() * 0.1, 2.)
+        x, y = ReadPySpecLog.synth_spectrum([1.], [0.], [np.inf])
+        self.assertEqual(len(x), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#! encoding = utf-8
+
+""" Unit test of the batch spectral fitting """
+
+import os
+import csv
+import json
+import time
+import unittest
+import tempfile
+import multiprocessing
+from unittest import mock
+import numpy as np
+from PyMMSp import sflib, sfbatch
+
+
+def _slow_fit(*args, **kwargs):
+    time.sleep(60)
+
+
+class TestSFBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        x = np.linspace(-5, 5, 501)
+        rng = np.random.default_rng(0)
+        f = sflib.Function(0, 2, 1)
+        tasks = []
+        for i, mu in enumerate((-1., 0., 1.)):
+            y = f.get_func()(x, mu, 0.5, 1.) + rng.normal(size=501) * 1e-3 + 0.01
+            np.savetxt(os.path.join(self.dir.name, f'line{i:d}.csv'), np.column_stack((x, y)), delimiter=',')
+            tasks.append({'file': f'line{i:d}.csv', 'init': [mu + 0.1, 0.4, 0.8], 'ftype': 'gaussian', 'der': 2})
+        tasks.append({'file': 'missing.csv', 'init': [0, 1, 1]})
+        self.manifest = os.path.join(self.dir.name, 'manifest.jsonl')
+        with open(self.manifest, 'w') as fp:
+            fp.write('# comment\n')
+            fp.write('\n'.join(json.dumps(t) for t in tasks))
+        self.out_dir = os.path.join(self.dir.name, 'out')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _check(self, results):
+        self.assertEqual([r['status'] for r in results], ['ok', 'ok', 'ok', 'file not found'])
+        for r, mu in zip(results, (-1., 0., 1.)):
+            np.testing.assert_allclose(r['popt'], [mu, 0.5, 1.], atol=1e-3)
+        self.assertTrue(os.path.isfile(os.path.join(self.out_dir, 'Fitline0.log')))
+        with open(os.path.join(self.out_dir, sfbatch.SUMMARY_FILE)) as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1]['peak_idx'], '1')
+
+    def test_serial(self):
+        progress = []
+        tasks = sfbatch.load_manifest(self.manifest)
+        results = sfbatch.fit_batch(tasks, self.out_dir, n_workers=1, progress=lambda *a: progress.append(a[:2]))
+        self._check(results)
+        self.assertEqual(progress, [(1, 4), (2, 4), (3, 4), (4, 4)])
+
+    def test_pool(self):
+        tasks = sfbatch.load_manifest(self.manifest)
+        self._check(sfbatch.fit_batch(tasks, self.out_dir, n_workers=2))
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == 'fork', 'the patch is inherited by fork only')
+    def test_timeout(self):
+        # several tasks per worker, so the later tasks run after a timed out one
+        tasks = sfbatch.load_manifest(self.manifest)[:3] * 2
+        progress = []
+        t0 = time.perf_counter()
+        with mock.patch.object(sflib, 'fit_spectrum', _slow_fit):
+            results = sfbatch.fit_batch(tasks, self.out_dir, n_workers=2, timeout=0.5,
+                                        progress=lambda *a: progress.append(a[0]))
+        self.assertEqual([r['status'] for r in results], ['timeout'] * 6)
+        self.assertEqual(progress, [1, 2, 3, 4, 5, 6])
+        self.assertLess(time.perf_counter() - t0, 30)
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == 'fork', 'the patch is inherited by fork only')
+    def test_timeout_mixed(self):
+        # the fits after a timed out task on the same worker slot still succeed
+        tasks = sfbatch.load_manifest(self.manifest)
+        slow = tasks[1]['file']
+        fit = sflib.fit_spectrum
+
+        def _fit(f, x, y, init, *args, **kwargs):
+            if abs(init[0]) < 0.5:
+                time.sleep(60)
+            return fit(f, x, y, init, *args, **kwargs)
+
+        with mock.patch.object(sflib, 'fit_spectrum', _fit):
+            results = sfbatch.fit_batch(tasks * 2, self.out_dir, n_workers=2, timeout=5)
+        self.assertEqual([r['status'] for r in results], ['ok', 'timeout', 'ok', 'file not found'] * 2)
+        self.assertEqual(results[5]['file'], slow)
+
+
+if __name__ == '__main__':
+    unittest.main()
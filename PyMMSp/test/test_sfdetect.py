@@ -0,0 +1,94 @@
+#! encoding = utf-8
+
+""" Unit test of the automatic line detection of sfdetect """
+
+import os
+import csv
+import tempfile
+import unittest
+import numpy as np
+from PyMMSp import sflib, sfdetect
+
+# (mu, width, A) of the lines. The 2 lines at 60 are blended
+_LINES = np.array([[20., 0.3, 1.], [45., 0.5, 0.6], [60., 0.3, 0.8], [61.5, 0.3, 0.5], [85., 0.4, 1.2]])
+_NOISE = 0.01
+
+
+def _survey(ftype, der):
+    x = np.linspace(0., 100., 20001)
+    f = sflib.Function(ftype, der, 1).get_func()
+    # normalized so that the peak intensity of each line is about A
+    y = sum(f(x, mu, w, 1.) / np.abs(f(mu + (0.5 * w if der % 2 else 0.), mu, w, 1.)) * a for mu, w, a in _LINES)
+    rng = np.random.default_rng(1)
+    return x, y + 0.05 + rng.normal(scale=_NOISE, size=x.size)
+
+
+class TestDetect(unittest.TestCase):
+
+    def test_detect(self):
+        for ftype in (0, 1):
+            for der in (0, 2, 4):
+                x, y = _survey(ftype, der)
+                lines = sfdetect.detect(x, y, ftype, der, widths=(0.2, 0.4, 0.8), snr=6.)
+                msg = f'ftype {ftype:d} der {der:d}'
+                self.assertEqual(lines.shape, (len(_LINES), 4), msg)
+                # the centers of the blended lines are pulled a little by each other
+                np.testing.assert_allclose(lines[:, 0], _LINES[:, 0], atol=0.1, err_msg=msg)
+                np.testing.assert_allclose(lines[:, 1], _LINES[:, 1], rtol=0.15, err_msg=msg)
+                self.assertTrue(np.all(lines[:, 3] > 6.), msg)
+                # upside down
+                lines_neg = sfdetect.detect(x, -y, ftype, der, widths=(0.2, 0.4, 0.8), snr=6., sign=-1)
+                np.testing.assert_allclose(lines_neg[:, 0], lines[:, 0], err_msg=msg)
+                np.testing.assert_allclose(lines_neg[:, 2], -lines[:, 2], err_msg=msg)
+
+    def test_noise(self):
+        rng = np.random.default_rng(2)
+        x = np.linspace(0., 100., 20001)
+        self.assertEqual(len(sfdetect.detect(x, rng.normal(size=x.size), 0, 2, snr=6.)), 0)
+        c = rng.normal(size=10000) * np.repeat([1., 3.], 5000)
+        self.assertAlmostEqual(sfdetect.robust_sigma(c), 2., delta=0.5)
+        np.testing.assert_allclose(sfdetect.robust_sigma(c, 2500)[[0, -1]], (1., 3.), rtol=0.1)
+
+    def test_segment(self):
+        x = np.linspace(0., 100., 20001)
+        lines = np.column_stack((_LINES, np.full(len(_LINES), 10.)))
+        windows = sfdetect.segment(x, lines, 0)
+        self.assertEqual([w.peak for w in windows], [1, 1, 2, 1])
+        self.assertEqual(windows[2].init, tuple(_LINES[2:4].ravel()))
+        for w, (mu, width, _) in zip(windows, _LINES[[0, 1, 2, 4]]):
+            self.assertAlmostEqual(x[w.i0], mu - sfdetect.WINDOW_HW[0] * width, delta=0.01)
+        self.assertEqual([w.peak for w in sfdetect.segment(x, lines, 0, max_peak=1)], [1] * 5)
+
+    def test_reduce_survey(self):
+        x, y = _survey(0, 2)
+        for n_workers in (1, 2):
+            windows, results = sfdetect.reduce_survey(x, y, 0, 2, widths=(0.2, 0.4, 0.8), snr=6.,
+                                                       n_workers=n_workers)
+            self.assertEqual(len(results), len(windows))
+            self.assertTrue(all(r['status'] == 'ok' for r in results))
+            popt = np.concatenate([r['popt'] for r in results]).reshape(-1, 3)
+            np.testing.assert_allclose(popt[:, 0], _LINES[:, 0], atol=0.01)
+            np.testing.assert_allclose(popt[:, 1], _LINES[:, 1], rtol=0.05)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'lines.csv')
+            sfdetect.save_line_list(filename, x, results)
+            with open(filename, newline='') as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), len(_LINES))
+        self.assertEqual(rows[3]['window'], '3')
+        self.assertEqual(rows[3]['peak_idx'], '2')
+
+    def test_prune(self):
+        # a spurious line on the noise runs away in the fit, and is removed
+        x, y = _survey(0, 0)
+        window = sfdetect.Window(0, 4001, (20., 0.3, 3., 22., 0.3, 0.1), (100., 6.))
+        r = sfdetect.fit_window(x[:4001], y[:4001], window, 0, 0)
+        self.assertEqual(r['status'], 'ok')
+        self.assertEqual(len(r['popt']), 3)
+        self.assertEqual(r['snr'], [100.])
+        r = sfdetect.fit_window(x[:4001], y[:4001], window, 0, 0, min_sig=0)
+        self.assertEqual(r['status'], 'fit failed')
+
+
+if __name__ == '__main__':
+    unittest.main()
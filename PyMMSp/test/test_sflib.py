@@ -0,0 +1,74 @@
+#! encoding = utf-8
+
+""" Unit test of the spectral line profiles of sflib """
+
+import unittest
+import numpy as np
+from PyMMSp import sflib
+
+# (mu, width, A) of 2 peaks
+_P = np.array([0.2, 0.7, 1.3, -0.5, 0.4, 0.8])
+
+
+class TestFunction(unittest.TestCase):
+
+    def test_derivatives(self):
+        # each function is the x-derivative of the previous order
+        x = np.linspace(-3, 3, 20001)
+        for ftype in (0, 1):
+            for der in range(1, 5):
+                y0 = sflib.Function(ftype, der - 1, 1).get_func()(x, *_P[:3])
+                y1 = sflib.Function(ftype, der, 1).get_func()(x, *_P[:3])
+                np.testing.assert_allclose(np.gradient(y0, x), y1, atol=1e-4 * np.abs(y1).max(),
+                                           err_msg=f'ftype {ftype:d} der {der:d}')
+
+    def test_multi_peak(self):
+        # 30 peaks on several chunks of the working arrays
+        x = np.linspace(240000., 240100., 5001)
+        rng = np.random.default_rng(0)
+        p = np.column_stack((rng.uniform(240000., 240100., 30), rng.uniform(0.1, 0.5, 30),
+                             rng.uniform(0.5, 2., 30))).ravel()
+        for ftype in (0, 1):
+            for der in range(5):
+                f1 = sflib.Function(ftype, der, 1).get_func()
+                y_sum = sum(f1(x, *p[3 * k:3 * k + 3]) for k in range(30))
+                y = sflib.Function(ftype, der, 30).get_func()(x, *p)
+                np.testing.assert_allclose(y, y_sum, rtol=0, atol=1e-12 * np.abs(y_sum).max())
+                f = sflib.Function(ftype, der, 30, dtype=np.float32, reuse_buffers=True)
+                for _ in range(2):
+                    y32 = f.get_func()(x, *p)
+                    self.assertEqual(y32.dtype, np.float32)
+                    np.testing.assert_allclose(y32, y_sum, rtol=0, atol=1e-3 * np.abs(y_sum).max())
+        # scalar x, and the function of another order than der
+        f = sflib.Function(0, 2, 1)
+        self.assertAlmostEqual(f.gder0(0.3, 0., 1., 1.), np.exp(-0.045) / np.sqrt(2 * np.pi))
+
+    def test_jac(self):
+        x = np.linspace(-3, 3, 501)
+        eps = 1e-6
+        for ftype in (0, 1):
+            for der in range(5):
+                f = sflib.Function(ftype, der, 2)
+                jac = f.get_jac()(x, *_P)
+                self.assertEqual(jac.shape, (501, 6))
+                for i in range(6):
+                    dp = np.zeros(6)
+                    dp[i] = eps
+                    num = (f.get_func()(x, *(_P + dp)) - f.get_func()(x, *(_P - dp))) / (2 * eps)
+                    np.testing.assert_allclose(jac[:, i], num, atol=1e-7 * np.abs(jac).max(),
+                                               err_msg=f'ftype {ftype:d} der {der:d} p {i:d}')
+
+    def test_fit_spectrum(self):
+        x = np.linspace(-5, 5, 2001)
+        rng = np.random.default_rng(0)
+        for ftype in (0, 1):
+            f = sflib.Function(ftype, 4, 2)
+            y = f.get_func()(x, *_P) + rng.normal(size=x.size) * 1e-3 + 0.01
+            popt, uncertainty, noise, ppoly, stat = sflib.fit_spectrum(f, x, y, _P * 1.02, 0)
+            self.assertEqual(stat, 0)
+            np.testing.assert_allclose(popt, _P, atol=1e-2)
+            self.assertAlmostEqual(ppoly[-1], 0.01, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()
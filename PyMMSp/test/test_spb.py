@@ -0,0 +1,92 @@
+#! encoding = utf-8
+
+""" Unit test of the binary spectrum format """
+
+import os
+import datetime
+import unittest
+import tempfile
+import numpy as np
+from PyMMSp.libs import lwa, spb
+
+_H_INFO = (6, 60, 0.01, 0.003, 15., 60., 'FM', 2, 0., 100000., 0.1, 1, 'scan comment')
+
+
+class TestSPB(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'test' + spb.SUFFIX)
+        rng = np.random.default_rng(0)
+        self.ys = [rng.normal(size=25 + i) * 1e-3 for i in range(3)]
+        self.date = datetime.datetime(2024, 1, 2, 10, 0, 0)
+        for i, y in enumerate(self.ys):
+            x = 100000. + np.arange(len(y)) * 0.1
+            spb.save_spb(self.filename, {'freq': x, 'lia_x': y, 'sweeps': np.vstack((y, y))},
+                         spb.h_info_to_dict(_H_INFO, date=self.date))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_scan_header(self):
+        entry_settings, hd_pos = spb.scan_header(self.filename)
+        self.assertEqual(len(entry_settings), 3)
+        self.assertEqual(entry_settings[1][:4], (2, 'scan comment', '01-02-2024', '10:00:00'))
+        self.assertEqual(entry_settings[2][13], 27)
+        self.assertEqual(hd_pos[-1], os.path.getsize(self.filename))
+
+    def test_read_scan(self):
+        _, hd_pos = spb.scan_header(self.filename)
+        for is_mmap in (True, False):
+            info, columns = spb.read_scan(1, hd_pos, src=self.filename, is_mmap=is_mmap)
+            self.assertEqual(info['comment'], 'scan comment')
+            # full precision
+            np.testing.assert_array_equal(columns['lia_x'], self.ys[1])
+            self.assertEqual(columns['sweeps'].shape, (2, 26))
+        data = spb.preview(0, hd_pos, src=self.filename)
+        self.assertEqual(data.shape, (25, 2))
+        self.assertAlmostEqual(data[0, 0], 100000e6)
+
+    def test_incomplete(self):
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'ab') as f:
+            f.write(spb.MAGIC + b'\x10')
+        entry_settings, hd_pos = spb.scan_header(self.filename)
+        self.assertEqual(len(entry_settings), 3)
+        self.assertEqual(hd_pos[-1], size)
+
+    def test_writer(self):
+        info = spb.h_info_to_dict(_H_INFO, date=self.date)
+        w = spb.SPBWriter(self.filename, 4, info)
+        w.write(0, freq=[1., 2.], lia_x=[3., 4.])
+        w.close()
+        # an empty scan
+        w = spb.SPBWriter(self.filename, 0, info)
+        w.close()
+        entry_settings, hd_pos = spb.scan_header(self.filename)
+        self.assertEqual(len(entry_settings), 5)
+        self.assertEqual(hd_pos[-1], os.path.getsize(self.filename))
+        _, columns = spb.read_scan(3, hd_pos, src=self.filename)
+        np.testing.assert_array_equal(columns['lia_x'], [3., 4., np.nan, np.nan])
+        _, columns = spb.read_scan(4, hd_pos, src=self.filename)
+        self.assertEqual(columns['freq'].shape, (0,))
+
+    def test_convert(self):
+        lwa_file = os.path.join(self.dir.name, 'test.lwa')
+        spb.spb_to_lwa(self.filename, lwa_file)
+        entry_settings_lwa, _ = lwa.scan_header(lwa_file)
+        entry_settings, _ = spb.scan_header(self.filename)
+        self.assertEqual([e[:4] for e in entry_settings_lwa], [e[:4] for e in entry_settings])
+        # and back
+        spb_file = os.path.join(self.dir.name, 'back' + spb.SUFFIX)
+        spb.lwa_to_spb(lwa_file, spb_file)
+        _, hd_pos = spb.scan_header(spb_file)
+        info, columns = spb.read_scan(2, hd_pos, src=spb_file)
+        self.assertEqual(info['synmulti'], 6)
+        # 3 decimal places in LWA, full scale is 1e4
+        np.testing.assert_allclose(columns['lia_x'], self.ys[2], atol=0.01 * 1e-4 * 1e-3)
+        np.testing.assert_allclose(columns['freq'], 100000. + np.arange(27) * 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+#! encoding = utf-8
+
+""" Unit test of the instrument communication statistics """
+
+import os
+import json
+import unittest
+import tempfile
+import threading
+from PyMMSp.inst.stats import LatencyHistogram, InstStats, timed, dump_stats
+
+
+class _FakeHandle:
+
+    def __init__(self):
+        self.stats = InstStats()
+        self.block = None
+
+    @timed
+    def send(self, code):
+        if self.block:
+            self.block.wait(5)
+
+    @timed
+    def recv(self, byte=64, skip=0):
+        return 'reply'
+
+    @timed
+    def query(self, code, byte=64, skip=0):
+        self.send(code)
+        return self.recv(byte, skip)
+
+    @timed
+    def query_timeout(self, code):
+        raise TimeoutError
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentile(self):
+        h = LatencyHistogram()
+        for _ in range(99):
+            h.record(1e-3)
+        h.record(1.)
+        self.assertEqual(h.n, 100)
+        self.assertAlmostEqual(h.max, 1.)
+        # within one bucket (10 per decade)
+        self.assertTrue(1e-3 <= h.percentile(50) <= 1.3e-3)
+        self.assertAlmostEqual(h.percentile(100), 1.)
+
+    def test_out_of_range(self):
+        h = LatencyHistogram()
+        h.record(0)
+        h.record(1e4)
+        self.assertEqual(h.counts[0], 1)
+        self.assertEqual(h.counts[-1], 1)
+
+
+class TestInstStats(unittest.TestCase):
+
+    def test_nested(self):
+        h = _FakeHandle()
+        h.query(':FREQ:CW?')
+        h.send(':FREQ:CW 1000.000HZ')
+        h.send(':FREQ:CW 2000.000HZ')
+        # query is recorded once, not again for its send and recv
+        self.assertEqual(set(h.stats.commands), {':FREQ:CW?', ':FREQ:CW'})
+        self.assertEqual(h.stats.commands[':FREQ:CW?'].latency.n, 1)
+        self.assertEqual(h.stats.commands[':FREQ:CW?'].bytes_recv, 5)
+        self.assertEqual(h.stats.commands[':FREQ:CW'].latency.n, 2)
+
+    def test_threads(self):
+        # a call in another thread is not taken for a nested call
+        h = _FakeHandle()
+        h.block = threading.Event()
+        t = threading.Thread(target=h.send, args=('*TRG',))
+        t.start()
+        h.recv()
+        h.block.set()
+        t.join()
+        self.assertEqual(h.stats.commands['(read)'].latency.n, 1)
+        self.assertEqual(h.stats.commands['*TRG'].latency.n, 1)
+
+    def test_timeout(self):
+        h = _FakeHandle()
+        with self.assertRaises(TimeoutError):
+            h.query_timeout('OUTP? 1')
+        self.assertEqual(h.stats.commands['OUTP?'].n_timeout, 1)
+        # the handle is usable after the exception
+        h.query('OUTP? 1')
+        self.assertEqual(h.stats.commands['OUTP?'].latency.n, 1)
+
+    def test_dump(self):
+        h = _FakeHandle()
+        h.query('*IDN?')
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'stats.json')
+            dump_stats({'Synthesizer': h.stats}, filename)
+            with open(filename, 'r') as fp:
+                d = json.load(fp)
+        self.assertEqual(d['Synthesizer']['*IDN?']['latency']['n'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#! encoding = utf-8
+
+""" Unit test of the scan stitching """
+
+import os
+import datetime
+import unittest
+import tempfile
+import numpy as np
+from PyMMSp.libs import lwa, spb, stitch
+
+
+def _h_info(start_freq, step, avg):
+    return 6, 60, 1., 0.003, 15., 60., 'FM', 2, 0., start_freq, step, avg, ''
+
+
+class TestIntervalTree(unittest.TestCase):
+
+    def test_overlap(self):
+        rng = np.random.default_rng(0)
+        lo = rng.uniform(0, 1000, 300)
+        intervals = [(a, a + w, i) for i, (a, w) in enumerate(zip(lo, rng.uniform(0, 50, 300)))]
+        tree = stitch.IntervalTree(intervals)
+        for a, b in rng.uniform(0, 1100, (100, 2)):
+            a, b = min(a, b), max(a, b)
+            expected = sorted(i for l, h, i in intervals if l <= b and h >= a)
+            self.assertEqual(sorted(tree.overlap(a, b)), expected)
+
+
+class TestStitch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'survey.lwa')
+        date = datetime.datetime(2024, 1, 2)
+        # 3 windows of 101 points, overlapping by 21 points, the middle one with 3 averages
+        for i, (start, avg) in enumerate(((1000., 1), (1008., 3), (1016., 1))):
+            lwa.save_lwa(self.filename, np.full(101, i + 1.), _h_info(start, 0.1, avg), date=date)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_stitch(self):
+        scans = stitch.scans_from_files([self.filename])
+        self.assertEqual([s.avg for s in scans], [1, 3, 1])
+        x, y = next(stitch.stitch(scans))
+        self.assertEqual(len(x), 261)
+        np.testing.assert_allclose(x[[0, -1]], [1000., 1026.])
+        # weighted by the number of averages
+        np.testing.assert_allclose(y[[0, 85, 100, 130, 170, 180, 260]], [1, 1.75, 1.75, 2, 2.25, 2.25, 3])
+        x, y = next(stitch.stitch(scans, weight='equal'))
+        self.assertAlmostEqual(y[85], 1.5)
+        # the chunks give the same spectrum
+        chunks = list(stitch.stitch(scans, weight='equal', chunk_pts=17))
+        self.assertEqual(len(chunks), 16)
+        np.testing.assert_allclose(np.concatenate([c[1] for c in chunks]), y)
+
+    def test_gap(self):
+        scans = stitch.scans_from_files([self.filename])
+        x, y = next(stitch.stitch([scans[0], scans[2]]))
+        self.assertTrue(np.isnan(y[150]))
+        output = os.path.join(self.dir.name, 'stitched.txt')
+        self.assertEqual(stitch.stitch_to_file([scans[0], scans[2]], output), 202)
+        self.assertEqual(np.loadtxt(output, skiprows=1).shape, (202, 2))
+        # binary output, in chunks
+        output = os.path.join(self.dir.name, 'stitched' + spb.SUFFIX)
+        self.assertEqual(stitch.stitch_to_file([scans[0], scans[2]], output, chunk_pts=50), 261)
+        _, hd_pos = spb.scan_header(output)
+        _, columns = spb.read_scan(0, hd_pos, src=output)
+        np.testing.assert_allclose(columns['freq'], x)
+        np.testing.assert_array_equal(columns['lia_x'], y)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+#! encoding = utf-8
+
+""" Unit test of the multi-sweep averaging """
+
+import os
+import unittest
+import tempfile
+import numpy as np
+from PyMMSp.libs.sweep import SweepStack
+
+
+class TestSweepStack(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.sweeps = self.rng.normal(size=(20, 50))
+
+    def test_welford(self):
+        stack = SweepStack(20, 50)
+        for y in self.sweeps:
+            self.assertTrue(stack.add_sweep(y))
+        self.assertTrue(np.allclose(stack.mean, self.sweeps.mean(axis=0)))
+        self.assertTrue(np.allclose(stack.var, self.sweeps.var(axis=0, ddof=1)))
+        self.assertTrue(np.allclose(stack.err, self.sweeps.std(axis=0, ddof=1) / np.sqrt(20)))
+        self.assertTrue(np.array_equal(stack.sweeps, self.sweeps))
+        stack.close()
+
+    def test_reject_drift(self):
+        stack = SweepStack(21, 50, reject_thresh=3)
+        for y in self.sweeps[:10]:
+            stack.add_sweep(y)
+        # a baseline jump is rejected, and kept out of the average
+        self.assertFalse(stack.add_sweep(self.sweeps[10] + 10))
+        for y in self.sweeps[10:]:
+            self.assertTrue(stack.add_sweep(y))
+        self.assertEqual(stack.n_taken, 21)
+        self.assertEqual(stack.n_avg, 20)
+        self.assertFalse(stack.accepted[10])
+        self.assertTrue(np.allclose(stack.mean, self.sweeps.mean(axis=0)))
+        stack.close()
+
+    def test_converged(self):
+        stack = SweepStack(20, 50)
+        for y in self.sweeps:
+            stack.add_sweep(y)
+        self.assertFalse(stack.is_converged(0))
+        self.assertFalse(stack.is_converged(0.01))
+        self.assertTrue(stack.is_converged(1))
+
+    def test_memmap(self):
+        fd, filename = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+        try:
+            stack = SweepStack(20, 50, filename=filename)
+            for y in self.sweeps:
+                stack.add_sweep(y)
+            stack.close()
+            self.assertTrue(np.array_equal(np.load(filename), self.sweeps))
+        finally:
+            del stack
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
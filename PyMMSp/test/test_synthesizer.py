@@ -3,7 +3,9 @@
 """ Unit test of synthesizer API """
 
 import unittest
+from importlib.resources import files
 from PyMMSp.inst.base import Handles
+from PyMMSp.inst.synthesizer import SynSimDecoder
 
 
 class BaseTest(unittest.TestCase):
@@ -220,6 +222,26 @@ class BaseTest(unittest.TestCase):
         stat = self.h.api_syn.get_remote_disp_stat(self.h.h_syn)
         self.assertTrue(stat)
 
+    def test_list_sweep(self):
+        test_list = [1e9, 1.5e9, 2e9]
+        self.h.api_syn.set_list_type(self.h.h_syn, 'LIST')
+        self.assertEqual(self.h.api_syn.get_list_type(self.h.h_syn), 'LIST')
+        self.h.api_syn.set_list_freq(self.h.h_syn, test_list)
+        self.assertEqual(self.h.api_syn.get_list_freq_pts(self.h.h_syn), len(test_list))
+        self.h.api_syn.set_list_trig_source(self.h.h_syn, 'BUS')
+        self.assertEqual(self.h.api_syn.get_list_trig_source(self.h.h_syn), 'BUS')
+        self.h.api_syn.set_init_cont(self.h.h_syn, False)
+        self.assertFalse(self.h.api_syn.get_init_cont(self.h.h_syn))
+        self.h.api_syn.set_freq_mode(self.h.h_syn, 'LIST')
+        self.assertEqual(self.h.api_syn.get_freq_mode(self.h.h_syn), 'LIST')
+        self.h.api_syn.init_sweep(self.h.h_syn)
+        self.assertEqual(self.h.api_syn.get_cw_freq(self.h.h_syn), test_list[0])
+        for freq in test_list[1:]:
+            self.h.api_syn.trigger(self.h.h_syn)
+            self.assertEqual(self.h.api_syn.get_cw_freq(self.h.h_syn), freq)
+        self.h.api_syn.set_freq_mode(self.h.h_syn, 'CW')
+        self.assertEqual(self.h.api_syn.get_freq_mode(self.h.h_syn), 'CW')
+
 
 class TestReal_Agilent_E8257D(BaseTest):
 
@@ -247,9 +269,36 @@ class TestSim_Agilent_E8257D(BaseTest):
         self.h.close_all()
 
 
+class TestSynSimDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.d = SynSimDecoder(files('PyMMSp.inst').joinpath('API_MAP_Agilent_E8257D.yaml'), 'Agilent_E8257D')
+
+    def _query(self, cmd):
+        self.d.interpret(cmd)
+        return self.d.str_out()
+
+    def test_unit_prefix(self):
+        self.d.interpret(':FREQ:CW 1000.000MHZ')
+        self.assertEqual(float(self._query(':FREQ:CW?')), 1e9)
+        self.d.interpret(':LFO:AMPL 10.000MVP')
+        self.assertAlmostEqual(float(self._query(':LFO:AMPL?')), 0.01)
+
+    def test_channel(self):
+        # multi-digit channel, with or without the leading level separator
+        self.d.interpret('AM12:DEPT 30.00')
+        self.assertEqual(float(self._query(':AM12:DEPT?')), 30.)
+        self.assertEqual(len(self.d._info.am_depth_pct), 12)
+
+    def test_queue(self):
+        self.d.interpret(':AM1:SOUR INT1; :AM1:STAT 1; :POW:MODE FIX')
+        self.assertEqual(self._query(':AM1:SOUR?'), 'INT1')
+        self.assertEqual(self._query(':AM1:STAT?'), '1')
+
+
 def load_tests(loader, tests, pattern):
     suite = unittest.TestSuite()
-    for test_class in [TestReal_Agilent_E8257D, TestSim_Agilent_E8257D]:
+    for test_class in [TestReal_Agilent_E8257D, TestSim_Agilent_E8257D, TestSynSimDecoder]:
         tests = loader.loadTestsFromTestCase(test_class)
         suite.addTests(tests)
     return suite
@@ -3,9 +3,10 @@
 from PyQt6 import QtWidgets, QtCore
 from PyQt6.QtGui import QFont
 import pyqtgraph as pg
+import numpy as np
 from PyMMSp.ui import ui_shared
-from PyMMSp.config.config import AbsScanSetting
-from PyMMSp.inst.lockin import SENS_STR, TAU_STR, MODU_MODE
+from PyMMSp.config.config import AbsScanSetting, DATA_FORMATS
+from PyMMSp.inst.lockin import SENS_STR, TAU_STR, MODU_MODE, SAMPLE_RATE, OCTAVE
 
 
 class DialogAbsConfig(QtWidgets.QDialog):
@@ -20,25 +21,78 @@ class DialogAbsConfig(QtWidgets.QDialog):
         # Add top buttons
         self.btnDir = QtWidgets.QPushButton('Save data to directory: ')
         self.lblDir = QtWidgets.QLabel()
+        self.comboFileFmt = QtWidgets.QComboBox()
+        self.comboFileFmt.addItems(DATA_FORMATS)
+        self.comboFileFmt.setToolTip('File format of the data. The .lwa file is written after each sweep')
         self.ckPress = QtWidgets.QCheckBox('Regulate pressure')
+        self.ckBuffer = QtWidgets.QCheckBox('Use lockin buffer')
+        self.ckBuffer.setToolTip('Acquire each reading through the lockin internal buffer '
+                                 'in a single binary transfer')
+        self.comboSampleRate = QtWidgets.QComboBox()
+        # the last 'Trigger' option is not supported
+        self.comboSampleRate.addItems(SAMPLE_RATE[:-1])
+        self.comboSampleRate.setCurrentIndex(13)
+        self.ckListSweep = QtWidgets.QCheckBox('Synthesizer list sweep')
+        self.ckListSweep.setToolTip('Upload the frequency table to the synthesizer once '
+                                    'and step through it with bus triggers')
+        self.ckMultiSweep = QtWidgets.QCheckBox('Average over sweeps')
+        self.ckMultiSweep.setToolTip('Take each point once per sweep and average up/down sweeps, '
+                                     'instead of averaging at each point')
+        self.inpRejectThresh = ui_shared.create_double_spin_box(0, minimum=0, dec=1, width=80)
+        self.inpRejectThresh.setToolTip('Reject a sweep if its residual against the running mean '
+                                        'exceeds this multiple of the noise. 0 disables rejection')
+        self.inpStopErr = ui_shared.create_double_spin_box(0, minimum=0, dec=6, width=100)
+        self.inpStopErr.setToolTip('Stop averaging when the standard error of every point '
+                                   'falls below this value. 0 disables early stop')
+        self.comboOctave = QtWidgets.QComboBox()
+        self.comboOctave.addItems(OCTAVE)
+        self.ckAutoDwell = QtWidgets.QCheckBox('Auto dwell')
+        self.ckAutoDwell.setToolTip('Compute the dwell time from the time constant, the filter slope '
+                                    'and the frequency step, instead of the fixed dwell time')
+        self.inpSettleTol = ui_shared.create_double_spin_box(0.01, minimum=0.0001, maximum=1, step=0.01, dec=4, width=80)
+        self.inpSettleTol.setToolTip('Allowed settling error, as a fraction of the change over a frequency step')
+        self.ckWatchSettle = QtWidgets.QCheckBox('Watch settling')
+        self.ckWatchSettle.setToolTip('Read the lockin output during the auto dwell, '
+                                      'and proceed as soon as it settles')
         topButtonLayout = QtWidgets.QHBoxLayout()
         topButtonLayout.setAlignment(QtCore.Qt.AlignmentFlag.AlignLeft)
         topButtonLayout.addWidget(self.btnDir)
         topButtonLayout.addWidget(self.lblDir)
+        topButtonLayout.addWidget(QtWidgets.QLabel('File format'))
+        topButtonLayout.addWidget(self.comboFileFmt)
         topButtons = QtWidgets.QWidget()
         topButtons.setLayout(topButtonLayout)
 
         top2Layout = QtWidgets.QHBoxLayout()
         top2Layout.setAlignment(QtCore.Qt.AlignmentFlag.AlignLeft)
         top2Layout.addWidget(self.ckPress)
+        top2Layout.addWidget(self.ckBuffer)
+        top2Layout.addWidget(QtWidgets.QLabel('Sample rate'))
+        top2Layout.addWidget(self.comboSampleRate)
+        top2Layout.addWidget(self.ckListSweep)
+        top2Layout.addWidget(self.ckMultiSweep)
+        top2Layout.addWidget(QtWidgets.QLabel('Reject (σ)'))
+        top2Layout.addWidget(self.inpRejectThresh)
+        top2Layout.addWidget(QtWidgets.QLabel('Stop at error'))
+        top2Layout.addWidget(self.inpStopErr)
+        top2Layout.addWidget(QtWidgets.QLabel('Filter slope'))
+        top2Layout.addWidget(self.comboOctave)
+        top2Layout.addWidget(self.ckAutoDwell)
+        top2Layout.addWidget(QtWidgets.QLabel('Settle tol'))
+        top2Layout.addWidget(self.inpSettleTol)
+        top2Layout.addWidget(self.ckWatchSettle)
 
         # Add bottom buttons
         cancelButton = QtWidgets.QPushButton(ui_shared.btn_label('reject'))
         acceptButton = QtWidgets.QPushButton(ui_shared.btn_label('confirm'))
         acceptButton.setDefault(True)
         self.btnEstimate = QtWidgets.QPushButton('Estimate Time')
+        self.ckOptimize = QtWidgets.QCheckBox('Optimize order')
+        self.ckOptimize.setToolTip('Reorder the entries to group the same instrument configuration '
+                                   'and to minimize frequency jumps')
         bottomButtonLayout = QtWidgets.QHBoxLayout()
         bottomButtonLayout.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight)
+        bottomButtonLayout.addWidget(self.ckOptimize)
         bottomButtonLayout.addWidget(self.btnEstimate)
         bottomButtonLayout.addWidget(cancelButton)
         bottomButtonLayout.addWidget(acceptButton)
@@ -124,6 +178,17 @@ class DialogAbsConfig(QtWidgets.QDialog):
         # also need to check if the pressure regulation is checked
         for setting in a_list:
             setting.is_press = self.ckPress.isChecked()
+            setting.is_lockin_buffer = self.ckBuffer.isChecked()
+            setting.sample_rate_idx = self.comboSampleRate.currentIndex()
+            setting.is_list_sweep = self.ckListSweep.isChecked()
+            setting.is_multi_sweep = self.ckMultiSweep.isChecked()
+            setting.reject_thresh = self.inpRejectThresh.value()
+            setting.stop_err = self.inpStopErr.value()
+            setting.octave_idx = self.comboOctave.currentIndex()
+            setting.is_auto_dwell = self.ckAutoDwell.isChecked()
+            setting.settle_tol = self.inpSettleTol.value()
+            setting.is_watch_settle = self.ckWatchSettle.isChecked()
+            setting.file_fmt = self.comboFileFmt.currentText()
         return a_list
 
     def add_item(self):
@@ -239,6 +304,19 @@ class DialogAbsScan(QtWidgets.QDialog):
         self.inpModFreq = ui_shared.create_double_spin_box(0, minimum=0, dec=3)
         self.inpModAmp = ui_shared.create_double_spin_box(0, minimum=0, dec=2)
         self.inpACGain = ui_shared.create_int_spin_box(0, minimum=0, maximum=72)
+        self.ckBuffer = QtWidgets.QCheckBox('Use lockin buffer')
+        self.comboSampleRate = QtWidgets.QComboBox()
+        self.comboSampleRate.addItems(SAMPLE_RATE[:-1])
+        self.comboSampleRate.setCurrentIndex(13)
+        self.ckListSweep = QtWidgets.QCheckBox('Synthesizer list sweep')
+        self.ckMultiSweep = QtWidgets.QCheckBox('Average over sweeps')
+        self.inpRejectThresh = ui_shared.create_double_spin_box(0, minimum=0, dec=1, width=125)
+        self.inpStopErr = ui_shared.create_double_spin_box(0, minimum=0, dec=6, width=125)
+        self.comboOctave = QtWidgets.QComboBox()
+        self.comboOctave.addItems(OCTAVE)
+        self.ckAutoDwell = QtWidgets.QCheckBox('Auto dwell')
+        self.inpSettleTol = ui_shared.create_double_spin_box(0.01, minimum=0.0001, maximum=1, step=0.01, dec=4, width=125)
+        self.ckWatchSettle = QtWidgets.QCheckBox('Watch settling')
         self.boxPress = QtWidgets.QGroupBox('Regulate Pressure')
         self.boxPress.setCheckable(True)
         boxPressLayout = QtWidgets.QFormLayout()
@@ -270,7 +348,21 @@ class DialogAbsScan(QtWidgets.QDialog):
         commonWidgetLayout.addWidget(self.inpModAmp, 5, 2, 1, 2)
         commonWidgetLayout.addWidget(QtWidgets.QLabel('AC Gain (dB)'), 6, 0, 1, 2)
         commonWidgetLayout.addWidget(self.inpACGain, 6, 2, 1, 2)
-        commonWidgetLayout.addWidget(self.boxPress, 7, 0, 1, 4)
+        commonWidgetLayout.addWidget(self.ckBuffer, 7, 0, 1, 2)
+        commonWidgetLayout.addWidget(self.comboSampleRate, 7, 2, 1, 2)
+        commonWidgetLayout.addWidget(self.ckListSweep, 8, 0, 1, 2)
+        commonWidgetLayout.addWidget(self.ckMultiSweep, 8, 2, 1, 2)
+        commonWidgetLayout.addWidget(QtWidgets.QLabel('Reject (σ)'), 9, 0)
+        commonWidgetLayout.addWidget(self.inpRejectThresh, 9, 1)
+        commonWidgetLayout.addWidget(QtWidgets.QLabel('Stop at error'), 9, 2)
+        commonWidgetLayout.addWidget(self.inpStopErr, 9, 3)
+        commonWidgetLayout.addWidget(QtWidgets.QLabel('Filter slope'), 10, 0)
+        commonWidgetLayout.addWidget(self.comboOctave, 10, 1)
+        commonWidgetLayout.addWidget(self.ckAutoDwell, 10, 2)
+        commonWidgetLayout.addWidget(self.ckWatchSettle, 10, 3)
+        commonWidgetLayout.addWidget(QtWidgets.QLabel('Settle tol'), 11, 0)
+        commonWidgetLayout.addWidget(self.inpSettleTol, 11, 1)
+        commonWidgetLayout.addWidget(self.boxPress, 12, 0, 1, 4)
 
         quickConfigBtnLayout = QtWidgets.QHBoxLayout()
         self.btnStart = QtWidgets.QPushButton('Start')
@@ -363,11 +455,13 @@ class DialogAbsScan(QtWidgets.QDialog):
         self._curveThisInTotal.setPen(pg.mkPen(255, 182, 47))
         self._curveThis = pg.PlotCurveItem()
         self._curveThis.setPen(pg.mkPen(255, 182, 47))
+        self._errTotal = pg.ErrorBarItem(x=np.zeros(0), y=np.zeros(0), pen=pg.mkPen(150, 150, 150))
         canvasPress = pg.PlotWidget()
         self._curvePress = pg.PlotCurveItem()
         self._curvePress.setPen(pg.mkPen(175, 205, 255))
         self._canvasTotal.addItem(self._curveTotal)
         self._canvasTotal.addItem(self._curveThisInTotal)
+        self._canvasTotal.addItem(self._errTotal)
         self._canvasThis.addItem(self._curveThis)
         canvasPress.addItem(self._curvePress)
         self._canvasTotal.getPlotItem().setTitle('Overall Scan')
@@ -428,7 +522,17 @@ class DialogAbsScan(QtWidgets.QDialog):
             modu_amp=self.inpModAmp.value(),
             is_press=self.boxPress.isChecked(),
             press=self.inpPress.value(),
-            press_tol=self.inpPressTol.value()
+            press_tol=self.inpPressTol.value(),
+            is_lockin_buffer=self.ckBuffer.isChecked(),
+            sample_rate_idx=self.comboSampleRate.currentIndex(),
+            is_list_sweep=self.ckListSweep.isChecked(),
+            is_multi_sweep=self.ckMultiSweep.isChecked(),
+            reject_thresh=self.inpRejectThresh.value(),
+            stop_err=self.inpStopErr.value(),
+            octave_idx=self.comboOctave.currentIndex(),
+            is_auto_dwell=self.ckAutoDwell.isChecked(),
+            settle_tol=self.inpSettleTol.value(),
+            is_watch_settle=self.ckWatchSettle.isChecked(),
         )
 
     def plot_this(self, x, y):
@@ -437,6 +541,11 @@ class DialogAbsScan(QtWidgets.QDialog):
     def plot_total(self, x, y):
         self._curveTotal.setData(x, y)
 
+    def plot_avg(self, x, y, err):
+        """ Plot the running mean of the sweeps with per-point error bars """
+        self._curveTotal.setData(x, y)
+        self._errTotal.setData(x=x, y=y, height=2 * np.nan_to_num(err))
+
     def plot_press(self, x, y):
         self._curvePress.setData(x, y)
 
@@ -770,6 +770,60 @@ class DialogCloseInst(QtWidgets.QDialog):
         okButton.clicked.connect(self.accept)
 
 
+class DialogDiagnostics(QtWidgets.QDialog):
+    """ Dialog window for the communication statistics of the instruments """
+
+    _HEADERS = ('Instrument', 'Command', 'Count', 'Mean (ms)', 'p50 (ms)', 'p99 (ms)',
+                'Max (ms)', 'Total (s)', 'Sent (B)', 'Recv (B)', 'Timeouts', 'Errors')
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumWidth(1000)
+        self.setMinimumHeight(400)
+        self.setWindowTitle('Communication Diagnostics')
+        self.setWindowFlag(QtCore.Qt.WindowType.Window)
+
+        self.table = QtWidgets.QTableWidget()
+        self.table.setColumnCount(len(self._HEADERS))
+        self.table.setHorizontalHeaderLabels(self._HEADERS)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+
+        self.btnRefresh = QtWidgets.QPushButton('Refresh')
+        self.btnClear = QtWidgets.QPushButton('Clear')
+        self.btnSave = QtWidgets.QPushButton('Save JSON')
+        btnLayout = QtWidgets.QHBoxLayout()
+        btnLayout.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight)
+        btnLayout.addWidget(self.btnRefresh)
+        btnLayout.addWidget(self.btnClear)
+        btnLayout.addWidget(self.btnSave)
+
+        mainLayout = QtWidgets.QVBoxLayout()
+        mainLayout.addWidget(self.table)
+        mainLayout.addLayout(btnLayout)
+        self.setLayout(mainLayout)
+
+    def set_stats(self, stats):
+        """ Fill the table with {inst_type: InstStats} """
+        self.table.setSortingEnabled(False)
+        rows = [(inst_type, cmd, s) for inst_type, inst_stats in stats.items()
+                for cmd, s in inst_stats.commands.items()]
+        self.table.setRowCount(len(rows))
+        for row, (inst_type, cmd, s) in enumerate(rows):
+            h = s.latency
+            values = (inst_type, cmd, h.n, h.mean * 1e3, h.percentile(50) * 1e3, h.percentile(99) * 1e3,
+                      h.max * 1e3, h.total, s.bytes_sent, s.bytes_recv, s.n_timeout, s.n_error)
+            for col, value in enumerate(values):
+                item = QtWidgets.QTableWidgetItem()
+                if isinstance(value, float):
+                    item.setData(QtCore.Qt.ItemDataRole.DisplayRole, round(value, 3))
+                else:
+                    item.setData(QtCore.Qt.ItemDataRole.DisplayRole, value)
+                self.table.setItem(row, col, item)
+        self.table.setSortingEnabled(True)
+        self.table.resizeColumnsToContents()
+
+
 class DialogSyn(QtWidgets.QDialog):
     """ Dialog window for displaying full synthesizer settings. """
 
@@ -1105,7 +1159,7 @@ class LWAParserDialog(QtWidgets.QDialog):
         self.mainLayout.addWidget(QtWidgets.QLabel('Source file: {:s}'.format(filename)))
 
         # read lwa batch scan entry from file
-        self.entry_settings, self.hd_line_num = lwa.scan_header(filename)
+        self.entry_settings, self.hd_pos = lwa.scan_header(filename)
 
         if self.entry_settings:
             # set top buttons
@@ -1197,7 +1251,7 @@ class LWAParserDialog(QtWidgets.QDialog):
         """ Preview single scan """
 
         id_ = self.previewButtonGroup.checkedId()
-        preview_data = lwaparser.preview(id_, self.hd_line_num, src=self.filename)
+        preview_data = lwa.preview(id_, self.hd_pos, src=self.filename)
         self.preview_win.setData(preview_data)
         self.preview_win.show()
 
@@ -1236,7 +1290,7 @@ class LWAParserDialog(QtWidgets.QDialog):
                              'Output file shall not overwrite source file')
             msg.exec()
         elif output_file:
-            lwaparser.export_lwa(list(set(self.entry_id_to_export)), self.hd_line_num, src=self.filename, output=output_file)
+            lwa.export_lwa(list(set(self.entry_id_to_export)), self.hd_pos, src=self.filename, output=output_file)
         else:
             pass
 
@@ -1257,7 +1311,7 @@ class LWAParserDialog(QtWidgets.QDialog):
                              'Output file shall not overwrite source file')
             msg.exec()
         elif output_dir:
-            lwaparser.export_xy(list(set(self.entry_id_to_export)), self.hd_line_num, src=self.filename, output_dir=output_dir)
+            lwa.export_xy(list(set(self.entry_id_to_export)), self.hd_pos, src=self.filename, output_dir=output_dir)
         else:
             pass
 
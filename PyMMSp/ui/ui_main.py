@@ -24,6 +24,21 @@ NUM_MONITORS = 6        # number of monitors. later this should be moved to conf
 class MainUI(QtWidgets.QWidget):
     """ Main UI Widget """
 
+    # dialogs are built on demand, see ui_shared.LazyDialog
+    dAbsScan = ui_shared.LazyDialog(ui_daq.DialogAbsScan)
+    dAbsConfig = ui_shared.LazyDialog(ui_daq.DialogAbsConfig)
+    dConnInst = ui_shared.LazyDialog(ui_dialog.DialogConnInst)
+    dSyn = ui_shared.LazyDialog(ui_dialog.DialogSyn)
+    dLockin = ui_shared.LazyDialog(ui_dialog.DialogLockin)
+    dOscillo = ui_shared.LazyDialog(ui_dialog.DialogOscillo)
+    dGauge = ui_shared.LazyDialog(ui_dialog.DialogGauge)
+    dFlow = ui_shared.LazyDialog(ui_dialog.DialogFlow)
+    dGCF = ui_shared.LazyDialog(ui_dialog.DialogGCF)
+    dAWG = ui_shared.LazyDialog(ui_dialog.DialogAWG)
+    dPowerSupp = ui_shared.LazyDialog(ui_dialog.DialogPowerSupp)
+    dCloseInst = ui_shared.LazyDialog(ui_dialog.DialogCloseInst)
+    dDiag = ui_shared.LazyDialog(ui_dialog.DialogDiagnostics)
+
     def __init__(self, parent=None):
         super().__init__(parent)
 
@@ -45,9 +60,6 @@ class MainUI(QtWidgets.QWidget):
 
         self._monitors = tuple(Monitor(self) for _ in range(NUM_MONITORS))
 
-        self.dAbsScan = ui_daq.DialogAbsScan(self)
-        self.dAbsConfig = ui_daq.DialogAbsConfig(self)
-
         panelLayout = QtWidgets.QVBoxLayout()
         panelLayout.setSpacing(3)
         panelLayout.addWidget(self.synPanel)
@@ -76,25 +88,21 @@ class MainUI(QtWidgets.QWidget):
         self.msgWarn = ui_shared.MsgWarning(self, 'Warning')
         self.msgInfo = ui_shared.MsgInfo(self, 'Info')
 
-        self.dConnInst = ui_dialog.DialogConnInst(self)
-        self.dSyn = ui_dialog.DialogSyn(self)
-        self.dLockin = ui_dialog.DialogLockin(self)
-        self.dOscillo = ui_dialog.DialogOscillo(self)
-        self.dGauge = ui_dialog.DialogGauge(self)
-        self.dFlow = ui_dialog.DialogFlow(self)
-        self.dGCF = ui_dialog.DialogGCF(self)
-        self.dAWG = ui_dialog.DialogAWG(self)
-        self.dPowerSupp = ui_dialog.DialogPowerSupp(self)
-        self.dCloseInst = ui_dialog.DialogCloseInst(self)
-
-        self.synPanel.btnConfig.clicked.connect(self.dSyn.show)
-        self.lockinPanel.btnConfig.clicked.connect(self.dLockin.show)
-        self.oscilloPanel.btnConfig.clicked.connect(self.dOscillo.show)
-        self.awgPanel.btnConfig.clicked.connect(self.dAWG.show)
-        self.dcPanel.btnConfig.clicked.connect(self.dPowerSupp.show)
-        self.flowPanel.btnConfig.clicked.connect(self.dFlow.show)
-        self.gaugePanel.btnConfig.clicked.connect(self.dGauge.show)
-
+        self.synPanel.btnConfig.clicked.connect(lambda: self.dSyn.show())
+        self.lockinPanel.btnConfig.clicked.connect(lambda: self.dLockin.show())
+        self.oscilloPanel.btnConfig.clicked.connect(lambda: self.dOscillo.show())
+        self.awgPanel.btnConfig.clicked.connect(lambda: self.dAWG.show())
+        self.dcPanel.btnConfig.clicked.connect(lambda: self.dPowerSupp.show())
+        self.flowPanel.btnConfig.clicked.connect(lambda: self.dFlow.show())
+        self.gaugePanel.btnConfig.clicked.connect(lambda: self.dGauge.show())
+
+    def on_dialog(self, name, slot):
+        """ Call slot(dialog) once the dialog self.name is built """
+        ui_shared.on_dialog(self, name, slot)
+
+    def built_dialog(self, name):
+        """ The dialog self.name if it is already built, else None """
+        return self.__dict__.get(name)
 
     def get_monitor(self, i):
         # return the i-th monitor
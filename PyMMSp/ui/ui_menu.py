@@ -23,6 +23,9 @@ class MenuBar(QMenuBar):
         self.instCloseAction = QAction('Close Instrument', self)
         self.instCloseAction.setStatusTip('Close individual instrument')
 
+        self.instDiagAction = QAction('Communication Diagnostics', self)
+        self.instDiagAction.setStatusTip('Latency and traffic statistics of each instrument command')
+
         # scan actions
         self.scanAbsAction = QAction('Absorption Scan - Broadband Mode', self)
         self.scanAbsAction.setShortcut('Ctrl+Shift+B')
@@ -53,6 +56,7 @@ class MenuBar(QMenuBar):
         menuInst = self.addMenu('&Instrument')
         menuInst.addAction(self.instSelAction)
         menuInst.addAction(self.instCloseAction)
+        menuInst.addAction(self.instDiagAction)
         menuScan = self.addMenu('&Scan')
         menuScan.addAction(self.scanAbsAction)
         menuScan.addAction(self.scanCPAction)
@@ -26,6 +26,44 @@ def btn_label(btn_type):
         return 'A Button'
 
 
+class LazyDialog:
+    """ Dialog attribute of a widget, built on the first access.
+    The dialog is then stored in the instance __dict__, which shadows this descriptor,
+    so later accesses cost nothing. Slots registered with on_dialog() are called
+    with the dialog once it is built, so that the controllers can connect
+    their signals without building the dialog at startup.
+
+        class MainUI(QtWidgets.QWidget):
+            dSyn = LazyDialog(ui_dialog.DialogSyn)
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._name = ''
+
+    def __set_name__(self, owner, name):
+        self._name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        d = self._factory(obj)
+        obj.__dict__[self._name] = d
+        for slot in obj.__dict__.setdefault('_dialog_slots', {}).pop(self._name, ()):
+            slot(d)
+        return d
+
+
+def on_dialog(obj, name, slot):
+    """ Call slot(dialog) once the LazyDialog obj.name is built,
+    or right away if it is already built """
+
+    if name in obj.__dict__:
+        slot(obj.__dict__[name])
+    else:
+        obj.__dict__.setdefault('_dialog_slots', {}).setdefault(name, []).append(slot)
+
+
 class InstStatus(QtWidgets.QMessageBox):
     """ Message box of instrument communication status. Silent if communication
         is successful. Pop up error message in pyvisa.constants.StatusCode
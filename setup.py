@@ -22,6 +22,6 @@ setup(name='PyMMSp',
             'lmfit>=1.0.0',
             'pyvisa>=1.14',
         ],
-      python_requires='>=3.8',
+      python_requires='>=3.9',
       license='MIT',
 )